@@ -1,2 +1,2 @@
-from .online import WILDCARD_EXPLICIT_DELEGATION, Analyst, OnlineDomainNameAnalysis, PrivateAnalyst, RecursiveAnalyst, PrivateRecursiveAnalyst, NetworkConnectivityException, DNS_RAW_VERSION
+from .online import WILDCARD_EXPLICIT_DELEGATION, ANALYSIS_WAIT_TIMEOUT, Analyst, AnalysisNotifier, AnalysisStore, BoundedAnalysisCache, DependencyExecutor, OnlineDomainNameAnalysis, PreviousQueries, QueryReuseStats, PrivateAnalyst, RecursiveAnalyst, PrivateRecursiveAnalyst, SharedAnalysisCache, NetworkConnectivityException, DNS_RAW_VERSION
 from .offline import OfflineDomainNameAnalysis, TTLAgnosticOfflineDomainNameAnalysis, DNS_PROCESSED_VERSION
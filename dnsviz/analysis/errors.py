@@ -1788,3 +1788,16 @@ class CNAMEWithOtherData(ZoneDataError):
     code = 'CNAME_WITH_OTHER_DATA'
     required_params = ['name']
     references = ['RFC 2181, Sec. 10.1']
+
+class AnalysisError(DomainNameAnalysisError):
+    pass
+
+class AnalysisPartial(AnalysisError):
+    '''
+    >>> e = AnalysisPartial()
+    >>> e.description
+    'The analysis of the name was cut short by its time limit (see the -B option to dnsviz probe), so some diagnostic queries were not issued, and the results might be incomplete.'
+    '''
+    _abstract = False
+    description_template = "The analysis of the name was cut short by its time limit (see the -B option to dnsviz probe), so some diagnostic queries were not issued, and the results might be incomplete."
+    code = 'ANALYSIS_PARTIAL'
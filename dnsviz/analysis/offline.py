@@ -102,6 +102,7 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
         self.dnssec_algorithms_digest_in_dlv = set()
 
         self.status = None
+        self.name_warnings = None
         self.yxdomain = None
         self.yxrrset = None
         self.yxrrset_proper = None
@@ -510,11 +511,16 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
                     delegation_status = Status.delegation_status_mapping[parent_obj.delegation_status[dns.rdatatype.DS]]
                     delegation_warnings = [w.terse_description for w in parent_obj.delegation_warnings[dns.rdatatype.DS]]
                     delegation_errors = [e.terse_description for e in parent_obj.delegation_errors[dns.rdatatype.DS]]
-            if parent_obj.parent is not None:
+            # the DS query might have been skipped, if the analysis was
+            # partial
+            if parent_obj.parent is not None and (parent_obj.name, dns.rdatatype.DS) in parent_obj.queries:
                 ds_response_info = parent_obj.get_response_info(parent_obj.name, dns.rdatatype.DS)
             else:
                 ds_response_info = None
 
+            if parent_obj.name_warnings:
+                zone_warnings = [w.terse_description for w in parent_obj.name_warnings] + zone_warnings
+
             name_tup = (fmt.humanize_name(parent_obj.name), zone_status, zone_warnings, zone_errors, delegation_status, delegation_warnings, delegation_errors, [])
             tup.append(name_tup)
 
@@ -554,7 +560,10 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
         # in this case, or in the case where the name is not a zone (and
         # thus changes), we create a new tuple.
         if parent_obj is None or response_info.qname != parent_obj.name or name_tup is None:
-            name_tup = (fmt.humanize_name(response_info.qname), None, [], [], None, [], [], [])
+            name_warnings = []
+            if response_info.name_obj.name == response_info.qname and response_info.name_obj.name_warnings:
+                name_warnings = [w.terse_description for w in response_info.name_obj.name_warnings]
+            name_tup = (fmt.humanize_name(response_info.qname), None, name_warnings, [], None, [], [], [])
             tup.append(name_tup)
 
         for response_info in response_info_list:
@@ -612,6 +621,12 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
             response_info_list = [response_info_map[qname][r] for r in rdtypes]
             tuples.extend(self._serialize_status_simple(response_info_list, processed))
 
+        # if the analysis was partial, then the queries for the name might
+        # have been skipped, but its warnings are still shown
+        if not tuples and self.name_warnings and (self.name, -1) not in processed:
+            processed.add((self.name, -1))
+            tuples.append((fmt.humanize_name(self.name), None, [w.terse_description for w in self.name_warnings], [], None, [], [], []))
+
         return tuples
 
     def _rdtypes_for_analysis_level(self, level):
@@ -830,6 +845,9 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
             return
 
         self.status = Status.NAME_STATUS_INDETERMINATE
+        self.name_warnings = []
+        if self.partial:
+            self.name_warnings.append(Errors.AnalysisPartial())
         self.yxdomain = set()
         self.yxrrset_proper = set()
         self.yxrrset = set()
@@ -1465,7 +1483,12 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
         names_from_child = self.get_ns_names_in_child()
         names_from_parent = self.get_ns_names_in_parent()
 
-        auth_ns_response = self.queries[(self.name, dns.rdatatype.NS)].is_valid_complete_authoritative_response_any()
+        # if the analysis was partial, then the NS query and the resolution
+        # of NS names might have been skipped
+        if (self.name, dns.rdatatype.NS) in self.queries:
+            auth_ns_response = self.queries[(self.name, dns.rdatatype.NS)].is_valid_complete_authoritative_response_any()
+        else:
+            auth_ns_response = False
 
         glue_mapping = self.get_glue_ip_mapping()
         auth_mapping = self.get_auth_ns_ip_mapping()
@@ -1486,7 +1509,8 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
             # if name resolution resulted in an error (other than NXDOMAIN)
             if name not in auth_mapping:
                 auth_addrs = set()
-                names_error_resolving.append(name)
+                if not self.partial:
+                    names_error_resolving.append(name)
             else:
                 auth_addrs = auth_mapping[name]
                 # if name resolution completed successfully, but the response was
@@ -1614,6 +1638,11 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
         ips_from_child_ipv4 = [x for x in ips_from_child if x.version == 4]
         ips_from_child_ipv6 = [x for x in ips_from_child if x.version == 6]
 
+        # if the analysis was partial, then the addresses of NS names might
+        # not have been looked up
+        if self.partial:
+            return
+
         if not (ips_from_parent_ipv4 or ips_from_child_ipv4) and warn_no_ipv4:
             if ips_from_parent_ipv4:
                 reference = 'child'
@@ -1668,14 +1697,22 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
         self.delegation_errors[rdtype] = []
         self.delegation_status[rdtype] = None
 
+        # the DS and DNSKEY queries might have been skipped, if the analysis
+        # was partial, in which case the absence of their responses is not
+        # reported as an error
+        ds_skipped = False
         try:
             ds_rrset_answer_info = self.queries[(name, rdtype)].answer_info
         except KeyError:
             # zones should have DS queries
-            if self.is_zone():
+            if self.is_zone() and self.partial:
+                ds_skipped = True
+                ds_rrset_answer_info = []
+            elif self.is_zone():
                 raise
             else:
                 return
+        dnskey_skipped = self.partial and (self.name, dns.rdatatype.DNSKEY) not in self.queries
 
         secure_path = False
 
@@ -1814,16 +1851,16 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
                 for (server,client,response) in algs_signing_sep:
                     for alg in ds_algs.difference(algs_signing_sep[(server,client,response)]):
                         Errors.DomainNameAnalysisError.insert_into_list(Errors.MissingSEPForAlg(algorithm=alg, source=dns.rdatatype.to_text(rdtype)), self.delegation_errors[rdtype], server, client, response)
-            else:
+            elif not dnskey_skipped:
                 Errors.DomainNameAnalysisError.insert_into_list(Errors.NoSEP(source=dns.rdatatype.to_text(rdtype)), self.delegation_errors[rdtype], None, None, None)
 
         if self.delegation_status[rdtype] is None:
             if ds_rrset_answer_info:
-                if secure_path:
+                if secure_path and not dnskey_skipped:
                     self.delegation_status[rdtype] = Status.DELEGATION_STATUS_BOGUS
                 else:
                     self.delegation_status[rdtype] = Status.DELEGATION_STATUS_INSECURE
-            elif self.parent.signed:
+            elif self.parent.signed and not ds_skipped:
                 self.delegation_status[rdtype] = Status.DELEGATION_STATUS_BOGUS
                 for nsec_status_list in [self.nxdomain_status[n] for n in self.nxdomain_status if n.qname == name and n.rdtype == dns.rdatatype.DS] + \
                         [self.nodata_status[n] for n in self.nodata_status if n.qname == name and n.rdtype == dns.rdatatype.DS]:
@@ -1849,7 +1886,7 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
             if self.delegation_status[rdtype] == Status.DELEGATION_STATUS_INSECURE:
                 self.delegation_status[rdtype] = Status.DELEGATION_STATUS_LAME
 
-        if rdtype == dns.rdatatype.DS:
+        if rdtype == dns.rdatatype.DS and not ds_skipped:
             try:
                 ds_nxdomain_info = [x for x in self.queries[(name, rdtype)].nxdomain_info if x.qname == name and x.rdtype == dns.rdatatype.DS][0]
             except IndexError:
@@ -2658,6 +2695,8 @@ class OfflineDomainNameAnalysis(OnlineDomainNameAnalysis):
         d[name_str] = OrderedDict()
         if loglevel <= logging.INFO or erroneous_status:
             d[name_str]['status'] = Status.name_status_mapping[self.status]
+        if self.name_warnings and loglevel <= logging.WARNING:
+            d[name_str]['warnings'] = [w.serialize(consolidate_clients=consolidate_clients, html_format=html_format) for w in self.name_warnings]
 
         d[name_str]['queries'] = OrderedDict()
         query_keys = list(self.queries.keys())
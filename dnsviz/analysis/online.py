@@ -27,8 +27,12 @@
 
 from __future__ import unicode_literals
 
+import collections
+import contextlib
 import datetime
+import hashlib
 import logging
+import pickle
 import random
 import re
 import socket
@@ -36,6 +40,7 @@ import sys
 import threading
 import time
 import uuid
+import weakref
 
 # minimal support for python2.6
 try:
@@ -57,6 +62,27 @@ _logger = logging.getLogger(__name__)
 
 DNS_RAW_VERSION = 1.1
 
+# the default maximum number of dependencies analyzed concurrently
+DEFAULT_DEPENDENCY_WORKERS = 8
+
+# the longest a waiter for an analysis goes without re-checking the analysis
+# cache, in case a notification is lost (e.g., because the process performing
+# the analysis died)
+ANALYSIS_WAIT_TIMEOUT = 5
+
+# the analyses of names at this depth or above (i.e., the root and TLDs) are
+# not evicted from a bounded analysis cache, unless they expire
+DEFAULT_CACHE_KEEP_LEVEL = 2
+
+# the minimum time (in seconds) that a complete analysis is kept in a bounded
+# analysis cache before it expires, even if records in it expire sooner
+# (e.g., those with a TTL of 0), so those waiting on it can retrieve it
+DEFAULT_CACHE_MIN_RETENTION = 30
+
+# the maximum number of deserialized analyses of names below the keep level
+# kept by each process sharing an unbounded analysis cache
+DEFAULT_CACHE_MAX_LOCAL = 10000
+
 class NetworkConnectivityException(Exception):
     pass
 
@@ -119,6 +145,19 @@ class OnlineDomainNameAnalysis(object):
         self.analysis_start = None
         self.analysis_end = None
 
+        # Whether the analysis was cut short by the deadline of the analyst,
+        # such that some queries were not issued (serialized).
+        self.partial = False
+
+        # The servers to which diagnostic queries were sent, if they were a
+        # sample of those authoritative for the zone (serialized).
+        self.sampled_servers = None
+
+        # The time spent in each phase of the analysis, and the number of
+        # queries issued, if recorded by the analyst (serialized).
+        self.timings = None
+        self.queries_issued = 0
+
         # The record type queried with the name when eliciting a referral.
         # (serialized).
         self.referral_rdtype = None
@@ -710,7 +749,45 @@ class OnlineDomainNameAnalysis(object):
             return [], None
         return self.parent.get_ns_name_for_ip(ip)
 
-    def serialize(self, d=None, meta_only=False, trace=None):
+    def get_expiration(self):
+        '''Return the time (as a timestamp) at which the first of the RRsets
+        in the answer and authority sections of the responses for this name
+        expires, measured from the end of the analysis, or None if there are
+        no such RRsets.'''
+
+        if self.analysis_end is None:
+            return None
+
+        min_ttl = None
+        for query in self.queries.values():
+            for q in query.queries.values():
+                for server in q.responses:
+                    for response in q.responses[server].values():
+                        if response.message is None:
+                            continue
+                        for rrset in response.message.answer + response.message.authority:
+                            if min_ttl is None or rrset.ttl < min_ttl:
+                                min_ttl = rrset.ttl
+        if min_ttl is None:
+            return None
+        return fmt.datetime_to_timestamp(self.analysis_end) + min_ttl
+
+    def add_timing(self, phase, elapsed):
+        if self.timings is None:
+            self.timings = OrderedDict()
+        self.timings[phase] = self.timings.get(phase, 0) + elapsed
+
+    def serialize(self, d=None, meta_only=False, trace=None, exclude=None, excluded=None):
+        '''Serialize the analysis, and those it refers to, into d.  If exclude
+        is specified, it maps names (as canonical text) that were serialized
+        elsewhere (e.g., earlier in the same stream) to whether that analysis
+        was provisional, i.e., a stub or partial.  Those are not serialized
+        again, unless this one is complete and that was provisional.
+        Likewise, a partial analysis already in d is replaced by a complete
+        one (e.g., redone by an analysis with time left).  If excluded is
+        specified, the names not serialized for that reason are added to it
+        (a set).'''
+
         if d is None:
             d = OrderedDict()
 
@@ -721,19 +798,24 @@ class OnlineDomainNameAnalysis(object):
             return
 
         name_str = lb2s(self.name.canonicalize().to_text())
-        if name_str in d:
+        provisional = self.stub or self.partial
+        if name_str in d and (provisional or not d[name_str].get('partial', False)):
+            return
+        if exclude is not None and name_str in exclude and (provisional or not exclude[name_str]):
+            if excluded is not None:
+                excluded.add(name_str)
             return
 
         # serialize dependencies first because their version of the analysis
         # might be the most complete (considering re-dos)
-        self._serialize_dependencies(d, meta_only, trace)
+        self._serialize_dependencies(d, meta_only, trace, exclude, excluded)
 
         if self.parent is not None:
-            self.parent.serialize(d, meta_only, trace + [self])
+            self.parent.serialize(d, meta_only, trace + [self], exclude, excluded)
         if self.dlv_parent is not None:
-            self.dlv_parent.serialize(d, meta_only, trace + [self])
+            self.dlv_parent.serialize(d, meta_only, trace + [self], exclude, excluded)
         if self.nxdomain_ancestor is not None:
-            self.nxdomain_ancestor.serialize(d, meta_only, trace + [self])
+            self.nxdomain_ancestor.serialize(d, meta_only, trace + [self], exclude, excluded)
 
         clients_ipv4 = list(self.clients_ipv4)
         clients_ipv4.sort()
@@ -745,6 +827,13 @@ class OnlineDomainNameAnalysis(object):
         d[name_str]['stub'] = self.stub
         d[name_str]['analysis_start'] = fmt.datetime_to_str(self.analysis_start)
         d[name_str]['analysis_end'] = fmt.datetime_to_str(self.analysis_end)
+        if self.partial:
+            d[name_str]['partial'] = True
+        if self.timings is not None:
+            d[name_str]['timings'] = OrderedDict((
+                ('queries_issued', self.queries_issued),
+                ('phases', OrderedDict([(phase, round(self.timings[phase], 3)) for phase in self.timings])),
+            ))
         if not self.stub:
             d[name_str]['clients_ipv4'] = clients_ipv4
             d[name_str]['clients_ipv6'] = clients_ipv6
@@ -764,6 +853,8 @@ class OnlineDomainNameAnalysis(object):
             if self.nxrrset_name is not None:
                 d[name_str]['nxrrset_name'] = lb2s(self.nxrrset_name.to_text())
                 d[name_str]['nxrrset_rdtype'] = dns.rdatatype.to_text(self.nxrrset_rdtype)
+            if self.sampled_servers is not None:
+                d[name_str]['sampled_servers'] = sorted(self.sampled_servers)
 
         self._serialize_related(d[name_str], meta_only)
 
@@ -787,23 +878,23 @@ class OnlineDomainNameAnalysis(object):
             for query in self.queries[(qname, rdtype)].queries.values():
                 d['queries'].append(query.serialize(meta_only))
 
-    def _serialize_dependencies(self, d, meta_only, trace):
+    def _serialize_dependencies(self, d, meta_only, trace, exclude=None, excluded=None):
         if self.stub:
             return
 
         for cname in self.cname_targets:
             for target, cname_obj in self.cname_targets[cname].items():
                 if cname_obj is not None:
-                    cname_obj.serialize(d, meta_only, trace=trace + [self])
+                    cname_obj.serialize(d, meta_only, trace=trace + [self], exclude=exclude, excluded=excluded)
         for signer, signer_obj in self.external_signers.items():
             if signer_obj is not None:
-                signer_obj.serialize(d, meta_only, trace=trace + [self])
+                signer_obj.serialize(d, meta_only, trace=trace + [self], exclude=exclude, excluded=excluded)
         for target, ns_obj in self.ns_dependencies.items():
             if ns_obj is not None:
-                ns_obj.serialize(d, meta_only, trace=trace + [self])
+                ns_obj.serialize(d, meta_only, trace=trace + [self], exclude=exclude, excluded=excluded)
         for target, mx_obj in self.mx_targets.items():
             if mx_obj is not None:
-                mx_obj.serialize(d, meta_only, trace=trace + [self])
+                mx_obj.serialize(d, meta_only, trace=trace + [self], exclude=exclude, excluded=excluded)
 
     @classmethod
     def deserialize(cls, name, d1, cache=None):
@@ -849,6 +940,10 @@ class OnlineDomainNameAnalysis(object):
             a.nxdomain_ancestor = nxdomain_ancestor
         a.analysis_start = fmt.str_to_datetime(d['analysis_start'])
         a.analysis_end = fmt.str_to_datetime(d['analysis_end'])
+        a.partial = d.get('partial', False)
+        if 'timings' in d:
+            a.queries_issued = d['timings']['queries_issued']
+            a.timings = OrderedDict(d['timings']['phases'].items())
 
         if not a.stub:
             if 'referral_rdtype' in d:
@@ -860,6 +955,8 @@ class OnlineDomainNameAnalysis(object):
             if 'nxrrset_name' in d:
                 a.nxrrset_name = dns.name.from_text(d['nxrrset_name'])
                 a.nxrrset_rdtype = dns.rdatatype.from_text(d['nxrrset_rdtype'])
+            if 'sampled_servers' in d:
+                a.sampled_servers = set([IPAddr(x) for x in d['sampled_servers']])
 
         a._deserialize_related(d)
         a._deserialize_dependencies(d1, cache)
@@ -955,12 +1052,711 @@ class ActiveDomainNameAnalysis(OnlineDomainNameAnalysis):
         super(ActiveDomainNameAnalysis, self).__init__(*args, **kwargs)
         self.complete = threading.Event()
 
+class _DependencyTask(object):
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.started = False
+        self.done = False
+
+class DependencyExecutor(object):
+    '''A bounded pool of threads, shared by an analyst and all its clones, for
+    the analysis of dependencies (CNAME targets, external signers, NS
+    dependencies, and MX targets).
+
+    A thread waiting on the tasks that it submitted runs those not yet
+    claimed by a worker itself, rather than blocking, so nested dependency
+    analyses cannot deadlock the pool, however few workers it has.'''
+
+    def __init__(self, max_workers=DEFAULT_DEPENDENCY_WORKERS):
+        self.max_workers = max_workers
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._workers = 0
+
+    def _claim(self, task):
+        # call with self._cond held
+        if task.started:
+            return False
+        task.started = True
+        return True
+
+    def _run(self, task):
+        try:
+            task.func(*task.args)
+        finally:
+            with self._cond:
+                task.done = True
+                self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                task = None
+                while self._queue:
+                    t = self._queue.popleft()
+                    if self._claim(t):
+                        task = t
+                        break
+                if task is None:
+                    # workers exit when there is nothing left to do, so
+                    # there are no idle threads between analyses
+                    self._workers -= 1
+                    return
+            self._run(task)
+
+    def submit(self, func, *args):
+        task = _DependencyTask(func, args)
+        with self._cond:
+            self._queue.append(task)
+            if self._workers < self.max_workers:
+                self._workers += 1
+                t = threading.Thread(target=self._worker)
+                t.daemon = True
+                t.start()
+        return task
+
+    def wait(self, tasks):
+        '''Wait for the given tasks to complete, running in the current thread
+        those that no worker has yet started.'''
+
+        for task in tasks:
+            with self._cond:
+                claimed = self._claim(task)
+            if claimed:
+                self._run(task)
+
+        with self._cond:
+            while [t for t in tasks if not t.done]:
+                self._cond.wait()
+
+class AnalysisNotifier(object):
+    '''Notify threads (or, when served by a multiprocessing manager,
+    processes) waiting on the analysis of a name, when that analysis is
+    complete.
+
+    A waiter first gets the current generation of the name, then checks the
+    analysis cache, and only then waits for the generation to change, so a
+    notification issued between the check and the wait is not missed.'''
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._generations = {}
+
+    def generation(self, name):
+        with self._cond:
+            return self._generations.get(name, 0)
+
+    def notify(self, name):
+        with self._cond:
+            self._generations[name] = self._generations.get(name, 0) + 1
+            self._cond.notify_all()
+
+    def wait(self, name, generation, timeout=None):
+        '''Wait until name has been notified since generation was retrieved,
+        or until timeout has elapsed.  Return True if the former.'''
+
+        if timeout is not None:
+            end = time.time() + timeout
+        with self._cond:
+            while self._generations.get(name, 0) == generation:
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            return True
+
+class BoundedAnalysisCache(object):
+    '''A dict-like analysis cache, for use as the analysis_cache of an
+    Analyst, that keeps at most max_entries complete analyses of names below
+    keep_level.
+
+    When there are more, they are evicted in least recently used order; the
+    analyses of names at keep_level or above (i.e., near the root) are kept,
+    as they are shared by the analyses of all names below them.  Complete
+    analyses are also evicted once any of the records in them has expired,
+    but no sooner than min_retention seconds after their completion.
+    Analyses in progress and pinned analyses are never evicted.  An evicted
+    analysis remains in the cache (weakly) for as long as something else
+    refers to it, e.g., the analysis of a descendant, and is restored if it
+    is looked up in that time.'''
+
+    def __init__(self, max_entries, keep_level=DEFAULT_CACHE_KEEP_LEVEL, min_retention=DEFAULT_CACHE_MIN_RETENTION):
+        self.max_entries = max_entries
+        self.keep_level = keep_level
+        self.min_retention = min_retention
+        self.evictions = 0
+        self._kept = {}
+        self._entries = OrderedDict()
+        self._evicted = weakref.WeakValueDictionary()
+        self._expirations = {}
+        self._pins = {}
+        self._lock = threading.RLock()
+
+    def _expired(self, name, name_obj):
+        # call with self._lock held
+        if name_obj.analysis_end is None or name in self._pins:
+            return False
+        if name not in self._expirations:
+            expiration = name_obj.get_expiration()
+            if expiration is not None:
+                expiration = max(expiration, fmt.datetime_to_timestamp(name_obj.analysis_end) + self.min_retention)
+            self._expirations[name] = expiration
+        expiration = self._expirations[name]
+        return expiration is not None and expiration <= time.time()
+
+    def _lookup(self, name):
+        with self._lock:
+            if name in self._kept:
+                name_obj = self._kept[name]
+            else:
+                name_obj = self._entries.pop(name, None)
+                if name_obj is None:
+                    name_obj = self._evicted.pop(name, None)
+                if name_obj is not None:
+                    self._entries[name] = name_obj
+                    self._evict()
+            if name_obj is None:
+                return None
+            if self._expired(name, name_obj):
+                self._remove(name)
+                return None
+            return name_obj
+
+    def _remove(self, name):
+        # call with self._lock held
+        self._kept.pop(name, None)
+        self._entries.pop(name, None)
+        self._evicted.pop(name, None)
+        self._expirations.pop(name, None)
+
+    def _evict(self):
+        # call with self._lock held
+        excess = len(self._entries) - self.max_entries
+        if excess <= 0:
+            return
+        evicted_names = []
+        for name in self._entries:
+            if self._entries[name].analysis_end is not None and name not in self._pins:
+                evicted_names.append(name)
+                if len(evicted_names) >= excess:
+                    break
+        for name in evicted_names:
+            self._evicted[name] = self._entries.pop(name)
+            self._expirations.pop(name, None)
+        self.evictions += len(evicted_names)
+
+    def __getitem__(self, name):
+        name_obj = self._lookup(name)
+        if name_obj is None:
+            raise KeyError(name)
+        return name_obj
+
+    def get(self, name, default=None):
+        name_obj = self._lookup(name)
+        if name_obj is None:
+            return default
+        return name_obj
+
+    def __setitem__(self, name, name_obj):
+        with self._lock:
+            self._remove(name)
+            if len(name) <= self.keep_level:
+                self._kept[name] = name_obj
+            else:
+                self._entries[name] = name_obj
+                self._evict()
+
+    def setdefault(self, name, name_obj):
+        with self._lock:
+            existing = self._lookup(name)
+            if existing is not None:
+                return existing
+            self[name] = name_obj
+            return name_obj
+
+    def __delitem__(self, name):
+        with self._lock:
+            if name not in self._kept and name not in self._entries and name not in self._evicted:
+                raise KeyError(name)
+            self._remove(name)
+
+    def __contains__(self, name):
+        return self._lookup(name) is not None
+
+    def keys(self):
+        with self._lock:
+            return list(self._kept) + list(self._entries)
+
+    def pin(self, name):
+        '''Keep the analysis of name from being evicted or expiring until it is
+        unpinned as many times as it has been pinned.'''
+
+        with self._lock:
+            self._pins[name] = self._pins.get(name, 0) + 1
+
+    def unpin(self, name):
+        with self._lock:
+            count = self._pins.pop(name, 0) - 1
+            if count > 0:
+                self._pins[name] = count
+            else:
+                self._evict()
+
+class AnalysisStore(object):
+    '''A store of serialized analyses, keyed by name, to be served by a
+    multiprocessing manager and accessed through SharedAnalysisCache.
+
+    Analyses are stored as they were serialized by the client, so the
+    server neither deserializes nor re-serializes them.  Each entry carries a
+    version, which changes whenever the entry is replaced, and a state
+    (pending or complete), which can be checked without transferring the
+    analysis itself.'''
+
+    def __init__(self, max_entries=None, keep_level=DEFAULT_CACHE_KEEP_LEVEL, min_retention=DEFAULT_CACHE_MIN_RETENTION):
+        self._id = uuid.uuid4().hex
+        self._entries = {}
+        self._version = 0
+        self._lock = threading.Lock()
+
+        # if max_entries is specified, then the complete analyses of names
+        # below keep_level are evicted in least recently used order, so that
+        # there are at most max_entries of them; and complete analyses are
+        # evicted when they expire, but no sooner than min_retention seconds
+        # after they are stored.  Pinned analyses are neither.
+        self.max_entries = max_entries
+        self.keep_level = keep_level
+        self.min_retention = min_retention
+        self._evictable = OrderedDict()
+        self._expirations = {}
+        self._pins = {}
+
+    def id(self):
+        return self._id
+
+    def bounds(self):
+        '''Return a (max_entries, keep_level) tuple.'''
+
+        return self.max_entries, self.keep_level
+
+    def _lookup(self, name):
+        try:
+            entry = self._entries[name]
+        except KeyError:
+            return None
+        if self.max_entries is None:
+            return entry
+        with self._lock:
+            if name not in self._entries:
+                return None
+            expiration = self._expirations.get(name)
+            if expiration is not None and expiration <= time.time() and name not in self._pins:
+                self._remove(name)
+                return None
+            if name in self._evictable:
+                del self._evictable[name]
+                self._evictable[name] = None
+        return entry
+
+    def _store(self, name, entry, expiration):
+        # call with self._lock held
+        self._entries[name] = entry
+        if self.max_entries is None:
+            return
+        complete = entry[1]
+        self._evictable.pop(name, None)
+        self._expirations.pop(name, None)
+        if complete:
+            if expiration is not None:
+                self._expirations[name] = max(expiration, time.time() + self.min_retention)
+            if len(name) > self.keep_level:
+                self._evictable[name] = None
+                self._evict()
+
+    def _evict(self):
+        # call with self._lock held
+        excess = len(self._evictable) - self.max_entries
+        if excess <= 0:
+            return
+        evicted_names = []
+        for name in self._evictable:
+            if name not in self._pins:
+                evicted_names.append(name)
+                if len(evicted_names) >= excess:
+                    break
+        for name in evicted_names:
+            self._remove(name)
+
+    def _remove(self, name):
+        # call with self._lock held
+        del self._entries[name]
+        self._evictable.pop(name, None)
+        self._expirations.pop(name, None)
+
+    def _next_version(self):
+        # call with self._lock held
+        self._version += 1
+        return self._version
+
+    def state(self, name):
+        '''Return a (version, complete) tuple for name, or None, if there is
+        no analysis for name in the store.'''
+
+        entry = self._lookup(name)
+        if entry is None:
+            return None
+        version, complete, data = entry
+        return version, complete
+
+    def get(self, name, version=None):
+        '''Return a (version, complete, data) tuple for name, or None, if
+        there is no analysis for name in the store.  If version is the
+        current version of the entry, then data is None, as the caller
+        already has it.'''
+
+        entry = self._lookup(name)
+        if entry is None:
+            return None
+        entry_version, complete, data = entry
+        if entry_version == version:
+            data = None
+        return entry_version, complete, data
+
+    def put(self, name, data, complete, expiration=None):
+        with self._lock:
+            version = self._next_version()
+            self._store(name, (version, complete, data), expiration)
+        return version
+
+    def add(self, name, data, complete, expiration=None):
+        '''Add the analysis for name, if there is none in the store already.
+        Return a tuple (added, version, complete, data), where the last three
+        describe the existing entry, if added is False.'''
+
+        # (this evicts the existing entry, if it has expired)
+        self._lookup(name)
+        with self._lock:
+            try:
+                version, complete, data = self._entries[name]
+            except KeyError:
+                version = self._next_version()
+                self._store(name, (version, complete, data), expiration)
+                return True, version, complete, None
+        return False, version, complete, data
+
+    def delete(self, name, version=None):
+        '''Delete the analysis for name, if it exists and if version is either
+        None or its current version.  Return True if it was deleted.'''
+
+        with self._lock:
+            try:
+                entry_version = self._entries[name][0]
+            except KeyError:
+                return False
+            if version is not None and version != entry_version:
+                return False
+            self._remove(name)
+        return True
+
+    def names(self):
+        return list(self._entries)
+
+    def pin(self, name):
+        '''Keep the analysis for name from being evicted or expiring until it
+        is unpinned as many times as it has been pinned.'''
+
+        with self._lock:
+            self._pins[name] = self._pins.get(name, 0) + 1
+
+    def unpin(self, name):
+        with self._lock:
+            count = self._pins.pop(name, 0) - 1
+            if count > 0:
+                self._pins[name] = count
+            elif self.max_entries is not None:
+                self._evict()
+
+_shared_analysis_caches = {}
+_shared_analysis_caches_lock = threading.Lock()
+
+def _get_shared_analysis_cache(store, store_id):
+    # there is one SharedAnalysisCache per store per process, so the
+    # deserialized analyses are shared by all analyses in the process
+    with _shared_analysis_caches_lock:
+        try:
+            return _shared_analysis_caches[store_id]
+        except KeyError:
+            cache = _shared_analysis_caches[store_id] = SharedAnalysisCache(store, store_id)
+            return cache
+
+class SharedAnalysisCache(object):
+    '''A dict-like analysis cache, for use as the analysis_cache of an
+    Analyst, backed by an AnalysisStore shared among processes.
+
+    Readers take no lock.  Each read is a single round trip to the store,
+    which transfers the analysis only if it has changed since this process
+    last deserialized it.  Complete analyses are deserialized at most once
+    per version per process.  The number of analyses of names below the
+    store's keep_level that are kept by each process is bounded by that of
+    the store or, if the store is unbounded, by DEFAULT_CACHE_MAX_LOCAL.'''
+
+    def __init__(self, store, store_id=None):
+        self._store = store
+        if store_id is None:
+            store_id = store.id()
+        self._store_id = store_id
+        max_entries, self._keep_level = store.bounds()
+        self._bounded = max_entries is not None
+        if max_entries is None:
+            max_entries = DEFAULT_CACHE_MAX_LOCAL
+        self._max_local = max_entries
+        self._local = {}
+        self._local_lru = OrderedDict()
+        self._local_lock = threading.Lock()
+
+    def __reduce__(self):
+        return (_get_shared_analysis_cache, (self._store, self._store_id))
+
+    def _serialize(self, name_obj):
+        return pickle.dumps(name_obj, pickle.HIGHEST_PROTOCOL), name_obj.analysis_end is not None
+
+    def _expiration(self, name_obj):
+        if not self._bounded or name_obj.analysis_end is None:
+            return None
+        return name_obj.get_expiration()
+
+    def _remember(self, name, version, name_obj):
+        if len(name) <= self._keep_level:
+            self._local[name] = (version, name_obj)
+            return
+        with self._local_lock:
+            self._local_lru.pop(name, None)
+            self._local_lru[name] = (version, name_obj)
+            while len(self._local_lru) > self._max_local:
+                self._local_lru.popitem(last=False)
+
+    def _recall(self, name):
+        local = self._local.get(name)
+        if local is not None:
+            return local
+        with self._local_lock:
+            local = self._local_lru.pop(name, None)
+            if local is not None:
+                self._local_lru[name] = local
+        return local
+
+    def _forget(self, name):
+        self._local.pop(name, None)
+        with self._local_lock:
+            self._local_lru.pop(name, None)
+
+    def _deserialize(self, name, version, complete, data):
+        name_obj = pickle.loads(data)
+        if complete:
+            self._remember(name, version, name_obj)
+        return name_obj
+
+    def __getitem__(self, name):
+        local = self._recall(name)
+        if local is None:
+            entry = self._store.get(name)
+        else:
+            entry = self._store.get(name, local[0])
+        if entry is None:
+            self._forget(name)
+            raise KeyError(name)
+        version, complete, data = entry
+        if data is None:
+            return local[1]
+        return self._deserialize(name, version, complete, data)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __setitem__(self, name, name_obj):
+        data, complete = self._serialize(name_obj)
+        version = self._store.put(name, data, complete, self._expiration(name_obj))
+        if complete:
+            self._remember(name, version, name_obj)
+        else:
+            self._forget(name)
+
+    def setdefault(self, name, name_obj):
+        '''Add name_obj as the analysis for name, unless there already is one,
+        atomically across all processes sharing the store.  Return the
+        analysis for name.'''
+
+        # look for an existing analysis first, so that name_obj is only
+        # serialized if it is likely to be added
+        try:
+            return self[name]
+        except KeyError:
+            pass
+        data, complete = self._serialize(name_obj)
+        added, version, complete, data = self._store.add(name, data, complete, self._expiration(name_obj))
+        if added:
+            return name_obj
+        return self._deserialize(name, version, complete, data)
+
+    def __delitem__(self, name):
+        self._forget(name)
+        if not self._store.delete(name):
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        return self._store.state(name) is not None
+
+    def keys(self):
+        return self._store.names()
+
+    def pin(self, name):
+        self._store.pin(name)
+
+    def unpin(self, name):
+        self._store.unpin(name)
+
+class QueryReuseStats(object):
+    '''Counts of the queries answered from a previous analysis and those
+    issued anew.'''
+
+    def __init__(self):
+        self._reused = 0
+        self._issued = 0
+        self._lock = threading.Lock()
+
+    def record(self, reused):
+        with self._lock:
+            if reused:
+                self._reused += 1
+            else:
+                self._issued += 1
+
+    def serialize(self):
+        with self._lock:
+            return OrderedDict((
+                ('queries_reused', self._reused),
+                ('queries_issued', self._issued),
+            ))
+
+class PreviousQueries(object):
+    '''The queries of previous analyses, whose responses are used in lieu of
+    issuing the same queries again, for as long as none of the RRsets (or
+    RRSIGs) in them has expired.'''
+
+    def __init__(self, stats=None):
+        self._queries = {}
+        if stats is None:
+            stats = QueryReuseStats()
+        self.stats = stats
+
+    @classmethod
+    def _response_expiration(cls, response, start):
+        if response.message is None:
+            return None
+
+        expiration = None
+        for rrset in response.message.answer + response.message.authority:
+            rrset_expiration = start + rrset.ttl
+            if rrset.rdtype == dns.rdatatype.RRSIG:
+                for rrsig in rrset:
+                    rrset_expiration = min(rrset_expiration, rrsig.expiration)
+            if expiration is None or rrset_expiration < expiration:
+                expiration = rrset_expiration
+        return expiration
+
+    def add_analysis(self, name_obj):
+        '''Add the queries of name_obj.  Responses are considered to have been
+        received at the start of the analysis, and a server's responses are
+        only used if each of them has at least one RRset.'''
+
+        if name_obj.analysis_start is None:
+            return
+        start = fmt.datetime_to_timestamp(name_obj.analysis_start)
+
+        for multi_query in name_obj.queries.values():
+            for params, query in multi_query.queries.items():
+                key = (query.qname, query.rdtype, query.rdclass, params)
+                for server in query.responses:
+                    expiration = None
+                    for response in query.responses[server].values():
+                        response_expiration = self._response_expiration(response, start)
+                        if response_expiration is None:
+                            break
+                        if expiration is None or response_expiration < expiration:
+                            expiration = response_expiration
+                    else:
+                        if expiration is not None:
+                            self._queries.setdefault(key, {})[server] = (expiration, query.responses[server])
+
+    def fill(self, query):
+        '''If there are unexpired responses to a previous query with the same
+        parameters as query from all the servers of query, then add copies of
+        them to query and return True.  Otherwise, return False.'''
+
+        entry = self._queries.get((query.qname, query.rdtype, query.rdclass, query.params()))
+        t = time.time()
+        reused = entry is not None and \
+                not [s for s in query.servers if s not in entry or entry[s][0] <= t]
+        self.stats.record(reused)
+        if not reused:
+            return False
+
+        for server in query.servers:
+            for client, response in entry[server][1].items():
+                response_clone = response.copy()
+                response_clone.query = None
+                query.add_response(server, client, response_clone, query.bailiwick)
+        return True
+
+class _PhaseTimer(object):
+    '''A timer of a phase of an analysis (see Analyst.record_timings), which
+    measures its exclusive time, i.e., the time elapsed less that of the
+    phases timed within it in the same thread, including those of other
+    analyses (e.g., of ancestors or dependencies).  Thus the times of all the
+    phases of all analyses can be added without counting any time twice.
+    Time spent waiting for other threads (e.g., for their analyses or
+    queries) is included.'''
+
+    _local = threading.local()
+
+    def __init__(self):
+        self._start = None
+        self._nested = 0
+
+    def start(self):
+        self._start = time.time()
+        self._nested = 0
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        self._local.stack.append(self)
+        return self
+
+    def stop(self):
+        '''Stop the timer, and return its exclusive time.'''
+
+        elapsed = time.time() - self._start
+        stack = self._local.stack
+        # discard any timers within this one that were never stopped (e.g.,
+        # because of an exception)
+        while stack and stack.pop() is not self:
+            pass
+        if stack:
+            stack[-1]._nested += elapsed
+        return elapsed - self._nested
+
 class Analyst(object):
     analysis_model = ActiveDomainNameAnalysis
     _simple_query = Q.SimpleDNSQuery
     _diagnostic_query = Q.DiagnosticQuery
     _tcp_diagnostic_query = Q.TCPDiagnosticQuery
     _pmtu_diagnostic_query = Q.PMTUDiagnosticQuery
+    _parallel_pmtu_diagnostic_query = Q.ParallelPMTUDiagnosticQuery
     _truncation_diagnostic_query = Q.TruncationDiagnosticQuery
     _edns_version_diagnostic_query = Q.EDNSVersionDiagnosticQuery
     _edns_flag_diagnostic_query = Q.EDNSFlagDiagnosticQuery
@@ -971,17 +1767,27 @@ class Analyst(object):
     qname_only = True
     analysis_type = ANALYSIS_TYPE_AUTHORITATIVE
 
-    clone_attrnames = ['dlv_domain', 'try_ipv4', 'try_ipv6', 'client_ipv4', 'client_ipv6', 'query_class_mixin', 'logger', 'ceiling', 'edns_diagnostics', 'follow_ns', 'explicit_delegations', 'stop_at_explicit', 'odd_ports', 'analysis_cache', 'cache_level', 'analysis_cache_lock', 'transport_manager', 'th_factories', 'resolver']
+    # whether to look up the NS RRsets of the ancestry in advance of its
+    # analysis (only useful if the resolver caches)
+    prefetch_ancestry = True
+
+    clone_attrnames = ['dlv_domain', 'try_ipv4', 'try_ipv6', 'client_ipv4', 'client_ipv6', 'query_class_mixin', 'logger', 'ceiling', 'edns_diagnostics', 'parallel_pmtu', 'follow_ns', 'explicit_delegations', 'stop_at_explicit', 'odd_ports', 'analysis_cache', 'cache_level', 'analysis_cache_lock', 'transport_manager', 'th_factories', 'resolver', 'dependency_executor', 'analysis_notifier', 'previous_queries', 'deadline', 'server_sample', 'record_timings', 'pinned_names']
 
     def __init__(self, name, dlv_domain=None, try_ipv4=True, try_ipv6=True, client_ipv4=None, client_ipv6=None, query_class_mixin=None, logger=_logger, ceiling=None, edns_diagnostics=False,
-             follow_ns=False, follow_mx=False, trace=None, explicit_delegations=None, stop_at_explicit=None, odd_ports=None, extra_rdtypes=None, explicit_only=False,
-             analysis_cache=None, cache_level=None, analysis_cache_lock=None, th_factories=None, transport_manager=None, resolver=None):
+             parallel_pmtu=False, follow_ns=False, follow_mx=False, trace=None, explicit_delegations=None, stop_at_explicit=None, odd_ports=None, extra_rdtypes=None, explicit_only=False,
+             analysis_cache=None, cache_level=None, analysis_cache_lock=None, th_factories=None, transport_manager=None, resolver=None, dependency_executor=None, analysis_notifier=None, previous_queries=None, deadline=None, server_sample=None, record_timings=False, pinned_names=None):
+
+        setup_timer = _PhaseTimer().start()
 
         self.query_class_mixin = query_class_mixin
         self.simple_query = self._get_query_class(self._simple_query, self.query_class_mixin)
         self.diagnostic_query = self._get_query_class(self._diagnostic_query, self.query_class_mixin)
         self.tcp_diagnostic_query = self._get_query_class(self._tcp_diagnostic_query, self.query_class_mixin)
-        self.pmtu_diagnostic_query = self._get_query_class(self._pmtu_diagnostic_query, self.query_class_mixin)
+        self.parallel_pmtu = parallel_pmtu
+        if self.parallel_pmtu:
+            self.pmtu_diagnostic_query = self._get_query_class(self._parallel_pmtu_diagnostic_query, self.query_class_mixin)
+        else:
+            self.pmtu_diagnostic_query = self._get_query_class(self._pmtu_diagnostic_query, self.query_class_mixin)
         self.truncation_diagnostic_query = self._get_query_class(self._truncation_diagnostic_query, self.query_class_mixin)
         self.edns_version_diagnostic_query = self._get_query_class(self._edns_version_diagnostic_query, self.query_class_mixin)
         self.edns_flag_diagnostic_query = self._get_query_class(self._edns_flag_diagnostic_query, self.query_class_mixin)
@@ -1077,8 +1883,44 @@ class Analyst(object):
             self.analysis_cache_lock = threading.Lock()
         else:
             self.analysis_cache_lock = analysis_cache_lock
+        if dependency_executor is None:
+            self.dependency_executor = DependencyExecutor()
+        else:
+            self.dependency_executor = dependency_executor
+        if analysis_notifier is None:
+            self.analysis_notifier = AnalysisNotifier()
+        else:
+            self.analysis_notifier = analysis_notifier
+        self.previous_queries = previous_queries
+        # the time (as returned by time.time()) after which remaining
+        # diagnostic queries are skipped, shared with the analysts of
+        # dependencies
+        self.deadline = deadline
+        # the maximum number of servers of each address family to which
+        # diagnostic queries are sent
+        self.server_sample = server_sample
+        # the names of dependencies pinned in the analysis cache, shared with
+        # the analysts of dependencies, and unpinned by the analyst that
+        # created the list, once its analysis is complete
+        if pinned_names is None:
+            self.pinned_names = []
+            self._owns_pins = True
+        else:
+            self.pinned_names = pinned_names
+            self._owns_pins = False
+        self._deferred_tasks = []
+        self._deferred_errors = []
         self._detect_cname_chain()
 
+        # whether to record the time spent in each phase of each analysis;
+        # the time spent by the analyst itself, rather than on a particular
+        # analysis (e.g., detecting the ceiling and waiting for analyses by
+        # others), is added to that of the name in question, if the analyst
+        # performs it
+        self.record_timings = record_timings
+        self._analyst_timings = OrderedDict((('setup', setup_timer.stop()), ('cache_wait', 0)))
+        self._name_obj_analyzed = None
+
     def _get_resolver(self):
         hints = util.get_root_hints()
         for key in self.explicit_delegations:
@@ -1319,6 +2161,38 @@ class Analyst(object):
             return False
         return True
 
+    def _record_timing(self, name_obj, phase, elapsed):
+        if self.record_timings:
+            name_obj.add_timing(phase, elapsed)
+
+    @contextlib.contextmanager
+    def _timed(self, name_obj, phase):
+        '''Record the time spent in the body of the with statement as that of
+        the given phase of the analysis of name_obj.'''
+
+        timer = _PhaseTimer().start()
+        try:
+            yield
+        finally:
+            self._record_timing(name_obj, phase, timer.stop())
+
+    def _past_deadline(self):
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def _execute_queries(self, name_obj, *queries):
+        # use the responses of previous queries, where they are still fresh,
+        # and issue the rest
+        if self.previous_queries is not None:
+            queries = [q for q in queries if not self.previous_queries.fill(q)]
+        if queries:
+            with self._timed(name_obj, 'execute'):
+                Q.ExecutableDNSQuery.execute_queries(*queries, tm=self.transport_manager, th_factories=self.th_factories)
+            if self.record_timings:
+                # count every query sent, i.e., each retry (e.g., over TCP or
+                # with a different EDNS payload) and PMTU probe recorded in the
+                # history of a response, in addition to the final query
+                name_obj.queries_issued += sum([r.retries() + 1 for q in queries for server in q.responses for r in q.responses[server].values()])
+
     def _add_query(self, name_obj, query, detect_ns=False, iterative=False):
         # if this query is empty (i.e., nothing was actually asked, e.g., due
         # to client-side connectivity failure), then raise a connectivity
@@ -1328,11 +2202,32 @@ class Analyst(object):
 
         name_obj.add_query(query, detect_ns)
 
+        # share what was learned about the servers (from the standard queries
+        # used for detecting NS) with the resolver's infrastructure cache
+        if detect_ns:
+            self._record_infrastructure(query)
+
+    def _record_infrastructure(self, query):
+        infra_cache = getattr(self.resolver, 'infra_cache', None)
+        if infra_cache is None:
+            return
+        for server in query.responses:
+            for client in query.responses[server]:
+                status, edns = Resolver.infrastructure_status(query, query.responses[server][client])
+                infra_cache.record(server, query.bailiwick, status, edns)
+
     def _filter_servers_network(self, servers):
         if not self.try_ipv6:
             servers = [x for x in servers if x.version != 6]
         if not self.try_ipv4:
             servers = [x for x in servers if x.version != 4]
+
+        # avoid address families that appear to be blackholed, as long as
+        # there are other servers to query
+        health = self.transport_manager.family_health
+        healthy_servers = [x for x in servers if not health.is_blackholed(x.version)]
+        if healthy_servers:
+            servers = healthy_servers
         return servers
 
     def _filter_servers_locality(self, servers):
@@ -1342,6 +2237,25 @@ class Analyst(object):
             servers = [x for x in servers if not RFC_1918_RE.match(x) and not LINK_LOCAL_RE.match(x) and not UNIQ_LOCAL_RE.match(x)]
         return [x for x in servers if ZERO_SLASH8_RE.search(x) is None]
 
+    def _sample_servers(self, name_obj, servers):
+        '''Return the servers to which the diagnostic queries for name_obj are
+        sent: at most server_sample of each address family, selected by a hash
+        of the zone name and address, so the same ones are selected each time.
+        Record the sample in name_obj, if it excludes any servers.'''
+
+        if self.server_sample is None:
+            return servers
+
+        zone_str = lb2s(name_obj.zone.name.canonicalize().to_text())
+        sample = []
+        for version in (4, 6):
+            family = [x for x in servers if x.version == version]
+            family.sort(key=lambda x: hashlib.sha1(('%s %s' % (zone_str, x)).encode('utf-8')).digest())
+            sample.extend(family[:self.server_sample])
+        if len(sample) < len(servers):
+            name_obj.sampled_servers = set(sample)
+        return sample
+
     def _filter_servers(self, servers, no_raise=False):
         filtered_servers = self._filter_servers_network(servers)
         if servers and not filtered_servers and not no_raise:
@@ -1349,28 +2263,46 @@ class Analyst(object):
         return self._filter_servers_locality(filtered_servers)
 
     def _get_name_for_analysis(self, name, stub=False, lock=True):
-        with self.analysis_cache_lock:
-            try:
-                name_obj = self.analysis_cache[name]
-            except KeyError:
-                if lock:
-                    name_obj = self.analysis_cache[name] = self.analysis_model(name, stub=stub, analysis_type=self.analysis_type)
-                    return name_obj
-                # if not locking, then return None
-                else:
-                    return None
+        if lock:
+            new_name_obj = self.analysis_model(name, stub=stub, analysis_type=self.analysis_type)
+            with self.analysis_cache_lock:
+                name_obj = self.analysis_cache.setdefault(name, new_name_obj)
+            if name_obj is new_name_obj:
+                return name_obj
+        else:
+            # if not locking, then return None
+            name_obj = self.analysis_cache.get(name)
+            if name_obj is None:
+                return None
 
+        wait_timer = _PhaseTimer().start()
         # if there is a complete event, then wait on it
         if hasattr(name_obj, 'complete'):
             name_obj.complete.wait()
-        # loop and wait for analysis to be completed
+        # otherwise (e.g., the analysis is being performed by another
+        # process), wait to be notified that the analysis is complete
         while name_obj.analysis_end is None:
-            time.sleep(1)
-            name_obj = self.analysis_cache[name]
+            generation = self.analysis_notifier.generation(name)
+            name_obj = self.analysis_cache.get(name)
+            if name_obj is None:
+                # the analysis was removed (e.g., to be re-done) before it
+                # could be retrieved complete, so start over
+                self._analyst_timings['cache_wait'] += wait_timer.stop()
+                return self._get_name_for_analysis(name, stub, lock)
+            if name_obj.analysis_end is None:
+                self.analysis_notifier.wait(name, generation, ANALYSIS_WAIT_TIMEOUT)
+        self._analyst_timings['cache_wait'] += wait_timer.stop()
 
         # check if this analysis needs to be re-done
+        redo_analysis = False
+
+        # re-do analysis if the previous one was cut short by a deadline
+        # (e.g., that of another name, while analyzing an ancestor or
+        # dependency shared with this one), but this one has time
+        if name_obj.partial and not self._past_deadline():
+            redo_analysis = True
+
         if self.name == name:
-            redo_analysis = False
             # re-do analysis if force_dnskey is True and dnskey hasn't been queried
             if self._force_dnskey_query(self.name) and (self.name, dns.rdatatype.DNSKEY) not in name_obj.queries:
                 redo_analysis = True
@@ -1393,11 +2325,12 @@ class Analyst(object):
             if name_obj.stub and not stub:
                 redo_analysis = True
 
-            if redo_analysis:
-                with self.analysis_cache_lock:
-                    if name_obj.uuid == self.analysis_cache[name].uuid:
-                        del self.analysis_cache[name]
-                return self._get_name_for_analysis(name, stub, lock)
+        if redo_analysis:
+            with self.analysis_cache_lock:
+                existing = self.analysis_cache.get(name)
+                if existing is not None and existing.uuid == name_obj.uuid:
+                    del self.analysis_cache[name]
+            return self._get_name_for_analysis(name, stub, lock)
 
         return name_obj
 
@@ -1415,8 +2348,123 @@ class Analyst(object):
         return t
 
     def analyze(self):
+        try:
+            return self._analyze_all()
+        finally:
+            if self._owns_pins:
+                self._unpin_all()
+
+    def _analyze_all(self):
         self._analyze_dlv()
-        return self._analyze(self.name)
+        if self.prefetch_ancestry:
+            names = self._ancestry_to_prefetch()
+            if names:
+                self._defer(self.name, self._prefetch_ancestry, names)
+        try:
+            name_obj = self._analyze(self.name)
+        finally:
+            # wait for the work that was overlapped with the analysis
+            self.dependency_executor.wait(self._deferred_tasks)
+        self._raise_errors(self._deferred_errors)
+        if name_obj is self._name_obj_analyzed:
+            for phase, elapsed in self._analyst_timings.items():
+                self._record_timing(name_obj, phase, elapsed)
+        return name_obj
+
+    def _pin(self, name):
+        '''Keep the analysis of name, a dependency, in the analysis cache (if
+        it supports pinning) until the analysis in question is complete.'''
+
+        if hasattr(self.analysis_cache, 'pin'):
+            self.analysis_cache.pin(name)
+            self.pinned_names.append(name)
+
+    def _unpin_all(self):
+        while self.pinned_names:
+            self.analysis_cache.unpin(self.pinned_names.pop())
+
+    def _defer(self, name, func, *args):
+        '''Run func alongside the remainder of the analysis, which waits for it
+        before returning.'''
+
+        self._deferred_tasks.append(self.dependency_executor.submit(self._run_deferred, name, func, args))
+
+    def _run_deferred(self, name, func, args):
+        try:
+            func(*args)
+        except:
+            self._deferred_errors.append((name, sys.exc_info()))
+
+    def _raise_errors(self, errors):
+        if errors:
+            # raise only the first exception, but log all the ones beyond
+            for name, exc_info in errors[1:]:
+                self.logger.error('Error analyzing %s' % name, exc_info=exc_info)
+            raise errors[0][1][0].with_traceback(errors[0][1][2])
+
+    def _ancestry_to_prefetch(self):
+        '''Return the name in question and those of its ancestors that will be
+        analyzed with it, from the bottom up, stopping at the first that has
+        already been analyzed (or is being analyzed).'''
+
+        names = []
+        name = self.name
+        while True:
+            if name in self.analysis_cache:
+                break
+            if (name, dns.rdatatype.NS) in self.explicit_delegations:
+                if self.stop_at_explicit[name]:
+                    break
+            else:
+                names.append(name)
+            if name == dns.name.root or \
+                    (self.local_ceiling is not None and self.local_ceiling.is_subdomain(name)):
+                break
+            name = name.parent()
+        return names
+
+    def _prefetch_ancestry(self, names):
+        '''Look up the NS RRsets of the given names and then the addresses of
+        the servers in them, all concurrently, so the resolver has them at
+        hand when the delegation of each name is analyzed, top-down.  This is
+        only an optimization, so any failure is logged, rather than raised,
+        and the analysis proceeds without it.'''
+
+        try:
+            answer_map = self.resolver.query_multiple_for_answer(*[(name, dns.rdatatype.NS, dns.rdataclass.IN) for name in names])
+
+            query_tuples = set()
+            for a in answer_map.values():
+                if isinstance(a, Resolver.DNSAnswer):
+                    for rr in a.rrset:
+                        query_tuples.update(((rr.target, dns.rdatatype.A, dns.rdataclass.IN), (rr.target, dns.rdatatype.AAAA, dns.rdataclass.IN)))
+            if query_tuples:
+                self.resolver.query_multiple_for_answer(*query_tuples)
+        except dns.exception.DNSException:
+            pass
+        except Exception:
+            self.logger.warning('Error prefetching the ancestry of %s' % fmt.humanize_name(self.name), exc_info=True)
+
+    def _complete_analysis(self, name_obj):
+        '''Analyze the dependencies of the name and finalize its analysis.'''
+
+        try:
+            # analyze dependencies
+            with self._timed(name_obj, 'dependencies'):
+                self._analyze_dependencies(name_obj)
+
+            self._finalize_analysis_all(name_obj)
+        finally:
+            self._cleanup_analysis_all(name_obj)
+
+    def _complete_analysis_or_defer(self, name_obj):
+        # the analysis of an ancestor's dependencies is not needed for the
+        # analysis of its descendants, so overlap the two, rather than
+        # holding up the descendants.
+        if name_obj.name == self.name:
+            self._complete_analysis(name_obj)
+        else:
+            self._defer(name_obj.name, self._complete_analysis, name_obj)
 
     def _analyze_dlv(self):
         if self.dlv_domain is not None and self.dlv_domain != self.name and self.dlv_domain not in self.analysis_cache:
@@ -1434,6 +2482,7 @@ class Analyst(object):
     def _cleanup_analysis_proper(self, name_obj):
         if hasattr(name_obj, 'complete'):
             name_obj.complete.set()
+        self.analysis_notifier.notify(name_obj.name)
 
     def _cleanup_analysis_all(self, name_obj):
         if self.cache_level is not None and len(name_obj.name) > self.cache_level:
@@ -1457,6 +2506,7 @@ class Analyst(object):
         if name_obj.analysis_end is not None:
             return name_obj
 
+        stub_timer = _PhaseTimer().start()
         try:
             self.logger.info('Analyzing %s (stub)' % fmt.humanize_name(name))
 
@@ -1485,6 +2535,7 @@ class Analyst(object):
                     name_obj.parent = self._analyze_stub(name.parent()).zone
 
             name_obj.analysis_end = datetime.datetime.now(fmt.utc).replace(microsecond=0)
+            self._record_timing(name_obj, 'stub', stub_timer.stop())
 
             self._finalize_analysis_proper(name_obj)
             self._finalize_analysis_all(name_obj)
@@ -1538,13 +2589,20 @@ class Analyst(object):
         if name_obj is not None and name_obj.analysis_end is not None:
             return name_obj
 
-        parent_obj, dlv_parent_obj, nxdomain_ancestor = \
-                self._analyze_ancestry(name)
+        ancestry_timer = _PhaseTimer().start()
+        try:
+            parent_obj, dlv_parent_obj, nxdomain_ancestor = \
+                    self._analyze_ancestry(name)
+        finally:
+            ancestry_time = ancestry_timer.stop()
 
         # get or create the name
         name_obj = self._get_name_for_analysis(name)
         if name_obj.analysis_end is not None:
             return name_obj
+        if name == self.name:
+            self._name_obj_analyzed = name_obj
+        self._record_timing(name_obj, 'ancestry', ancestry_time)
 
         try:
             try:
@@ -1572,13 +2630,11 @@ class Analyst(object):
                 self._finalize_analysis_proper(name_obj)
             finally:
                 self._cleanup_analysis_proper(name_obj)
-
-            # analyze dependencies
-            self._analyze_dependencies(name_obj)
-
-            self._finalize_analysis_all(name_obj)
-        finally:
+        except:
             self._cleanup_analysis_all(name_obj)
+            raise
+
+        self._complete_analysis_or_defer(name_obj)
 
         return name_obj
 
@@ -1589,7 +2645,8 @@ class Analyst(object):
         if not name_obj.explicit_delegation:
             # analyze delegation, and return if name doesn't exist, unless
             # explicit_only was specified
-            yxdomain = self._analyze_delegation(name_obj)
+            with self._timed(name_obj, 'delegation'):
+                yxdomain = self._analyze_delegation(name_obj)
             if not yxdomain and not self.explicit_only:
                 return
 
@@ -1597,9 +2654,15 @@ class Analyst(object):
         if name_obj.is_zone():
             name_obj.set_ns_dependencies()
 
-        self._analyze_queries(name_obj)
+        with self._timed(name_obj, 'queries'):
+            self._analyze_queries(name_obj)
 
     def _analyze_queries(self, name_obj):
+        if self._past_deadline():
+            self.logger.info('Deadline passed; skipping diagnostic queries for %s' % fmt.humanize_name(name_obj.name))
+            name_obj.partial = True
+            return
+
         bailiwick = name_obj.zone.name
 
         servers = name_obj.zone.get_auth_or_designated_servers()
@@ -1614,6 +2677,9 @@ class Analyst(object):
         odd_ports = dict([(s, self.odd_ports[(n, s)]) for n, s in self.odd_ports if n == name_obj.zone.name])
 
         servers = self._filter_servers(servers)
+        # only the delegation-related queries (e.g., NS and DS) are sent to
+        # all servers; the diagnostic queries might go to a sample of them
+        servers = self._sample_servers(name_obj, servers)
         exclude_no_answer = set()
         queries = {}
 
@@ -1727,7 +2793,7 @@ class Analyst(object):
 
         # actually execute the queries, then store the results
         self.logger.debug('Executing queries...')
-        Q.ExecutableDNSQuery.execute_queries(*list(queries.values()), tm=self.transport_manager, th_factories=self.th_factories)
+        self._execute_queries(name_obj, *list(queries.values()))
         for key, query in queries.items():
             if query.is_answer_any() or key not in exclude_no_answer:
                 self._add_query(name_obj, query)
@@ -1772,7 +2838,7 @@ class Analyst(object):
 
             self.logger.debug('Querying %s/%s (referral)...' % (fmt.humanize_name(name_obj.name), dns.rdatatype.to_text(rdtype)))
             query = self.diagnostic_query(name_obj.name, rdtype, dns.rdataclass.IN, parent_auth_servers, name_obj.parent_name(), self.client_ipv4, self.client_ipv6, odd_ports=odd_ports)
-            query.execute(tm=self.transport_manager, th_factories=self.th_factories)
+            self._execute_queries(name_obj, query)
             referral_queries[rdtype] = query
 
             # if NXDOMAIN was received, then double-check with the secondary
@@ -1861,11 +2927,19 @@ class Analyst(object):
         names_resolved = set()
         names_not_resolved = name_obj.get_ns_names().difference(names_resolved)
         while names_not_resolved:
+            # if the deadline has passed, then stop querying the
+            # authoritative servers
+            if self._past_deadline():
+                self.logger.info('Deadline passed; skipping remaining authoritative servers for %s' % fmt.humanize_name(name_obj.name))
+                name_obj.partial = True
+                break
+
             # resolve every name in the NS RRset
             query_tuples = []
             for name in names_not_resolved:
                 query_tuples.extend([(name, dns.rdatatype.A, dns.rdataclass.IN), (name, dns.rdatatype.AAAA, dns.rdataclass.IN)])
-            answer_map = self.resolver.query_multiple_for_answer(*query_tuples)
+            with self._timed(name_obj, 'ns_lookup'):
+                answer_map = self.resolver.query_multiple_for_answer(*query_tuples)
             for query_tuple in answer_map:
                 name = query_tuple[0]
                 a = answer_map[query_tuple]
@@ -1901,7 +2975,7 @@ class Analyst(object):
                     queries.append(self.diagnostic_query(name_obj.name, secondary_rdtype, dns.rdataclass.IN, servers, name_obj.name, self.client_ipv4, self.client_ipv6, odd_ports=odd_ports))
 
             # actually execute the queries, then store the results
-            Q.ExecutableDNSQuery.execute_queries(*queries, tm=self.transport_manager, th_factories=self.th_factories)
+            self._execute_queries(name_obj, *queries)
             for query in queries:
                 self._add_query(name_obj, query, True, True)
 
@@ -1913,51 +2987,59 @@ class Analyst(object):
 
         return True
 
+    def _dependency_analyst(self, name_obj, rdtype, name):
+        '''Return an analyst for name, a dependency of name_obj of type rdtype
+        (CNAME, RRSIG, NS, or MX).'''
+
+        kwargs = dict([(n, getattr(self, n)) for n in self.clone_attrnames])
+        if rdtype == dns.rdatatype.CNAME:
+            kwargs.update(explicit_only=self.explicit_only, extra_rdtypes=self.extra_rdtypes)
+        elif rdtype == dns.rdatatype.MX:
+            kwargs.update(explicit_only=True, extra_rdtypes=[dns.rdatatype.A, dns.rdatatype.AAAA])
+        return self.__class__(name, trace=self.trace + [(name_obj, rdtype)], **kwargs)
+
     def _analyze_dependency(self, analyst, result_map, result_key, errors):
         try:
             result_map[result_key] = analyst.analyze()
         except:
             errors.append((result_key, sys.exc_info()))
+        else:
+            self._pin(result_key)
 
     def _analyze_dependencies(self, name_obj):
-        threads = []
+        tasks = []
         errors = []
 
-        kwargs = dict([(n, getattr(self, n)) for n in self.clone_attrnames])
         for cname in name_obj.cname_targets:
             for target in name_obj.cname_targets[cname]:
-                a = self.__class__(target, trace=self.trace + [(name_obj, dns.rdatatype.CNAME)], explicit_only=self.explicit_only, extra_rdtypes=self.extra_rdtypes, **kwargs)
-                t = threading.Thread(target=self._analyze_dependency, args=(a, name_obj.cname_targets[cname], target, errors))
-                t.start()
-                threads.append(t)
+                a = self._dependency_analyst(name_obj, dns.rdatatype.CNAME, target)
+                tasks.append(self.dependency_executor.submit(self._analyze_dependency, a, name_obj.cname_targets[cname], target, errors))
 
         for signer in name_obj.external_signers:
-            a = self.__class__(signer, trace=self.trace + [(name_obj, dns.rdatatype.RRSIG)], **kwargs)
-            t = threading.Thread(target=self._analyze_dependency, args=(a, name_obj.external_signers, signer, errors))
-            t.start()
-            threads.append(t)
-
-        if self.follow_ns:
+            a = self._dependency_analyst(name_obj, dns.rdatatype.RRSIG, signer)
+            tasks.append(self.dependency_executor.submit(self._analyze_dependency, a, name_obj.external_signers, signer, errors))
+
+        # the analysis of NS and MX dependencies is optional, so skip it if
+        # the deadline has passed
+        follow_ns = self.follow_ns and bool(name_obj.ns_dependencies)
+        follow_mx = self.follow_mx and bool(name_obj.mx_targets)
+        if (follow_ns or follow_mx) and self._past_deadline():
+            self.logger.info('Deadline passed; skipping NS and MX dependencies of %s' % fmt.humanize_name(name_obj.name))
+            name_obj.partial = True
+            follow_ns = follow_mx = False
+
+        if follow_ns:
             for ns in name_obj.ns_dependencies:
-                a = self.__class__(ns, trace=self.trace + [(name_obj, dns.rdatatype.NS)], **kwargs)
-                t = threading.Thread(target=self._analyze_dependency, args=(a, name_obj.ns_dependencies, ns, errors))
-                t.start()
-                threads.append(t)
+                a = self._dependency_analyst(name_obj, dns.rdatatype.NS, ns)
+                tasks.append(self.dependency_executor.submit(self._analyze_dependency, a, name_obj.ns_dependencies, ns, errors))
 
-        if self.follow_mx:
+        if follow_mx:
             for target in name_obj.mx_targets:
-                a = self.__class__(target, trace=self.trace + [(name_obj, dns.rdatatype.MX)], explicit_only=True, extra_rdtypes=[dns.rdatatype.A, dns.rdatatype.AAAA], **kwargs)
-                t = threading.Thread(target=self._analyze_dependency, args=(a, name_obj.mx_targets, target, errors))
-                t.start()
-                threads.append(t)
+                a = self._dependency_analyst(name_obj, dns.rdatatype.MX, target)
+                tasks.append(self.dependency_executor.submit(self._analyze_dependency, a, name_obj.mx_targets, target, errors))
 
-        for t in threads:
-            t.join()
-        if errors:
-            # raise only the first exception, but log all the ones beyond
-            for name, exc_info in errors[1:]:
-                self.logger.error('Error analyzing %s' % name, exc_info=exc_info)
-            raise errors[0][1][0].with_traceback(errors[0][1][2])
+        self.dependency_executor.wait(tasks)
+        self._raise_errors(errors)
 
     def _set_negative_queries(self, name_obj):
         random_label = ''.join(random.sample('abcdefghijklmnopqrstuvwxyz1234567890', 10))
@@ -2042,6 +3124,7 @@ class RecursiveAnalyst(Analyst):
     _diagnostic_query = Q.RecursiveDiagnosticQuery
     _tcp_diagnostic_query = Q.RecursiveTCPDiagnosticQuery
     _pmtu_diagnostic_query = Q.RecursivePMTUDiagnosticQuery
+    _parallel_pmtu_diagnostic_query = Q.RecursiveParallelPMTUDiagnosticQuery
     _truncation_diagnostic_query = Q.RecursiveTruncationDiagnosticQuery
     _edns_version_diagnostic_query = Q.RecursiveEDNSVersionDiagnosticQuery
     _edns_flag_diagnostic_query = Q.RecursiveEDNSFlagDiagnosticQuery
@@ -2049,6 +3132,8 @@ class RecursiveAnalyst(Analyst):
 
     analysis_type = ANALYSIS_TYPE_RECURSIVE
 
+    prefetch_ancestry = False
+
     def _get_resolver(self):
         servers = set()
         for rdata in self.explicit_delegations[(WILDCARD_EXPLICIT_DELEGATION, dns.rdatatype.NS)]:
@@ -2126,6 +3211,7 @@ class RecursiveAnalyst(Analyst):
         if name_obj.analysis_end is not None:
             return name_obj
 
+        stub_timer = _PhaseTimer().start()
         try:
             self.logger.info('Analyzing %s (stub)' % fmt.humanize_name(name))
 
@@ -2144,6 +3230,7 @@ class RecursiveAnalyst(Analyst):
                 pass
 
             name_obj.analysis_end = datetime.datetime.now(fmt.utc).replace(microsecond=0)
+            self._record_timing(name_obj, 'stub', stub_timer.stop())
 
             self._finalize_analysis_proper(name_obj)
             self._finalize_analysis_all(name_obj)
@@ -2199,6 +3286,8 @@ class RecursiveAnalyst(Analyst):
         name_obj = self._get_name_for_analysis(name)
         if name_obj.analysis_end is not None:
             return name_obj
+        if name == self.name:
+            self._name_obj_analyzed = name_obj
 
         try:
             try:
@@ -2215,8 +3304,9 @@ class RecursiveAnalyst(Analyst):
                 self._check_connectivity(name_obj)
 
                 # analyze ancestry
-                parent_obj, dlv_parent_obj, nxdomain_ancestor = \
-                        self._analyze_ancestry(name, name_obj.has_ns)
+                with self._timed(name_obj, 'ancestry'):
+                    parent_obj, dlv_parent_obj, nxdomain_ancestor = \
+                            self._analyze_ancestry(name, name_obj.has_ns)
 
                 name_obj.parent = parent_obj
                 name_obj.dlv_parent = dlv_parent_obj
@@ -2225,13 +3315,11 @@ class RecursiveAnalyst(Analyst):
                 self._finalize_analysis_proper(name_obj)
             finally:
                 self._cleanup_analysis_proper(name_obj)
-
-            # analyze dependencies
-            self._analyze_dependencies(name_obj)
-
-            self._finalize_analysis_all(name_obj)
-        finally:
+        except:
             self._cleanup_analysis_all(name_obj)
+            raise
+
+        self._complete_analysis_or_defer(name_obj)
 
         return name_obj
 
@@ -2267,7 +3355,7 @@ class RecursiveAnalyst(Analyst):
 
         self.logger.debug('Querying %s/%s...' % (fmt.humanize_name(name_obj.name), dns.rdatatype.to_text(rdtype)))
         query = self.diagnostic_query(name_obj.name, rdtype, dns.rdataclass.IN, servers, None, self.client_ipv4, self.client_ipv6, odd_ports=odd_ports)
-        query.execute(tm=self.transport_manager, th_factories=self.th_factories)
+        self._execute_queries(name_obj, query)
         self._add_query(name_obj, query, True)
 
         # if there were no valid responses, then exit out early
@@ -2280,7 +3368,8 @@ class RecursiveAnalyst(Analyst):
             return name_obj
 
         # now query most other queries
-        self._analyze_queries(name_obj)
+        with self._timed(name_obj, 'queries'):
+            self._analyze_queries(name_obj)
 
         if name_obj.name != dns.name.root:
             # ensure these weren't already queried for (e.g., as part of extra_rdtypes)
@@ -2289,7 +3378,7 @@ class RecursiveAnalyst(Analyst):
                 # because there is no parent on the name_obj)
                 self.logger.debug('Querying %s/%s...' % (fmt.humanize_name(name_obj.name), dns.rdatatype.to_text(dns.rdatatype.DS)))
                 query = self.diagnostic_query(name_obj.name, dns.rdatatype.DS, dns.rdataclass.IN, servers, None, self.client_ipv4, self.client_ipv6, odd_ports=odd_ports)
-                query.execute(tm=self.transport_manager, th_factories=self.th_factories)
+                self._execute_queries(name_obj, query)
                 self._add_query(name_obj, query)
 
         # for non-TLDs make NS queries after all others
@@ -2298,7 +3387,7 @@ class RecursiveAnalyst(Analyst):
             if (name_obj.name, dns.rdatatype.NS) not in name_obj.queries:
                 self.logger.debug('Querying %s/%s...' % (fmt.humanize_name(name_obj.name), dns.rdatatype.to_text(dns.rdatatype.NS)))
                 query = self.diagnostic_query(name_obj.name, dns.rdatatype.NS, dns.rdataclass.IN, servers, None, self.client_ipv4, self.client_ipv6, odd_ports=odd_ports)
-                query.execute(tm=self.transport_manager, th_factories=self.th_factories)
+                self._execute_queries(name_obj, query)
                 self._add_query(name_obj, query, True)
 
         return name_obj
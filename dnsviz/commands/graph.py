@@ -36,7 +36,7 @@ import dns.exception, dns.name
 from dnsviz.analysis import OfflineDomainNameAnalysis, DNS_RAW_VERSION
 from dnsviz.config import DNSVIZ_SHARE_PATH, JQUERY_PATH, JQUERY_UI_PATH, JQUERY_UI_CSS_PATH, RAPHAEL_PATH
 from dnsviz.format import latin1_binary_to_string as lb2s
-from dnsviz.util import TRUSTED_KEYS_ROOT, get_trusted_keys
+from dnsviz.util import TRUSTED_KEYS_ROOT, get_trusted_keys, iter_analyses, iter_names, iter_names_from_file
 
 # If the import of DNSAuthGraph fails because of the lack of pygraphviz, it
 # will be reported later
@@ -73,7 +73,7 @@ Options:
     -h             - display the usage and exit
 ''' % (err))
 
-def finish_graph(G, name_objs, rdtypes, trusted_keys, fmt, filename):
+def finish_graph(G, rdtypes, trusted_keys, fmt, filename):
     G.add_trust(trusted_keys)
     G.remove_extra_edges()
 
@@ -239,7 +239,6 @@ def main(argv):
             logger.error('Version %d.%d of JSON input is incompatible with this software.' % (major_vers, minor_vers))
             sys.exit(3)
 
-        names = []
         if '-f' in opts:
             if opts['-f'] == '-':
                 opts['-f'] = sys.stdin.fileno()
@@ -248,17 +247,9 @@ def main(argv):
             except IOError as e:
                 logger.error('%s: "%s"' % (e.strerror, opts['-f']))
                 sys.exit(3)
-            for line in f:
-                name = line.strip()
-                try:
-                    name = dns.name.from_text(name)
-                except UnicodeDecodeError as e:
-                    logger.error('%s: "%s"' % (e, name))
-                except dns.exception.DNSException:
-                    logger.error('The domain name was invalid: "%s"' % name)
-                else:
-                    names.append(name)
-            f.close()
+            # names are read from the file as they are needed, rather than
+            # all at once, so work can begin before the entire file is read
+            names = iter_names_from_file(f, logger)
         else:
             if args:
                 # python3/python2 dual compatibility
@@ -270,15 +261,7 @@ def main(argv):
                 except KeyError:
                     logger.error('No names found in json input!')
                     sys.exit(3)
-            for name in args:
-                try:
-                    name = dns.name.from_text(name)
-                except UnicodeDecodeError as e:
-                    logger.error('%s: "%s"' % (e, name))
-                except dns.exception.DNSException:
-                    logger.error('The domain name was invalid: "%s"' % name)
-                else:
-                    names.append(name)
+            names = iter_names(args, logger)
 
         if '-t' not in opts:
             try:
@@ -292,21 +275,19 @@ def main(argv):
                 logger.error('There was an error parsing the trusted keys file: "%s"' % arg)
                 sys.exit(3)
 
-        name_objs = []
-        cache = {}
-        for name in names:
-            name_str = lb2s(name.canonicalize().to_text())
-            if name_str not in analysis_structured or analysis_structured[name_str].get('stub', True):
-                logger.error('The analysis of "%s" was not found in the input.' % lb2s(name.to_text()))
-                continue
-            name_objs.append(OfflineDomainNameAnalysis.deserialize(name, analysis_structured, cache))
-
-        if not name_objs:
-            sys.exit(4)
-
+        # each name is deserialized, analyzed, and graphed in turn, as the
+        # names are consumed; only the graph (or, with -O, the graph of the
+        # current name) is held until it is drawn
+        name_count = 0
         G = DNSAuthGraph()
-        for name_obj in name_objs:
+        for name_obj in iter_analyses(OfflineDomainNameAnalysis, names, analysis_structured, logger):
+            name_count += 1
             name_obj.populate_status(trusted_keys)
+            if name_obj.partial:
+                logger.warning('The analysis of "%s" was cut short by its time limit; the results might be incomplete.' % lb2s(name_obj.name.to_text()))
+                # the queries for the name might have been skipped, so graph
+                # its zone, at least
+                G.graph_zone_auth(name_obj.zone, False)
             for qname, rdtype in name_obj.queries:
                 if rdtypes is None:
                     # if rdtypes was not specified, then graph all, with some
@@ -330,14 +311,17 @@ def main(argv):
                     name = 'root'
                 else:
                     name = lb2s(name_obj.name.canonicalize().to_text()).rstrip('.')
-                finish_graph(G, [name_obj], rdtypes, trusted_keys, fmt, '%s.%s' % (name, fmt))
+                finish_graph(G, rdtypes, trusted_keys, fmt, '%s.%s' % (name, fmt))
                 G = DNSAuthGraph()
 
+        if not name_count:
+            sys.exit(4)
+
         if '-O' not in opts:
             if '-o' not in opts or opts['-o'] == '-':
-                finish_graph(G, name_objs, rdtypes, trusted_keys, fmt, None)
+                finish_graph(G, rdtypes, trusted_keys, fmt, None)
             else:
-                finish_graph(G, name_objs, rdtypes, trusted_keys, fmt, opts['-o'])
+                finish_graph(G, rdtypes, trusted_keys, fmt, opts['-o'])
 
     except KeyboardInterrupt:
         logger.error('Interrupted.')
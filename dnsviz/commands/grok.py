@@ -40,8 +40,7 @@ except ImportError:
 import dns.exception, dns.name
 
 from dnsviz.analysis import OfflineDomainNameAnalysis, DNS_RAW_VERSION
-from dnsviz.format import latin1_binary_to_string as lb2s
-from dnsviz.util import TRUSTED_KEYS_ROOT, get_trusted_keys
+from dnsviz.util import TRUSTED_KEYS_ROOT, get_trusted_keys, iter_analyses, iter_names, iter_names_from_file
 
 # If the import of DNSAuthGraph fails because of the lack of pygraphviz, it
 # will be reported later
@@ -251,7 +250,6 @@ def main(argv):
             logger.error('Version %d.%d of JSON input is incompatible with this software.' % (major_vers, minor_vers))
             sys.exit(3)
 
-        names = []
         if '-f' in opts:
             if opts['-f'] == '-':
                 opts['-f'] = sys.stdin.fileno()
@@ -260,17 +258,9 @@ def main(argv):
             except IOError as e:
                 logger.error('%s: "%s"' % (e.strerror, opts['-f']))
                 sys.exit(3)
-            for line in f:
-                name = line.strip()
-                try:
-                    name = dns.name.from_text(name)
-                except UnicodeDecodeError as e:
-                    logger.error('%s: "%s"' % (e, name))
-                except dns.exception.DNSException:
-                    logger.error('The domain name was invalid: "%s"' % name)
-                else:
-                    names.append(name)
-            f.close()
+            # names are read from the file as they are needed, rather than
+            # all at once, so work can begin before the entire file is read
+            names = iter_names_from_file(f, logger)
         else:
             if args:
                 # python3/python2 dual compatibility
@@ -282,15 +272,7 @@ def main(argv):
                 except KeyError:
                     logger.error('No names found in json input!')
                     sys.exit(3)
-            for name in args:
-                try:
-                    name = dns.name.from_text(name)
-                except UnicodeDecodeError as e:
-                    logger.error('%s: "%s"' % (e, name))
-                except dns.exception.DNSException:
-                    logger.error('The domain name was invalid: "%s"' % name)
-                else:
-                    names.append(name)
+            names = iter_names(args, logger)
 
         if '-o' not in opts or opts['-o'] == '-':
             opts['-o'] = sys.stdout.fileno()
@@ -309,20 +291,19 @@ def main(argv):
         if trusted_keys:
             test_pygraphviz()
 
-        name_objs = []
-        cache = {}
-        for name in names:
-            name_str = lb2s(name.canonicalize().to_text())
-            if name_str not in analysis_structured or analysis_structured[name_str].get('stub', True):
-                logger.error('The analysis of "%s" was not found in the input.' % lb2s(name.to_text()))
-                continue
-            name_objs.append(OfflineDomainNameAnalysis.deserialize(name, analysis_structured, cache))
-
-        if not name_objs:
-            sys.exit(4)
-
-        d = OrderedDict()
-        for name_obj in name_objs:
+        color = '-c' not in opts and fh.isatty() and os.environ.get('TERM', 'dumb') != 'dumb'
+        if 'indent' in kwargs:
+            member_sep = ','
+        else:
+            member_sep = ', '
+
+        # each name is deserialized, analyzed, and written in turn, so the
+        # output is produced as the names are consumed.  The members of the
+        # JSON object are written individually, each name only once.
+        name_count = 0
+        names_written = set()
+        for name_obj in iter_analyses(OfflineDomainNameAnalysis, names, analysis_structured, logger):
+            name_count += 1
             name_obj.populate_status(trusted_keys)
 
             if trusted_keys:
@@ -342,13 +323,32 @@ def main(argv):
                 G.add_trust(trusted_keys)
                 name_obj.populate_response_component_status(G)
 
+            d = OrderedDict()
             name_obj.serialize_status(d, loglevel=loglevel)
+            for name_str in d:
+                if name_str in names_written:
+                    continue
+                s = json.dumps(OrderedDict(((name_str, d[name_str]),)), ensure_ascii=False, **kwargs)
+                # strip the enclosing braces (and the newline before the
+                # closing one, if indented)
+                s = s[1:s.rindex('}')].rstrip('\n')
+                if color:
+                    s = color_json(s)
+                if names_written:
+                    s = member_sep + s
+                else:
+                    s = '{' + s
+                fh.write(s.encode('utf-8'))
+                names_written.add(name_str)
 
-        if d:
-            s = json.dumps(d, ensure_ascii=False, **kwargs)
-            if '-c' not in opts and fh.isatty() and os.environ.get('TERM', 'dumb') != 'dumb':
-                s = color_json(s)
-            fh.write(s.encode('utf-8'))
+        if not name_count:
+            sys.exit(4)
+
+        if names_written:
+            if 'indent' in kwargs:
+                fh.write(b'\n}')
+            else:
+                fh.write(b'}')
 
     except KeyboardInterrupt:
         logger.error('Interrupted.')
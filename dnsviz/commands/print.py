@@ -35,7 +35,7 @@ import dns.exception, dns.name
 
 from dnsviz.analysis import TTLAgnosticOfflineDomainNameAnalysis, DNS_RAW_VERSION
 from dnsviz.format import latin1_binary_to_string as lb2s
-from dnsviz.util import TRUSTED_KEYS_ROOT, get_trusted_keys
+from dnsviz.util import TRUSTED_KEYS_ROOT, get_trusted_keys, iter_analyses, iter_names, iter_names_from_file
 
 # If the import of DNSAuthGraph fails because of the lack of pygraphviz, it
 # will be reported later
@@ -68,27 +68,33 @@ Options:
     -h             - display the usage and exit
 ''' % (err))
 
-def finish_graph(G, name_objs, rdtypes, trusted_keys, filename):
-    G.add_trust(trusted_keys)
-
+def open_output(filename):
     if filename is None:
         filename = sys.stdout.fileno()
     try:
-        fh = io.open(filename, 'w', encoding='utf-8')
+        return io.open(filename, 'w', encoding='utf-8')
     except IOError as e:
         logger.error('%s: "%s"' % (e.strerror, filename))
         sys.exit(3)
 
+def write_status(G, name_objs, rdtypes, trusted_keys, fh, processed):
+    '''Write the status of the names in name_objs, as graphed in G, to fh,
+    skipping those in processed, and add the names written to processed.'''
+
+    G.add_trust(trusted_keys)
+
     show_colors = fh.isatty() and os.environ.get('TERM', 'dumb') != 'dumb'
 
     tuples = []
-    processed = set()
     for name_obj in name_objs:
         name_obj.populate_response_component_status(G)
         tuples.extend(name_obj.serialize_status_simple(rdtypes, processed))
 
     fh.write(textualize_status_output(tuples, show_colors))
 
+def finish_graph(G, name_objs, rdtypes, trusted_keys, filename):
+    write_status(G, name_objs, rdtypes, trusted_keys, open_output(filename), set())
+
 TERM_COLOR_MAP = {
     'BOLD': '\033[1m',
     'RESET': '\033[0m',
@@ -389,7 +395,6 @@ def main(argv):
             logger.error('Version %d.%d of JSON input is incompatible with this software.' % (major_vers, minor_vers))
             sys.exit(3)
 
-        names = []
         if '-f' in opts:
             if opts['-f'] == '-':
                 opts['-f'] = sys.stdin.fileno()
@@ -398,17 +403,9 @@ def main(argv):
             except IOError as e:
                 logger.error('%s: "%s"' % (e.strerror, opts['-f']))
                 sys.exit(3)
-            for line in f:
-                name = line.strip()
-                try:
-                    name = dns.name.from_text(name)
-                except UnicodeDecodeError as e:
-                    logger.error('%s: "%s"' % (e, name))
-                except dns.exception.DNSException:
-                    logger.error('The domain name was invalid: "%s"' % name)
-                else:
-                    names.append(name)
-            f.close()
+            # names are read from the file as they are needed, rather than
+            # all at once, so work can begin before the entire file is read
+            names = iter_names_from_file(f, logger)
         else:
             if args:
                 # python3/python2 dual compatibility
@@ -420,15 +417,7 @@ def main(argv):
                 except KeyError:
                     logger.error('No names found in json input!')
                     sys.exit(3)
-            for name in args:
-                try:
-                    name = dns.name.from_text(name)
-                except UnicodeDecodeError as e:
-                    logger.error('%s: "%s"' % (e, name))
-                except dns.exception.DNSException:
-                    logger.error('The domain name was invalid: "%s"' % name)
-                else:
-                    names.append(name)
+            names = iter_names(args, logger)
 
         if '-t' not in opts:
             try:
@@ -442,21 +431,23 @@ def main(argv):
                 logger.error('There was an error parsing the trusted keys file: "%s"' % arg)
                 sys.exit(3)
 
-        name_objs = []
-        cache = {}
-        for name in names:
-            name_str = lb2s(name.canonicalize().to_text())
-            if name_str not in analysis_structured or analysis_structured[name_str].get('stub', True):
-                logger.error('The analysis of "%s" was not found in the input.' % lb2s(name.to_text()))
-                continue
-            name_objs.append(TTLAgnosticOfflineDomainNameAnalysis.deserialize(name, analysis_structured, cache))
-
-        if not name_objs:
-            sys.exit(4)
-
-        G = DNSAuthGraph()
-        for name_obj in name_objs:
+        # each name is deserialized, analyzed, and written in turn, so the
+        # output is produced as the names are consumed.  The status of a name
+        # depends only on its own chain of trust, so each is graphed
+        # separately; the names already written (e.g., common ancestors) are
+        # not written again.
+        name_count = 0
+        fh = None
+        processed = set()
+        for name_obj in iter_analyses(TTLAgnosticOfflineDomainNameAnalysis, names, analysis_structured, logger):
+            name_count += 1
+            G = DNSAuthGraph()
             name_obj.populate_status(trusted_keys)
+            if name_obj.partial:
+                logger.warning('The analysis of "%s" was cut short by its time limit; the results might be incomplete.' % lb2s(name_obj.name.to_text()))
+                # the queries for the name might have been skipped, so graph
+                # its zone, at least
+                G.graph_zone_auth(name_obj.zone, False)
             for qname, rdtype in name_obj.queries:
                 if rdtypes is None:
                     # if rdtypes was not specified, then graph all, with some
@@ -481,13 +472,16 @@ def main(argv):
                 else:
                     name = lb2s(name_obj.name.canonicalize().to_text()).rstrip('.')
                 finish_graph(G, [name_obj], rdtypes, trusted_keys, '%s.txt' % name)
-                G = DNSAuthGraph()
-
-        if '-O' not in opts:
-            if '-o' not in opts or opts['-o'] == '-':
-                finish_graph(G, name_objs, rdtypes, trusted_keys, None)
             else:
-                finish_graph(G, name_objs, rdtypes, trusted_keys, opts['-o'])
+                if fh is None:
+                    if '-o' not in opts or opts['-o'] == '-':
+                        fh = open_output(None)
+                    else:
+                        fh = open_output(opts['-o'])
+                write_status(G, [name_obj], rdtypes, trusted_keys, fh, processed)
+
+        if not name_count:
+            sys.exit(4)
 
     except KeyboardInterrupt:
         logger.error('Interrupted.')
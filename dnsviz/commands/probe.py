@@ -58,15 +58,21 @@ except ImportError:
 else:
     urlparse = urllib.parse
 
+# python3/python2 dual compatibility
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 import dns.edns, dns.exception, dns.message, dns.name, dns.rdata, dns.rdataclass, dns.rdatatype, dns.rdtypes.ANY.NS, dns.rdtypes.IN.A, dns.rdtypes.IN.AAAA, dns.resolver, dns.rrset
 
-from dnsviz.analysis import WILDCARD_EXPLICIT_DELEGATION, PrivateAnalyst, PrivateRecursiveAnalyst, OnlineDomainNameAnalysis, NetworkConnectivityException, DNS_RAW_VERSION
+from dnsviz.analysis import WILDCARD_EXPLICIT_DELEGATION, AnalysisNotifier, AnalysisStore, BoundedAnalysisCache, SharedAnalysisCache, DependencyExecutor, PreviousQueries, QueryReuseStats, PrivateAnalyst, PrivateRecursiveAnalyst, OnlineDomainNameAnalysis, NetworkConnectivityException, DNS_RAW_VERSION
 import dnsviz.format as fmt
 from dnsviz.ipaddr import IPAddr
 from dnsviz.query import StandardRecursiveQueryCD
-from dnsviz.resolver import DNSAnswer, Resolver, PrivateFullResolver
+from dnsviz.resolver import DNSAnswer, Resolver, PrivateFullResolver, SharedResolverCache, InfrastructureCache
 from dnsviz import transport
-from dnsviz.util import get_client_address, get_root_hints
+from dnsviz.util import get_client_address, get_root_hints, iter_names, iter_names_from_file
 lb2s = fmt.latin1_binary_to_string
 
 logger = logging.getLogger('dnsviz.analysis.online')
@@ -78,11 +84,44 @@ resolver = None
 bootstrap_resolver = None
 explicit_delegations = None
 odd_ports = None
+aggressive_negative = False
+hedge_delay = None
+hedge_percentile = None
+name_budget = None
+server_sample = None
+record_timings = False
+max_cached_analyses = None
+max_resolver_cache_entries = None
+dependency_workers = None
+dependency_executor = None
+analysis_notifier = None
+previous_queries = None
+# the names serialized by this process in a streaming session (-F)
+serialized_names = None
 next_port = 50053
 
 A_ROOT_IPV4 = IPAddr('198.41.0.4')
 A_ROOT_IPV6 = IPAddr('2001:503:ba3e::2:30')
 
+# names at this depth or above (i.e., the root and TLDs) are the ones whose
+# analyses are seeded from (-W) and saved to (-S) a snapshot
+WARM_START_LEVEL = 2
+RESOLVER_CACHE_KEY = '_resolver_cache._dnsviz.'
+
+# the suffix of the name of the index of a checkpoint (-K)
+CHECKPOINT_INDEX_SUFFIX = '.idx'
+# the analyses appended to a checkpoint are synced to disk (and indexed) once
+# this many have accumulated or this many seconds have passed since the last
+# sync, whichever comes first
+CHECKPOINT_SYNC_COUNT = 1000
+CHECKPOINT_SYNC_INTERVAL = 5.0
+
+# the maximum number of names analyzed concurrently in one process (-j); the
+# transport manager waits on its sockets with select(), which cannot handle
+# descriptors beyond FD_SETSIZE (typically 1024), and each name in flight
+# has at least one socket open, often several
+MAX_CONCURRENCY = 500
+
 BRACKETS_RE = re.compile(r'^\[(.*)\]$')
 PORT_RE = re.compile(r'^(.*):(\d+)$')
 STOP_RE = re.compile(r'^(.*)\+$')
@@ -112,37 +151,59 @@ def _init_stub_resolver():
         for rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
             if (rdata.target, rdtype) in explicit_delegations:
                 servers.update([IPAddr(r.address) for r in explicit_delegations[(rdata.target, rdtype)]])
-    resolver = Resolver(list(servers), StandardRecursiveQueryCD, transport_manager=tm)
+    resolver = Resolver(list(servers), StandardRecursiveQueryCD, transport_manager=tm, hedge_delay=hedge_delay, hedge_percentile=hedge_percentile)
 
-def _init_full_resolver():
+def _init_full_resolver(shared_cache=None, infra_cache=None):
     global resolver
 
     # now that we have the hints, make resolver a full resolver instead of a stub
     hints = get_root_hints()
     for key in explicit_delegations:
         hints[key] = explicit_delegations[key]
-    resolver = PrivateFullResolver(hints, odd_ports=odd_ports, transport_manager=tm)
+    resolver = PrivateFullResolver(hints, odd_ports=odd_ports, transport_manager=tm, max_cache_entries=max_resolver_cache_entries, shared_cache=shared_cache, infra_cache=infra_cache, aggressive_negative=aggressive_negative)
+
+def _init_dependency_executor():
+    global dependency_executor
+
+    if dependency_workers is not None:
+        dependency_executor = DependencyExecutor(dependency_workers)
+    else:
+        dependency_executor = DependencyExecutor()
 
 def _init_interrupt_handler():
     signal.signal(signal.SIGINT, _raise_eof)
 
-def _init_subprocess(use_full):
+def _init_subprocess(use_full, family_health=None, resolver_cache=None, infra_cache=None, notifier=None, reuse_stats=None):
+    global analysis_notifier
+
     _init_tm()
+    if family_health is not None:
+        tm.family_health = transport.CachedAddressFamilyHealth(family_health)
     if use_full:
-        _init_full_resolver()
+        _init_full_resolver(resolver_cache, infra_cache)
     else:
         _init_stub_resolver()
+    _init_dependency_executor()
+    analysis_notifier = notifier
+    # previous_queries was inherited from the parent process; count the
+    # queries it saves in the parent's statistics
+    if previous_queries is not None and reuse_stats is not None:
+        previous_queries.stats = reuse_stats
     _init_interrupt_handler()
 
 def _analyze(args):
     (cls, name, dlv_domain, try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, \
-            stop_at_explicit, extra_rdtypes, explicit_only, cache, cache_level, cache_lock) = args
+            parallel_pmtu, stop_at_explicit, extra_rdtypes, explicit_only, cache, cache_level, cache_lock) = args
     if ceiling is not None and name.is_subdomain(ceiling):
         c = ceiling
     else:
         c = name
+    if name_budget is not None:
+        deadline = time.time() + name_budget
+    else:
+        deadline = None
     try:
-        a = cls(name, dlv_domain=dlv_domain, try_ipv4=try_ipv4, try_ipv6=try_ipv6, client_ipv4=client_ipv4, client_ipv6=client_ipv6, query_class_mixin=query_class_mixin, ceiling=c, edns_diagnostics=edns_diagnostics, explicit_delegations=explicit_delegations, stop_at_explicit=stop_at_explicit, odd_ports=odd_ports, extra_rdtypes=extra_rdtypes, explicit_only=explicit_only, analysis_cache=cache, cache_level=cache_level, analysis_cache_lock=cache_lock, transport_manager=tm, th_factories=th_factories, resolver=resolver)
+        a = cls(name, dlv_domain=dlv_domain, try_ipv4=try_ipv4, try_ipv6=try_ipv6, client_ipv4=client_ipv4, client_ipv6=client_ipv6, query_class_mixin=query_class_mixin, ceiling=c, edns_diagnostics=edns_diagnostics, parallel_pmtu=parallel_pmtu, explicit_delegations=explicit_delegations, stop_at_explicit=stop_at_explicit, odd_ports=odd_ports, extra_rdtypes=extra_rdtypes, explicit_only=explicit_only, analysis_cache=cache, cache_level=cache_level, analysis_cache_lock=cache_lock, transport_manager=tm, th_factories=th_factories, resolver=resolver, dependency_executor=dependency_executor, analysis_notifier=analysis_notifier, previous_queries=previous_queries, deadline=deadline, server_sample=server_sample, record_timings=record_timings)
         return a.analyze()
     # re-raise a KeyboardInterrupt, as this means we've been interrupted
     except KeyboardInterrupt:
@@ -158,14 +219,303 @@ def _analyze(args):
         logger.exception('Error analyzing %s' % fmt.humanize_name(name))
         return None
 
+def _serialize_members(name_obj, meta_only=False, json_kwargs=None, exclude=None):
+    '''Return the serialization of name_obj and of the analyses it refers to,
+    other than those in exclude, as a tuple (members, excluded, elapsed).
+    members is a list of (name, provisional, member, timings) tuples, in which
+    provisional is whether the analysis might be superseded by a complete one
+    of the same name (i.e., it is a stub or partial), member is a JSON object
+    member, i.e., without the enclosing braces, and timings is the serialized
+    timings of the analysis, if any.  excluded is the set of
+    names not serialized because they are in exclude, and elapsed is the time
+    spent serializing.  Add the names serialized to exclude.'''
+
+    if name_obj is None:
+        return [], set(), 0
+    if json_kwargs is None:
+        json_kwargs = {}
+    start = time.time()
+    d = OrderedDict()
+    excluded = set()
+    name_obj.serialize(d, meta_only, exclude=exclude, excluded=excluded)
+    members = []
+    for name_str in d:
+        s = json.dumps(OrderedDict(((name_str, d[name_str]),)), **json_kwargs)
+        lindex = s.index('{')
+        rindex = s.rindex('}')
+        provisional = d[name_str]['stub'] or d[name_str].get('partial', False)
+        members.append((name_str, provisional, s[lindex+1:rindex], d[name_str].get('timings')))
+        if exclude is not None:
+            exclude[name_str] = provisional
+    return members, excluded, time.time() - start
+
+def _record_names(names, names_list):
+    for name in names:
+        names_list.append(lb2s(name.to_text()))
+        yield name
+
+def _analyze_serialized(args):
+    analyze_args, meta_only, json_kwargs = args
+    return _serialize_members(_analyze(analyze_args), meta_only, json_kwargs, serialized_names)
+
 class CustomQueryMixin(object):
     pass
 
+class SerializedNames(object):
+    '''A dict-like record of the names serialized so far in a streaming
+    session, each mapped to a value (e.g., whether its analysis was
+    provisional).  If max_names is specified, then at most that many names
+    below WARM_START_LEVEL are remembered, the least recently used being
+    forgotten, so that the memory used doesn't grow with the number of names
+    analyzed; the names of the root and top-level domains, which are shared by
+    all the names below them, are always remembered.  A name forgotten this
+    way might be written again, in which case the output contains it twice,
+    and the later one is used.'''
+
+    def __init__(self, max_names=None):
+        self.max_names = max_names
+        self._kept = {}
+        self._entries = OrderedDict()
+
+    def _keep(self, name_str):
+        return self.max_names is None or \
+                len(dns.name.from_text(name_str)) - 1 <= WARM_START_LEVEL
+
+    def __contains__(self, name_str):
+        return name_str in self._kept or name_str in self._entries
+
+    def __getitem__(self, name_str):
+        try:
+            return self._kept[name_str]
+        except KeyError:
+            # move the name to the most recently used position
+            value = self._entries.pop(name_str)
+            self._entries[name_str] = value
+            return value
+
+    def __setitem__(self, name_str, value):
+        if self._keep(name_str):
+            self._kept[name_str] = value
+            return
+        self._entries.pop(name_str, None)
+        self._entries[name_str] = value
+        while len(self._entries) > self.max_names:
+            self._entries.popitem(last=False)
+
+    def update(self, d):
+        for name_str in d:
+            self[name_str] = d[name_str]
+
+class NameListWriter(object):
+    '''A list of names, written incrementally to a temporary file as a JSON
+    array, so that the names need not be held in memory.'''
+
+    def __init__(self):
+        self._fh = tempfile.TemporaryFile()
+        self._count = 0
+
+    def append(self, name_str):
+        if self._count:
+            self._fh.write(b',')
+        self._fh.write(json.dumps(name_str).encode('utf-8'))
+        self._count += 1
+
+    def write_to(self, fh):
+        '''Write the JSON array to fh, and discard the temporary file.'''
+
+        self._fh.seek(0)
+        fh.write(b'[')
+        shutil.copyfileobj(self._fh, fh)
+        fh.write(b']')
+        self._fh.close()
+
+class Checkpoint(object):
+    '''An append-only record of the serialized analyses of a bulk probe, and
+    an index of the names in it, from which an interrupted probe can be
+    resumed.  The index is a file of JSON arrays, one per line, each of which
+    contains a name, whether its analysis is provisional (i.e., a stub or
+    partial), and the offset and length of the analysis in the record.  An analysis is added to the index only
+    once it has been durably written to the record.  Analyses are synced to
+    disk in batches, so those appended since the last sync are lost (and
+    analyzed again on resumption) if the probe is interrupted.
+
+    A Checkpoint can be used as the structured input to
+    OnlineDomainNameAnalysis.deserialize(), in which case the analyses are
+    read from the record as they are needed.'''
+
+    def __init__(self, filename, sync_count=CHECKPOINT_SYNC_COUNT, sync_interval=CHECKPOINT_SYNC_INTERVAL):
+        self.filename = filename
+        self.index_filename = filename + CHECKPOINT_INDEX_SUFFIX
+        self.index = OrderedDict()
+        self.sync_count = sync_count
+        self.sync_interval = sync_interval
+        # the index entries of the analyses written to the record since the
+        # last sync, by name
+        self._pending = OrderedDict()
+        self._last_sync = time.time()
+
+        end = self._load_index()
+        self._data_fh = io.open(self.filename, 'ab')
+        self._data_fh.truncate(end)
+        self._index_fh = io.open(self.index_filename, 'ab')
+        self._index_fh.truncate(self._index_size)
+        self._read_fh = io.open(self.filename, 'rb')
+        self._end = end
+
+    def _load_index(self):
+        # read the index, stopping at the first entry that is incomplete (e.g.,
+        # because of a crash while it was being written) or that refers to
+        # data not in the record, and return the size of the record up to the
+        # end of the last analysis indexed
+        self._index_size = 0
+        try:
+            data_size = os.path.getsize(self.filename)
+            index_fh = io.open(self.index_filename, 'rb')
+        except (IOError, OSError):
+            return 0
+        end = 0
+        with index_fh:
+            for line in index_fh:
+                try:
+                    name_str, provisional, offset, length = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                if not line.endswith(b'\n') or offset + length > data_size:
+                    break
+                self.index[name_str] = (provisional, offset, length)
+                end = max(end, offset + length)
+                self._index_size += len(line)
+        return end
+
+    def completed(self, name):
+        '''Return True if a complete (i.e., not provisional) analysis of name is
+        in the record.'''
+
+        name_str = lb2s(name.canonicalize().to_text())
+        if name_str in self._pending:
+            return not self._pending[name_str][0]
+        return name_str in self.index and not self.index[name_str][0]
+
+    def provisional(self):
+        '''Return a dictionary of the names in the record, mapped to whether
+        the analysis of each is provisional.'''
+
+        return dict([(name_str, self.index[name_str][0]) for name_str in self.index])
+
+    def sizes(self):
+        '''Return a dictionary of the names in the record, mapped to a tuple
+        of whether the analysis of each is provisional and its size in the output
+        (i.e., with the separating comma).'''
+
+        return dict([(name_str, (self.index[name_str][0], self.index[name_str][2] + 1)) for name_str in self.index])
+
+    def append(self, members):
+        '''Append the serialized analyses in members, as returned by
+        _serialize_members(), to the record.  They are added to the index
+        when the record is next synced, which happens once enough analyses
+        have accumulated or enough time has passed since the last sync.'''
+
+        for name_str, provisional, member in members:
+            member = member.encode('utf-8')
+            self._data_fh.write(member)
+            self._pending[name_str] = (provisional, self._end, len(member))
+            self._end += len(member)
+
+        if len(self._pending) >= self.sync_count or \
+                (self._pending and time.time() - self._last_sync >= self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        '''Durably write the analyses appended since the last sync to the
+        record, and then add them to the index.'''
+
+        self._last_sync = time.time()
+        if not self._pending:
+            return
+        self._data_fh.flush()
+        os.fsync(self._data_fh.fileno())
+
+        for name_str, (provisional, offset, length) in self._pending.items():
+            self._index_fh.write((json.dumps([name_str, provisional, offset, length]) + '\n').encode('utf-8'))
+            self.index[name_str] = (provisional, offset, length)
+        self._index_fh.flush()
+        os.fsync(self._index_fh.fileno())
+        self._pending.clear()
+
+    def _read_member(self, name_str):
+        provisional, offset, length = self.index[name_str]
+        self._read_fh.seek(offset)
+        return self._read_fh.read(length).decode('utf-8')
+
+    def __contains__(self, name_str):
+        return name_str in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __getitem__(self, name_str):
+        return json.loads('{%s}' % self._read_member(name_str))[name_str]
+
+    def write_to(self, fh):
+        '''Write the analyses in the record to fh, as the members of a JSON
+        object, each followed by a comma.'''
+
+        self.sync()
+        for name_str in self.index:
+            fh.write((self._read_member(name_str) + ',').encode('utf-8'))
+
+    def close(self):
+        self.sync()
+        self._data_fh.close()
+        self._index_fh.close()
+        self._read_fh.close()
+
+class TimingReport(object):
+    '''An aggregate of the phase timings and query counts recorded in the
+    analyses of a bulk probe (-T).  The timings are exclusive of those of the
+    phases nested in them, so they can be summed across phases.'''
+
+    def __init__(self):
+        self.analyses = 0
+        self.queries_issued = 0
+        self.phases = OrderedDict()
+
+    def add(self, name_str, timings):
+        if timings is None:
+            return
+        self.analyses += 1
+        self.queries_issued += timings['queries_issued']
+        for phase, elapsed in timings['phases'].items():
+            if phase not in self.phases:
+                self.phases[phase] = { 'total': 0, 'count': 0, 'max': -1, 'max_name': None }
+            stats = self.phases[phase]
+            stats['total'] += elapsed
+            stats['count'] += 1
+            if elapsed > stats['max']:
+                stats['max'] = elapsed
+                stats['max_name'] = name_str
+
+    def serialize(self):
+        d = OrderedDict((('analyses', self.analyses), ('queries_issued', self.queries_issued), ('phases', OrderedDict())))
+        for phase, stats in self.phases.items():
+            d['phases'][phase] = OrderedDict((
+                ('total', round(stats['total'], 3)),
+                ('mean', round(stats['total'] / stats['count'], 3)),
+                ('max', round(stats['max'], 3)),
+                ('max_name', stats['max_name']),
+            ))
+        return d
+
+    def log(self):
+        for phase, stats in sorted(self.phases.items(), key=lambda x: -x[1]['total']):
+            logger.info('%s: %.3f s total, %.3f s mean, %.3f s max (%s)' % \
+                    (phase, stats['total'], stats['total'] / stats['count'], stats['max'], stats['max_name']))
+
 class BulkAnalyst(object):
     analyst_cls = PrivateAnalyst
     use_full_resolver = True
 
-    def __init__(self, try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, stop_at_explicit, cache_level, extra_rdtypes, explicit_only, dlv_domain):
+    def __init__(self, try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, parallel_pmtu, stop_at_explicit, cache_level, extra_rdtypes, explicit_only, dlv_domain):
         self.try_ipv4 = try_ipv4
         self.try_ipv6 = try_ipv6
         self.client_ipv4 = client_ipv4
@@ -173,18 +523,121 @@ class BulkAnalyst(object):
         self.query_class_mixin = query_class_mixin
         self.ceiling = ceiling
         self.edns_diagnostics = edns_diagnostics
+        self.parallel_pmtu = parallel_pmtu
         self.stop_at_explicit = stop_at_explicit
         self.cache_level = cache_level
         self.extra_rdtypes = extra_rdtypes
         self.explicit_only = explicit_only
         self.dlv_domain = dlv_domain
 
-        self.cache = {}
+        if max_cached_analyses is not None:
+            self.cache = BoundedAnalysisCache(max_cached_analyses)
+        else:
+            self.cache = {}
         self.cache_lock = threading.Lock()
+        self.family_health = tm.family_health
 
     def _name_to_args_iter(self, names):
         for name in names:
-            yield (self.analyst_cls, name, self.dlv_domain, self.try_ipv4, self.try_ipv6, self.client_ipv4, self.client_ipv6, self.query_class_mixin, self.ceiling, self.edns_diagnostics, self.stop_at_explicit, self.extra_rdtypes, self.explicit_only, self.cache, self.cache_level, self.cache_lock)
+            yield (self.analyst_cls, name, self.dlv_domain, self.try_ipv4, self.try_ipv6, self.client_ipv4, self.client_ipv6, self.query_class_mixin, self.ceiling, self.edns_diagnostics, self.parallel_pmtu, self.stop_at_explicit, self.extra_rdtypes, self.explicit_only, self.cache, self.cache_level, self.cache_lock)
+
+    def resolver_cache_stats(self):
+        if self.use_full_resolver:
+            return resolver.cache_stats()
+        return None
+
+    def infra_cache_serialize(self):
+        if self.use_full_resolver:
+            return resolver.infra_cache.serialize()
+        return None
+
+    def reprobe_stats(self):
+        if previous_queries is not None:
+            return previous_queries.stats.serialize()
+        return None
+
+    def _resolver_cache_snapshot(self):
+        return resolver.cache_snapshot()
+
+    def _load_resolver_cache_snapshot(self, snapshot):
+        resolver.load_cache_snapshot(snapshot)
+
+    def _warm_start_level(self):
+        if self.cache_level is not None:
+            return min(self.cache_level, WARM_START_LEVEL)
+        return WARM_START_LEVEL
+
+    def warm_start(self, analysis_structured):
+        '''Seed the resolver cache and the analysis cache with the unexpired
+        contents of the output of a previous run or a cache snapshot.'''
+
+        if self.use_full_resolver and RESOLVER_CACHE_KEY in analysis_structured:
+            self._load_resolver_cache_snapshot(analysis_structured[RESOLVER_CACHE_KEY])
+
+        level = self._warm_start_level()
+        names = []
+        for name_str in analysis_structured:
+            if name_str in ('_meta._dnsviz.', RESOLVER_CACHE_KEY):
+                continue
+            name = dns.name.from_text(name_str)
+            if len(name) <= level:
+                names.append(name)
+        # ancestors are considered first, so an analysis is only used if
+        # that of its parent is also used
+        names.sort(key=len)
+
+        t = time.time()
+        cache = {}
+        for name in names:
+            name_obj = OnlineDomainNameAnalysis.deserialize(name, analysis_structured, cache)
+            if name_obj.parent is not None and name_obj.parent.name not in self.cache:
+                continue
+            expiration = name_obj.get_expiration()
+            if expiration is None or expiration <= t:
+                continue
+            logger.debug('Using analysis of %s from previous run' % fmt.humanize_name(name))
+            self.cache[name] = name_obj
+
+    def snapshot(self):
+        '''Return the analyses of the names nearest the root and the contents
+        of the resolver cache, serialized, for use with warm_start().'''
+
+        level = self._warm_start_level()
+        d = OrderedDict()
+        for name in list(self.cache.keys()):
+            if len(name) > level:
+                continue
+            # (the analysis might have been evicted from a bounded cache)
+            name_obj = self.cache.get(name)
+            if name_obj is not None and name_obj.analysis_end is not None:
+                name_obj.serialize(d)
+        d['_meta._dnsviz.'] = OrderedDict((('version', DNS_RAW_VERSION), ('names', [])))
+        if self.use_full_resolver:
+            d[RESOLVER_CACHE_KEY] = self._resolver_cache_snapshot()
+        return d
+
+    def save_snapshot(self, filename):
+        # write to a temporary file first, so an existing snapshot is
+        # replaced only by a complete one
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+        try:
+            with io.open(fd, 'wb') as fh:
+                fh.write(json.dumps(self.snapshot(), ensure_ascii=False).encode('utf-8'))
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError) as e:
+            logger.error('Error writing cache snapshot: %s' % e)
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+
+    def analyze_serialized(self, names, flush_func, meta_only=False, json_kwargs=None):
+        '''Analyze names, passing the serialization of each analysis to
+        flush_func as it completes, as returned by _serialize_members().
+        Analyses already passed to flush_func (e.g., those of common
+        ancestors) are not serialized again.'''
+
+        self.analyze(names, lambda name_obj: flush_func(_serialize_members(name_obj, meta_only, json_kwargs, serialized_names)))
 
     def analyze(self, names, flush_func=None):
         name_objs = []
@@ -225,41 +678,42 @@ class MultiProcessAnalystMixin(object):
         if name_obj.dlv_parent is not None:
             self.refresh_dependency_references(name_obj.dlv_parent, trace+[name_obj.name])
 
-        # loop until all deps have been added
+        # wait until all deps have been added
         for cname in name_obj.cname_targets:
             for target in name_obj.cname_targets[cname]:
-                while name_obj.cname_targets[cname][target] is None:
-                    try:
-                        name_obj.cname_targets[cname][target] = self.analysis_cache[target]
-                    except KeyError:
-                        time.sleep(1)
+                if name_obj.cname_targets[cname][target] is None:
+                    name_obj.cname_targets[cname][target] = self._get_dependency(name_obj, dns.rdatatype.CNAME, target)
                 self.refresh_dependency_references(name_obj.cname_targets[cname][target], trace+[name_obj.name])
         for signer in name_obj.external_signers:
-            while name_obj.external_signers[signer] is None:
-                try:
-                    name_obj.external_signers[signer] = self.analysis_cache[signer]
-                except KeyError:
-                    time.sleep(1)
+            if name_obj.external_signers[signer] is None:
+                name_obj.external_signers[signer] = self._get_dependency(name_obj, dns.rdatatype.RRSIG, signer)
             self.refresh_dependency_references(name_obj.external_signers[signer], trace+[name_obj.name])
         if self.follow_ns:
             for ns in name_obj.ns_dependencies:
-                while name_obj.ns_dependencies[ns] is None:
-                    try:
-                        name_obj.ns_dependencies[ns] = self.analysis_cache[ns]
-                    except KeyError:
-                        time.sleep(1)
+                if name_obj.ns_dependencies[ns] is None:
+                    name_obj.ns_dependencies[ns] = self._get_dependency(name_obj, dns.rdatatype.NS, ns)
                 self.refresh_dependency_references(name_obj.ns_dependencies[ns], trace+[name_obj.name])
         if self.follow_mx:
             for target in name_obj.mx_targets:
-                while name_obj.mx_targets[target] is None:
-                    try:
-                        name_obj.mx_targets[target] = self.analysis_cache[target]
-                    except KeyError:
-                        time.sleep(1)
+                if name_obj.mx_targets[target] is None:
+                    name_obj.mx_targets[target] = self._get_dependency(name_obj, dns.rdatatype.MX, target)
                 self.refresh_dependency_references(name_obj.mx_targets[target], trace+[name_obj.name])
 
-    def analyze(self):
-        name_obj = super(MultiProcessAnalystMixin, self).analyze()
+    def _get_dependency(self, name_obj, rdtype, name):
+        '''Return the analysis of name, a dependency of name_obj, from the
+        analysis cache.  If it is no longer there (e.g., because it was
+        evicted), then analyze it again; the analysis cache coordinates this
+        with any other analysis of the same name.'''
+
+        try:
+            return self.analysis_cache[name]
+        except KeyError:
+            return self._dependency_analyst(name_obj, rdtype, name).analyze()
+
+    def _analyze_all(self):
+        # (the dependencies pinned in the analysis cache are unpinned only
+        # after their references have been refreshed)
+        name_obj = super(MultiProcessAnalystMixin, self)._analyze_all()
         if not self.trace:
             self.refresh_dependency_references(name_obj)
         return name_obj
@@ -270,38 +724,130 @@ class MultiProcessAnalyst(MultiProcessAnalystMixin, PrivateAnalyst):
 class RecursiveMultiProcessAnalyst(MultiProcessAnalystMixin, PrivateRecursiveAnalyst):
     pass
 
+class AnalysisManager(multiprocessing.managers.SyncManager):
+    pass
+
+AnalysisManager.register('AddressFamilyHealth', transport.AddressFamilyHealth)
+AnalysisManager.register('SharedResolverCache', SharedResolverCache)
+AnalysisManager.register('InfrastructureCache', InfrastructureCache)
+AnalysisManager.register('AnalysisNotifier', AnalysisNotifier)
+AnalysisManager.register('AnalysisStore', AnalysisStore)
+AnalysisManager.register('QueryReuseStats', QueryReuseStats)
+
 class ParallelAnalystMixin(object):
     analyst_cls = MultiProcessAnalyst
     use_full_resolver = None
+    # the number of names in flight per process
+    window_factor = 2
 
-    def __init__(self, try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, stop_at_explicit, cache_level, extra_rdtypes, explicit_only, dlv_domain, processes):
-        super(ParallelAnalystMixin, self).__init__(try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, stop_at_explicit, cache_level, extra_rdtypes, explicit_only, dlv_domain)
-        self.manager = multiprocessing.managers.SyncManager()
+    def __init__(self, try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, parallel_pmtu, stop_at_explicit, cache_level, extra_rdtypes, explicit_only, dlv_domain, processes):
+        super(ParallelAnalystMixin, self).__init__(try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, parallel_pmtu, stop_at_explicit, cache_level, extra_rdtypes, explicit_only, dlv_domain)
+        self.manager = AnalysisManager()
         self.manager.start()
 
         self.processes = processes
 
-        self.cache = self.manager.dict()
-        self.cache_lock = self.manager.Lock()
+        # the analysis store is safe for concurrent use by multiple
+        # processes, so each analysis need only lock the cache against the
+        # other threads of its own process
+        if max_cached_analyses is not None:
+            self.cache = SharedAnalysisCache(self.manager.AnalysisStore(max_cached_analyses))
+        else:
+            self.cache = SharedAnalysisCache(self.manager.AnalysisStore())
+        self.cache_lock = None
+        self.family_health = self.manager.AddressFamilyHealth()
+        # share the resolver cache among the worker processes, so that
+        # common lookups (e.g., root and TLD servers) are performed once
+        self.resolver_cache = self.manager.SharedResolverCache(max_resolver_cache_entries)
+        self.infra_cache = self.manager.InfrastructureCache()
+        # wake workers waiting on an analysis being performed by another
+        # worker as soon as it is complete
+        self.analysis_notifier = self.manager.AnalysisNotifier()
+        self.reuse_stats = self.manager.QueryReuseStats()
+
+    def resolver_cache_stats(self):
+        if self.use_full_resolver:
+            return self.resolver_cache.stats()
+        return None
+
+    def infra_cache_serialize(self):
+        if self.use_full_resolver:
+            return self.infra_cache.serialize()
+        return None
+
+    def reprobe_stats(self):
+        if previous_queries is not None:
+            return self.reuse_stats.serialize()
+        return None
+
+    def _resolver_cache_snapshot(self):
+        return self.resolver_cache.snapshot()
+
+    def _load_resolver_cache_snapshot(self, snapshot):
+        self.resolver_cache.load(snapshot)
 
     def analyze(self, names, flush_func=None):
-        results = []
-        name_objs = []
-        pool = multiprocessing.Pool(self.processes, _init_subprocess, (self.use_full_resolver,))
+        return self._analyze_windowed(_analyze, self._name_to_args_iter(names), flush_func)
+
+    def analyze_serialized(self, names, flush_func, meta_only=False, json_kwargs=None):
+        # the analyses are serialized by the workers, which send back only
+        # the JSON, rather than pickled graphs of analysis objects.  Each
+        # worker skips the analyses that it has already sent back; those that
+        # were sent back by more than one worker are written only once, by
+        # flush_func.
+        args_iter = ((args, meta_only, json_kwargs) for args in self._name_to_args_iter(names))
+        self._analyze_windowed(_analyze_serialized, args_iter, flush_func)
+
+    def _analyze_windowed(self, func, args_iter, flush_func):
+        # keep at most this many names submitted to the pool and not yet
+        # collected, so that memory use is proportional to the number of
+        # processes, rather than to the number of names
+        window = self.processes * self.window_factor
+
+        args_iter = enumerate(args_iter)
+        results = queue.Queue()
+        pending = {}
+        name_obj_map = {}
+        pool = multiprocessing.Pool(self.processes, _init_subprocess, (self.use_full_resolver, self.family_health, self.resolver_cache, self.infra_cache, self.analysis_notifier, self.reuse_stats))
         try:
-            for args in self._name_to_args_iter(names):
-                results.append(pool.apply_async(_analyze, (args,)))
-            # loop instead of just joining, so we can check for interrupt at
-            # main process
-            for result in results:
-                name_objs.append(result.get())
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < window:
+                    try:
+                        i, args = next(args_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[i] = pool.apply_async(func, (args,), callback=lambda name_obj, i=i: results.put((i, name_obj)))
+                if not pending:
+                    break
+
+                # loop with a timeout, instead of just blocking, so we can
+                # check for interrupt at main process
+                try:
+                    i, name_obj = results.get(True, 1)
+                except queue.Empty:
+                    # the callback is not called if the analysis raised an
+                    # exception, so re-raise it here
+                    for result in list(pending.values()):
+                        if result.ready() and not result.successful():
+                            result.get()
+                    continue
+                del pending[i]
+
+                # results are handled in the order in which they complete, so
+                # that a slow name doesn't hold up the output of the others
+                if flush_func is not None:
+                    flush_func(name_obj)
+                else:
+                    name_obj_map[i] = name_obj
         except KeyboardInterrupt:
             pool.terminate()
             raise
 
         pool.close()
         pool.join()
-        return name_objs
+        return [name_obj_map[i] for i in sorted(name_obj_map)]
 
 class ParallelAnalyst(ParallelAnalystMixin, BulkAnalyst):
     analyst_cls = MultiProcessAnalyst
@@ -311,6 +857,74 @@ class RecursiveParallelAnalyst(ParallelAnalystMixin, RecursiveBulkAnalyst):
     analyst_cls = RecursiveMultiProcessAnalyst
     use_full_resolver = False
 
+class ConcurrentAnalystMixin(object):
+    '''Analyze up to concurrency names at once in a single process, with one
+    thread per name in flight.  The threads spend nearly all their time
+    waiting on the network, and they share the transport manager, the
+    resolver (and its cache), the analysis cache, and the dependency
+    executor.  Threads are started as names become available, so no more are
+    started than there are names to analyze.'''
+
+    def __init__(self, try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, parallel_pmtu, stop_at_explicit, cache_level, extra_rdtypes, explicit_only, dlv_domain, concurrency):
+        super(ConcurrentAnalystMixin, self).__init__(try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, parallel_pmtu, stop_at_explicit, cache_level, extra_rdtypes, explicit_only, dlv_domain)
+        self.concurrency = concurrency
+
+    def _start_worker(self, args_iter, args_lock, results, threads):
+        t = threading.Thread(target=self._analyze_worker, args=(args_iter, args_lock, results, threads))
+        # don't let the threads hold up exit if interrupted
+        t.daemon = True
+        threads.append(t)
+        t.start()
+
+    def _analyze_worker(self, args_iter, args_lock, results, threads):
+        while True:
+            with args_lock:
+                try:
+                    i, args = next(args_iter)
+                except StopIteration:
+                    return
+                # there might be more names, so start another thread to take
+                # the next one, up to the limit
+                if len(threads) < self.concurrency:
+                    self._start_worker(args_iter, args_lock, results, threads)
+            results.put((i, _analyze(args)))
+
+    def analyze(self, names, flush_func=None):
+        args_iter = enumerate(self._name_to_args_iter(names))
+        args_lock = threading.Lock()
+        results = queue.Queue()
+
+        threads = []
+        with args_lock:
+            self._start_worker(args_iter, args_lock, results, threads)
+
+        # loop with a timeout, instead of just blocking, so we can check for
+        # interrupt in the main thread
+        name_obj_map = {}
+        while True:
+            try:
+                i, name_obj = results.get(True, 1)
+            except queue.Empty:
+                with args_lock:
+                    alive = [t for t in threads if t.is_alive()]
+                if not alive and results.empty():
+                    break
+                continue
+            # flush analyses in the order in which they complete, so that a
+            # slow name doesn't hold up the output of the others
+            if flush_func is not None:
+                flush_func(name_obj)
+            else:
+                name_obj_map[i] = name_obj
+
+        return [name_obj_map[i] for i in sorted(name_obj_map)]
+
+class ConcurrentAnalyst(ConcurrentAnalystMixin, BulkAnalyst):
+    pass
+
+class RecursiveConcurrentAnalyst(ConcurrentAnalystMixin, RecursiveBulkAnalyst):
+    pass
+
 def name_addr_mappings_from_string(domain, addr_mappings, delegation_mapping, require_name):
     global next_port
 
@@ -638,6 +1252,17 @@ def _get_nsid_option():
 
     return dns.edns.GenericOption(dns.edns.NSID, b'')
 
+def _load_previous_queries(analysis_structured):
+    previous = PreviousQueries()
+    cache = {}
+    for name_str in analysis_structured:
+        if name_str in ('_meta._dnsviz.', RESOLVER_CACHE_KEY):
+            continue
+        OnlineDomainNameAnalysis.deserialize(dns.name.from_text(name_str), analysis_structured, cache)
+    for name_obj in cache.values():
+        previous.add_analysis(name_obj)
+    return previous
+
 def usage(err=None):
     if err is not None:
         err += '\n\n'
@@ -649,6 +1274,9 @@ Options:
     -d <level>     - set debug level
     -r <filename>  - read diagnostic queries from a file
     -t <threads>   - specify number of threads to use for parallel queries
+    -j <names>     - specify number of names to analyze concurrently in one process
+                     (at most %d)
+    -C <count>     - specify the maximum number of concurrent dependency analyses
     -4             - use IPv4 only
     -6             - use IPv6 only
     -b             - specify a source IPv4 or IPv6 address for queries
@@ -659,6 +1287,9 @@ Options:
                    - perform analysis using only the specified type(s)
     -s <server>[,<server>...]
                    - designate servers for recursive analysis
+    -H <delay>[:<percentile>]
+                   - hedge recursive queries to a second server after delay
+                     (or after the percentile of recent response times)
     -A             - query analysis against authoritative servers
     -x <domain>[+]:<server>[,<server>...]
                    - designate authoritative servers explicitly for a domain
@@ -670,10 +1301,38 @@ Options:
     -e <subnet>[:<prefix>]
                    - use the EDNS client subnet option with subnet/prefix
     -E             - include EDNS compatibility diagnostics
+    -P             - bound the PMTU using concurrent queries
+    -B <seconds>   - skip remaining diagnostic queries for a name after seconds
+    -q <servers>   - send diagnostic queries to a sample of servers per address family
+    -T             - record the time spent in each phase of each analysis
+    -M <analyses>  - bound the number of analyses kept in memory
+    -L <entries>   - bound the number of entries in the resolver cache
+    -g             - synthesize negative responses from cached NSEC(3) RRs
+    -W <filename>  - seed caches from a previous output or cache snapshot
+    -S <filename>  - save a snapshot of the caches to the specified file
+    -i <filename>  - re-probe, reusing unexpired responses from a previous output
+    -K <filename>  - record analyses to a checkpoint, resuming from it if it exists
     -p             - make json output pretty instead of minimal
     -o <filename>    - write the analysis to the specified file
     -h             - display the usage and exit
-''' % (err))
+''' % (err, MAX_CONCURRENCY))
+
+def _check_json_version(analysis_structured):
+    # check version
+    if '_meta._dnsviz.' not in analysis_structured or 'version' not in analysis_structured['_meta._dnsviz.']:
+        logger.error('No version information in JSON input.')
+        sys.exit(3)
+    try:
+        major_vers, minor_vers = [int(x) for x in str(analysis_structured['_meta._dnsviz.']['version']).split('.', 1)]
+    except ValueError:
+        logger.error('Version of JSON input is invalid: %s' % analysis_structured['_meta._dnsviz.']['version'])
+        sys.exit(3)
+    # ensure major version is a match and minor version is no greater
+    # than the current minor version
+    curr_major_vers, curr_minor_vers = [int(x) for x in str(DNS_RAW_VERSION).split('.', 1)]
+    if major_vers != curr_major_vers or minor_vers > curr_minor_vers:
+        logger.error('Version %d.%d of JSON input is incompatible with this software.' % (major_vers, minor_vers))
+        sys.exit(3)
 
 def main(argv):
     global tm
@@ -682,11 +1341,22 @@ def main(argv):
     global bootstrap_resolver
     global explicit_delegations
     global odd_ports
+    global aggressive_negative
+    global hedge_delay
+    global hedge_percentile
+    global name_budget
+    global server_sample
+    global record_timings
+    global max_cached_analyses
+    global serialized_names
+    global max_resolver_cache_entries
+    global dependency_workers
+    global previous_queries
     global next_port
 
     try:
         try:
-            opts, args = getopt.getopt(argv[1:], 'f:d:l:c:r:t:64b:u:kmpo:a:R:x:N:D:ne:EAs:Fh')
+            opts, args = getopt.getopt(argv[1:], 'f:d:l:c:r:t:j:C:64b:u:kmpo:a:R:x:N:D:ne:EPgAs:H:FW:S:i:K:B:q:TM:L:h')
         except getopt.GetoptError as e:
             usage(str(e))
             sys.exit(1)
@@ -895,6 +1565,8 @@ def main(argv):
         if '-A' not in opts:
             if '-t' in opts:
                 cls = RecursiveParallelAnalyst
+            elif '-j' in opts:
+                cls = RecursiveConcurrentAnalyst
             else:
                 cls = RecursiveBulkAnalyst
             explicit_delegations[(WILDCARD_EXPLICIT_DELEGATION, dns.rdatatype.NS)] = dns.rrset.RRset(WILDCARD_EXPLICIT_DELEGATION, dns.rdataclass.IN, dns.rdatatype.NS)
@@ -914,10 +1586,14 @@ def main(argv):
         else:
             if '-t' in opts:
                 cls = ParallelAnalyst
+            elif '-j' in opts:
+                cls = ConcurrentAnalyst
             else:
                 cls = BulkAnalyst
 
         edns_diagnostics = '-E' in opts
+        parallel_pmtu = '-P' in opts
+        aggressive_negative = '-g' in opts
 
         if '-u' in opts:
 
@@ -969,6 +1645,103 @@ def main(argv):
             usage('The number of threads used must be greater than 0.')
             sys.exit(1)
 
+        if '-j' in opts:
+            if '-t' in opts:
+                usage('The -j and -t options cannot be used together.')
+                sys.exit(1)
+            try:
+                concurrency = int(opts['-j'])
+            except ValueError:
+                usage('The number of names analyzed concurrently must be greater than 0.')
+                sys.exit(1)
+            if concurrency < 1:
+                usage('The number of names analyzed concurrently must be greater than 0.')
+                sys.exit(1)
+            if concurrency > MAX_CONCURRENCY:
+                usage('The number of names analyzed concurrently cannot be greater than %d.' % MAX_CONCURRENCY)
+                sys.exit(1)
+
+        if '-C' in opts:
+            try:
+                dependency_workers = int(opts['-C'])
+            except ValueError:
+                usage('The number of concurrent dependency analyses must be greater than 0.')
+                sys.exit(1)
+            if dependency_workers < 1:
+                usage('The number of concurrent dependency analyses must be greater than 0.')
+                sys.exit(1)
+
+        if '-H' in opts:
+            try:
+                delay, percentile = opts['-H'].split(':', 1)
+            except ValueError:
+                delay = opts['-H']
+                percentile = None
+            try:
+                hedge_delay = float(delay)
+            except ValueError:
+                usage('The hedging delay must be a number of seconds greater than 0.')
+                sys.exit(1)
+            if hedge_delay <= 0:
+                usage('The hedging delay must be a number of seconds greater than 0.')
+                sys.exit(1)
+            if percentile is not None:
+                try:
+                    hedge_percentile = float(percentile)
+                except ValueError:
+                    usage('The hedging percentile must be a number greater than 0 and less than 100.')
+                    sys.exit(1)
+                if hedge_percentile <= 0 or hedge_percentile >= 100:
+                    usage('The hedging percentile must be a number greater than 0 and less than 100.')
+                    sys.exit(1)
+                hedge_percentile /= 100.0
+
+        if '-B' in opts:
+            try:
+                name_budget = float(opts['-B'])
+            except ValueError:
+                usage('The time budget must be a number of seconds greater than 0.')
+                sys.exit(1)
+            if name_budget <= 0:
+                usage('The time budget must be a number of seconds greater than 0.')
+                sys.exit(1)
+
+        record_timings = '-T' in opts
+
+        if '-M' in opts:
+            try:
+                max_cached_analyses = int(opts['-M'])
+            except ValueError:
+                usage('The maximum number of analyses cached must be greater than 0.')
+                sys.exit(1)
+            if max_cached_analyses <= 0:
+                usage('The maximum number of analyses cached must be greater than 0.')
+                sys.exit(1)
+
+        # the names serialized are remembered within the same bound as the
+        # analyses cached
+        serialized_names = SerializedNames(max_cached_analyses)
+
+        if '-L' in opts:
+            try:
+                max_resolver_cache_entries = int(opts['-L'])
+            except ValueError:
+                usage('The maximum number of resolver cache entries must be greater than 0.')
+                sys.exit(1)
+            if max_resolver_cache_entries <= 0:
+                usage('The maximum number of resolver cache entries must be greater than 0.')
+                sys.exit(1)
+
+        if '-q' in opts:
+            try:
+                server_sample = int(opts['-q'])
+            except ValueError:
+                usage('The number of servers sampled must be greater than 0.')
+                sys.exit(1)
+            if server_sample <= 0:
+                usage('The number of servers sampled must be greater than 0.')
+                sys.exit(1)
+
         try:
             val = int(opts.get('-d', 2))
         except ValueError:
@@ -1013,23 +1786,54 @@ def main(argv):
                 logger.error('There was an error parsing the json input: "%s"' % opts['-r'])
                 sys.exit(3)
 
-            # check version
-            if '_meta._dnsviz.' not in analysis_structured or 'version' not in analysis_structured['_meta._dnsviz.']:
-                logger.error('No version information in JSON input.')
+            _check_json_version(analysis_structured)
+
+        if '-W' in opts:
+            try:
+                warm_start_str = io.open(opts['-W'], 'r', encoding='utf-8').read()
+            except IOError as e:
+                logger.error('%s: "%s"' % (e.strerror, opts['-W']))
+                sys.exit(3)
+            try:
+                warm_start_structured = json.loads(warm_start_str)
+            except ValueError:
+                logger.error('There was an error parsing the json input: "%s"' % opts['-W'])
+                sys.exit(3)
+            _check_json_version(warm_start_structured)
+
+        if '-i' in opts:
+            if '-r' in opts:
+                usage('The -i and -r options cannot be used together.')
+                sys.exit(1)
+            try:
+                previous_str = io.open(opts['-i'], 'r', encoding='utf-8').read()
+            except IOError as e:
+                logger.error('%s: "%s"' % (e.strerror, opts['-i']))
                 sys.exit(3)
             try:
-                major_vers, minor_vers = [int(x) for x in str(analysis_structured['_meta._dnsviz.']['version']).split('.', 1)]
+                previous_structured = json.loads(previous_str)
             except ValueError:
-                logger.error('Version of JSON input is invalid: %s' % analysis_structured['_meta._dnsviz.']['version'])
+                logger.error('There was an error parsing the json input: "%s"' % opts['-i'])
                 sys.exit(3)
-            # ensure major version is a match and minor version is no greater
-            # than the current minor version
-            curr_major_vers, curr_minor_vers = [int(x) for x in str(DNS_RAW_VERSION).split('.', 1)]
-            if major_vers != curr_major_vers or minor_vers > curr_minor_vers:
-                logger.error('Version %d.%d of JSON input is incompatible with this software.' % (major_vers, minor_vers))
+            _check_json_version(previous_structured)
+            previous_queries = _load_previous_queries(previous_structured)
+            del previous_str, previous_structured
+
+        checkpoint = None
+        if '-K' in opts:
+            if '-r' in opts:
+                usage('The -K and -r options cannot be used together.')
+                sys.exit(1)
+            try:
+                checkpoint = Checkpoint(opts['-K'])
+            except (IOError, OSError) as e:
+                logger.error('%s: "%s"' % (e.strerror, opts['-K']))
                 sys.exit(3)
+            if checkpoint.index:
+                logger.info('Resuming from %d analyses in checkpoint %s' % (len(checkpoint.index), opts['-K']))
+            # analyses already in the checkpoint are not serialized again
+            serialized_names.update(checkpoint.provisional())
 
-        names = []
         if '-f' in opts:
             if opts['-f'] == '-':
                 opts['-f'] = sys.stdin.fileno()
@@ -1038,17 +1842,9 @@ def main(argv):
             except IOError as e:
                 logger.error('%s: "%s"' % (e.strerror, opts['-f']))
                 sys.exit(3)
-            for line in f:
-                name = line.strip()
-                try:
-                    name = dns.name.from_text(name)
-                except UnicodeDecodeError as e:
-                    logger.error('%s: "%s"' % (e, name))
-                except dns.exception.DNSException:
-                    logger.error('The domain name was invalid: "%s"' % name)
-                else:
-                    names.append(name)
-            f.close()
+            # names are read from the file as they are needed, rather than
+            # all at once, so work can begin before the entire file is read
+            names = iter_names_from_file(f, logger)
         else:
             if args:
                 # python3/python2 dual compatibility
@@ -1060,15 +1856,7 @@ def main(argv):
                 except KeyError:
                     logger.error('No names found in json input!')
                     sys.exit(3)
-            for name in args:
-                try:
-                    name = dns.name.from_text(name)
-                except UnicodeDecodeError as e:
-                    logger.error('%s: "%s"' % (e, name))
-                except dns.exception.DNSException:
-                    logger.error('The domain name was invalid: "%s"' % name)
-                else:
-                    names.append(name)
+            names = iter_names(args, logger)
 
         if '-p' in opts:
             kwargs = { 'indent': 4, 'separators': (',', ': ') }
@@ -1085,18 +1873,71 @@ def main(argv):
             logger.error('%s: "%s"' % (e.strerror, opts['-o']))
             sys.exit(3)
 
-        def _flush(name_obj):
-            d = OrderedDict()
-            name_obj.serialize(d)
-            s = json.dumps(d, **kwargs)
-            lindex = s.index('{')
-            rindex = s.rindex('}')
-            fh.write(s[lindex+1:rindex]+',')
-
-        dnsviz_meta = { 'version': DNS_RAW_VERSION, 'names': [lb2s(n.to_text()) for n in names] }
+        # the names written so far in the streaming session, mapped to
+        # whether the analysis written was provisional (i.e., a stub or
+        # partial) and to its size in the output
+        flushed_names = SerializedNames(max_cached_analyses)
+        if checkpoint is not None:
+            flushed_names.update(checkpoint.sizes())
+        # the provisional analyses not yet written, which are held until the
+        # end, in case a complete analysis of the same name follows, so that
+        # each name is written only once
+        pending_provisional = OrderedDict()
+        flush_stats = OrderedDict((('names_written', 0), ('duplicates_suppressed', 0), ('bytes_suppressed', 0), ('names_excluded', 0), ('bytes_excluded', 0), ('serialization_time', 0)))
+
+        timing_report = TimingReport()
+
+        def _flush(serialized):
+            members, excluded, elapsed = serialized
+            flush_stats['serialization_time'] += elapsed
+            # names that were not serialized at all, because they had been
+            # already; the bytes are those of the analysis written
+            for name_str in excluded:
+                flush_stats['names_excluded'] += 1
+                if name_str in flushed_names:
+                    flush_stats['bytes_excluded'] += flushed_names[name_str][1]
+            new_members = []
+            for name_str, provisional, member, timings in members:
+                if name_str in flushed_names and (provisional or not flushed_names[name_str][0]):
+                    flush_stats['duplicates_suppressed'] += 1
+                    flush_stats['bytes_suppressed'] += len(member) + 1
+                    continue
+                if name_str not in flushed_names:
+                    flush_stats['names_written'] += 1
+                flushed_names[name_str] = (provisional, len(member) + 1)
+                timing_report.add(name_str, timings)
+                new_members.append((name_str, provisional, member))
+            # with a checkpoint, the output is written from the checkpoint
+            # once the analysis is complete
+            if checkpoint is not None:
+                checkpoint.append(new_members)
+            else:
+                for name_str, provisional, member in new_members:
+                    if provisional:
+                        pending_provisional[name_str] = member
+                    else:
+                        pending_provisional.pop(name_str, None)
+                        fh.write((member + ',').encode('utf-8'))
 
         flush = '-F' in opts
 
+        # the names analyzed are recorded as they are consumed; when the
+        # output is streamed, they are recorded in a temporary file, rather
+        # than in memory, until the metadata is written.  Otherwise, every
+        # analysis is held until the output is written as a whole, so the
+        # names are simply held with them.
+        if (flush or checkpoint is not None) and '-r' not in opts:
+            names_list = NameListWriter()
+            dnsviz_meta = { 'version': DNS_RAW_VERSION }
+        else:
+            names_list = []
+            dnsviz_meta = { 'version': DNS_RAW_VERSION, 'names': names_list }
+        names = _record_names(names, names_list)
+        if checkpoint is not None:
+            # names whose analyses are already in the checkpoint are not
+            # analyzed again (but are still listed in the metadata)
+            names = (name for name in names if not checkpoint.completed(name))
+
         if '-n' in opts or '-e' in opts:
             CustomQueryMixin.edns_options = []
             if '-e' in opts:
@@ -1117,20 +1958,62 @@ def main(argv):
                 name_objs.append(OnlineDomainNameAnalysis.deserialize(name, analysis_structured, cache))
         else:
             if '-t' in opts:
-                a = cls(try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, stop_at_explicit, cache_level, rdtypes, explicit_only, dlv_domain, processes)
+                a = cls(try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, parallel_pmtu, stop_at_explicit, cache_level, rdtypes, explicit_only, dlv_domain, processes)
             else:
                 if cls.use_full_resolver:
                     _init_full_resolver()
                 else:
                     _init_stub_resolver()
-                a = cls(try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, stop_at_explicit, cache_level, rdtypes, explicit_only, dlv_domain)
-                if flush:
-                    fh.write('{')
-                    a.analyze(names, _flush)
-                    fh.write('"_meta._dnsviz.":%s}' % json.dumps(dnsviz_meta, **kwargs))
-                    sys.exit(0)
+                _init_dependency_executor()
+                if '-j' in opts:
+                    a = cls(try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, parallel_pmtu, stop_at_explicit, cache_level, rdtypes, explicit_only, dlv_domain, concurrency)
+                else:
+                    a = cls(try_ipv4, try_ipv6, client_ipv4, client_ipv6, query_class_mixin, ceiling, edns_diagnostics, parallel_pmtu, stop_at_explicit, cache_level, rdtypes, explicit_only, dlv_domain)
+            if '-W' in opts:
+                a.warm_start(warm_start_structured)
+
+            if checkpoint is not None:
+                # the analyses of the root and TLDs in the checkpoint are
+                # reused, so they aren't re-analyzed after a restart
+                a.warm_start(checkpoint)
+
+            if flush or checkpoint is not None:
+                if checkpoint is None:
+                    fh.write(b'{')
+                a.analyze_serialized(names, _flush, meta_only, kwargs)
+                if checkpoint is not None:
+                    fh.write(b'{')
+                    checkpoint.write_to(fh)
+                    checkpoint.close()
+                for member in pending_provisional.values():
+                    fh.write((member + ',').encode('utf-8'))
+                flush_stats['serialization_time'] = round(flush_stats['serialization_time'], 3)
+                dnsviz_meta['family_health'] = a.family_health.serialize()
+                dnsviz_meta['resolver_cache'] = a.resolver_cache_stats()
+                dnsviz_meta['infra_cache'] = a.infra_cache_serialize()
+                if '-i' in opts:
+                    dnsviz_meta['reprobe'] = a.reprobe_stats()
+                dnsviz_meta['flush'] = flush_stats
+                if record_timings:
+                    dnsviz_meta['timings'] = timing_report.serialize()
+                    timing_report.log()
+                s = json.dumps(dnsviz_meta, **kwargs)
+                fh.write(b'"_meta._dnsviz.":{"names":')
+                names_list.write_to(fh)
+                fh.write((',%s}' % s[s.index('{')+1:]).encode('utf-8'))
+                if '-S' in opts:
+                    a.save_snapshot(opts['-S'])
+                sys.exit(0)
 
             name_objs = a.analyze(names)
+            dnsviz_meta['family_health'] = a.family_health.serialize()
+            dnsviz_meta['resolver_cache'] = a.resolver_cache_stats()
+            dnsviz_meta['infra_cache'] = a.infra_cache_serialize()
+            if '-i' in opts:
+                dnsviz_meta['reprobe'] = a.reprobe_stats()
+                logger.info('Reused %(queries_reused)d queries from the previous analysis; issued %(queries_issued)d.' % dnsviz_meta['reprobe'])
+            if '-S' in opts:
+                a.save_snapshot(opts['-S'])
 
         name_objs = [x for x in name_objs if x is not None]
 
@@ -1140,6 +2023,11 @@ def main(argv):
         d = OrderedDict()
         for name_obj in name_objs:
             name_obj.serialize(d, meta_only)
+        if record_timings:
+            for name_str in d:
+                timing_report.add(name_str, d[name_str].get('timings'))
+            dnsviz_meta['timings'] = timing_report.serialize()
+            timing_report.log()
         d['_meta._dnsviz.'] = dnsviz_meta
 
         try:
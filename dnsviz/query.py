@@ -165,15 +165,20 @@ class NoValidServersToQuery(Exception):
     issue queries to all the servers.'''
     pass
 
-class DNSQueryRetryAttempt:
+class DNSQueryRetryAttempt(object):
     '''A failed attempt at a DNS query that invokes a subsequent retry.'''
 
-    def __init__(self, response_time, cause, cause_arg, action, action_arg):
+    __slots__ = ('response_time', 'cause', 'cause_arg', 'action', 'action_arg', 'concurrent')
+
+    def __init__(self, response_time, cause, cause_arg, action, action_arg, concurrent=False):
         self.response_time = response_time
         self.cause = cause
         self.cause_arg = cause_arg
         self.action = action
         self.action_arg = action_arg
+        # whether the attempt was one of a round of queries issued
+        # concurrently, rather than one after the other
+        self.concurrent = concurrent
 
     def __repr__(self):
         return '<Retry: %s -> %s>' % (retry_causes[self.cause], retry_actions[self.action])
@@ -194,6 +199,8 @@ class DNSQueryRetryAttempt:
         d['action'] = retry_actions.get(self.action, 'UNKNOWN')
         if self.action_arg is not None:
             d['action_arg'] = self.action_arg
+        if self.concurrent:
+            d['concurrent'] = True
         return d
 
     @classmethod
@@ -226,7 +233,7 @@ class DNSQueryRetryAttempt:
             action_arg = d['action_arg']
         else:
             action_arg = None
-        return DNSQueryRetryAttempt(response_time, cause, cause_arg, action, action_arg)
+        return DNSQueryRetryAttempt(response_time, cause, cause_arg, action, action_arg, d.get('concurrent', False))
 
 class DNSResponseHandlerFactory(object):
     '''A factory class that holds arguments to create a DNSResponseHandler instance.'''
@@ -268,7 +275,26 @@ class DNSResponseHandler(object):
         '''Handle a DNS response.  The response might be an actual DNS message or some type
         of exception that was raised during query.'''
 
-        raise NotImplemented
+        raise NotImplementedError()
+
+    def get_probe_payloads(self):
+        '''Return a list of UDP max payload values for which queries should be
+        issued concurrently, or None if only a single query should be
+        issued.'''
+
+        return None
+
+    def handle_probes(self, results):
+        '''Handle the responses (or exceptions) to a round of concurrent
+        queries requested with get_probe_payloads().  results is a list of
+        (payload, response_wire, response, response_time) tuples.  Return a
+        tuple (history, result, passthrough), in which history is a list of
+        DNSQueryRetryAttempt instances to be added to the history, and result
+        is the item of results recorded last.  If passthrough is True, then
+        history does not include result, which is instead to be handled by
+        all the response handlers, like the response to any other query.'''
+
+        raise NotImplementedError()
 
     def _get_retry_qty(self, cause):
         '''Return the number of retries associated with the DNS query, optionally limited to
@@ -643,6 +669,150 @@ class PMTUBoundingHandler(DNSResponseHandler):
         elif self._state == self.TCP_FINAL:
             pass
 
+class ParallelPMTUBoundingHandler(PMTUBoundingHandler):
+    '''A PMTUBoundingHandler that, once the initial bounds have been
+    established, issues queries with many UDP max payload values
+    concurrently, rather than one at a time.  Each round uses as few probes
+    (at most max_probes) as allow the bounds to converge in the fewest
+    rounds, so that typically it takes two rounds.
+
+    The probes of a round are recorded in the history in order of increasing
+    payload, each marked as concurrent.  If none of them is conclusive (e.g.,
+    all got an error), then the response to the largest is handled by the
+    other response handlers, e.g., to disable EDNS or to use TCP.'''
+
+    def __init__(self, reduced_payload, initial_timeouts, bounding_timeout, subhandlers, max_probes=32):
+        super(ParallelPMTUBoundingHandler, self).__init__(reduced_payload, initial_timeouts, bounding_timeout, subhandlers)
+        self._max_probes = max_probes
+        self._probe_payloads = None
+
+    def _next_probe_payloads(self):
+        span = self._upper_bound + 1 - self._lower_bound
+
+        # find the fewest rounds in which the bounds can converge, and then
+        # the fewest probes per round that achieve that
+        rounds = 1
+        while (self._max_probes + 1)**rounds < span:
+            rounds += 1
+        probes = 1
+        while probes < self._max_probes and (probes + 1)**rounds < span:
+            probes += 1
+
+        payloads = set()
+        for i in range(1, probes + 1):
+            payload = self._lower_bound + (span * i)//(probes + 1)
+            if self._lower_bound < payload <= self._upper_bound:
+                payloads.add(payload)
+        return sorted(payloads)
+
+    def handle(self, response_wire, response, response_time):
+        retry = super(ParallelPMTUBoundingHandler, self).handle(response_wire, response, response_time)
+
+        # upon entering the bounding state, replace the single payload
+        # selected for the next query with the first round of probes
+        if retry is not None and self._state == self.PICKLE and self._probe_payloads is None:
+            payloads = self._next_probe_payloads()
+            if payloads:
+                self._probe_payloads = payloads
+                self._request.payload = retry.action_arg = payloads[0]
+        return retry
+
+    def get_probe_payloads(self):
+        if self._state == self.PICKLE:
+            return self._probe_payloads
+        return None
+
+    def handle_probes(self, results):
+        # python3/python2 dual compatibility
+        map_func = lambda x: x
+        for payload, response_wire, response, response_time in results:
+            if isinstance(response_wire, str):
+                map_func = lambda x: ord(x)
+                break
+
+        results = sorted(results, key=lambda x: x[0])
+
+        causes = []
+        lower_bound = self._lower_bound
+        timeouts = []
+        valid = []
+        errors = []
+        for result in results:
+            payload, response_wire, response, response_time = result
+            if isinstance(response, dns.exception.Timeout):
+                causes.append((response_time, RETRY_CAUSE_TIMEOUT, None))
+                timeouts.append(payload)
+            elif isinstance(response, dns.message.Message) and response.rcode() in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+                if response_wire is not None and len(response_wire) >= self._water_mark:
+                    causes.append((response_time, RETRY_CAUSE_DIAGNOSTIC, len(response_wire)))
+                    lower_bound = max(lower_bound, payload)
+                    valid.append(result)
+                elif response_wire is not None and map_func(response_wire[2]) & 0x02:
+                    # a short, truncated response
+                    causes.append((response_time, RETRY_CAUSE_TC_SET, len(response_wire)))
+                    errors.append(result)
+                else:
+                    # a short response (perhaps rate limited) is
+                    # inconclusive
+                    causes.append((response_time, RETRY_CAUSE_DIAGNOSTIC, None))
+            else:
+                # an error
+                causes.append((response_time, RETRY_CAUSE_DIAGNOSTIC, None))
+                errors.append(result)
+
+        upper_bound = self._upper_bound
+        for payload in timeouts:
+            if payload > lower_bound:
+                upper_bound = min(upper_bound, payload - 1)
+        conclusive = lower_bound > self._lower_bound or upper_bound < self._upper_bound
+        self._lower_bound = lower_bound
+        self._upper_bound = max(upper_bound, lower_bound)
+
+        order = list(range(len(results)))
+        passthrough = False
+        self._probe_payloads = None
+        if not conclusive and errors:
+            # stop bounding, and let the other handlers deal with the error
+            self._state = self.INVALID
+            final = results.index(errors[-1])
+            passthrough = True
+        elif not conclusive or self._upper_bound - self._lower_bound <= 1:
+            self._params['tcp'] = True
+            self._state = self.TCP_FINAL
+            # record last the largest probe that got a complete response,
+            # and leave the payload at that value, rather than at that of a
+            # probe that timed out
+            if valid:
+                final = results.index(valid[-1])
+            else:
+                final = len(results) - 1
+            next_action = (RETRY_ACTION_USE_TCP, None)
+        else:
+            self._probe_payloads = self._next_probe_payloads()
+            final = len(results) - 1
+            next_action = (RETRY_ACTION_CHANGE_UDP_MAX_PAYLOAD, self._probe_payloads[0])
+        order.remove(final)
+        order.append(final)
+
+        history = []
+        for i, j in enumerate(order):
+            if i < len(order) - 1:
+                action = (RETRY_ACTION_CHANGE_UDP_MAX_PAYLOAD, results[order[i + 1]][0])
+            elif passthrough:
+                break
+            else:
+                action = next_action
+            response_time, cause, cause_arg = causes[j]
+            history.append(DNSQueryRetryAttempt(response_time, cause, cause_arg, action[0], action[1], True))
+
+        if self._state == self.TCP_FINAL and not valid:
+            self._request.payload = self._lower_bound
+        elif self._state == self.PICKLE:
+            self._request.payload = self._probe_payloads[0]
+        else:
+            self._request.payload = results[final][0]
+        return history, results[final], passthrough
+
 class ChangeTimeoutOnTimeoutHandler(ActionIndependentDNSResponseHandler):
     '''Modify timeout value when a certain number of timeouts is reached.'''
 
@@ -710,6 +880,11 @@ class DNSQueryHandler:
         self._server = server
         self._client = client
 
+        self._probes = {}
+        self._probe_results = []
+        self._probe_sources = {}
+        self._probe_handler = None
+
         for handler in self._response_handlers:
             handler.set_context(self.params, self.history, self.request)
 
@@ -730,6 +905,79 @@ class DNSQueryHandler:
         return transport.DNSQueryTransportMeta(self.request.to_wire(), self._server, self.params['tcp'], self.get_timeout(), \
                 self.query.odd_ports.get(self._server, self.query.port), src=self._client, sport=self.params['sport'])
 
+    def get_query_transport_metas(self):
+        '''Return a list of DNSQueryTransportMeta instances to be issued
+        concurrently.  Unless a response handler has requested concurrent
+        probes, the list contains a single instance.'''
+
+        for handler in self._response_handlers:
+            payloads = handler.get_probe_payloads()
+            if payloads:
+                break
+        else:
+            return [self.get_query_transport_meta()]
+
+        self._probe_handler = handler
+        orig_payload = self.request.payload
+        qtms = []
+        for payload in payloads:
+            self.request.payload = payload
+            qtm = self.get_query_transport_meta()
+            self._probes[qtm] = payload
+            qtms.append(qtm)
+        self.request.payload = orig_payload
+        return qtms
+
+    def is_probe(self, qtm):
+        return qtm in self._probes
+
+    def add_probe_response(self, qtm, response_wire, response, response_time):
+        '''Record the response to one of a round of concurrent probes.  Return
+        True if this was the last outstanding probe of the round; False
+        otherwise.'''
+
+        payload = self._probes.pop(qtm)
+        self._probe_results.append((payload, response_wire, response, response_time))
+        self._probe_sources[payload] = (qtm.src, qtm.sport)
+        return not self._probes
+
+    def handle_probe_responses(self):
+        '''Hand the responses to a complete round of concurrent probes to the
+        response handler that requested them.  Return a (response_wire,
+        response, response_time) tuple, if a response is to be accepted, or
+        None if the query is to be re-submitted.'''
+
+        results = self._probe_results
+        sources = self._probe_sources
+        self._probe_results = []
+        self._probe_sources = {}
+        history, result, passthrough = self._probe_handler.handle_probes(results)
+        self._probe_handler = None
+        self.params['sport'] = None
+
+        payload, response_wire, response, response_time = result
+        if passthrough:
+            self.history.extend(history)
+            history_len = len(self.history)
+            client, sport = sources[payload]
+            response = self.handle_response(response_wire, response, response_time, client, sport)
+            for retry in self.history[history_len:]:
+                retry.concurrent = True
+            if response is None:
+                return None
+            return response_wire, response, response_time
+
+        # if the lifetime has expired, then accept the response to the probe
+        # recorded last
+        if self.get_remaining_lifetime() <= 0:
+            self.history.extend(history[:-1])
+            return response_wire, response, response_time
+
+        self.history.extend(history)
+        self._set_query_time()
+        self._reset_wait()
+        return None
+
     def get_remaining_lifetime(self):
         if self._expiration is None:
             # send arbitrarily high value
@@ -938,6 +1186,17 @@ class DNSQuery(object):
 
         return clone
 
+    def params(self):
+        '''Return the parameters of the query, other than its question, as a
+        hashable tuple.'''
+
+        edns_options_str = b''
+        for o in self.edns_options:
+            s = io.BytesIO()
+            o.to_wire(s)
+            edns_options_str += struct.pack(b'!H', o.otype) + s.getvalue()
+        return (self.flags, self.edns, self.edns_max_udp_payload, self.edns_flags, edns_options_str, self.tcp)
+
     def join(self, query, bailiwick_map, default_bailiwick):
         if not (isinstance(query, DNSQuery)):
             raise ValueError('A DNSQuery instance can only be joined with another DNSQuery instance.')
@@ -1162,12 +1421,7 @@ class MultiQuery(object):
         if not (self.qname == query.qname and self.rdtype == query.rdtype and self.rdclass == query.rdclass):
             raise ValueError('DNS query information must be the same as that to which query is being joined.')
 
-        edns_options_str = b''
-        for o in query.edns_options:
-            s = io.BytesIO()
-            o.to_wire(s)
-            edns_options_str += struct.pack(b'!H', o.otype) + s.getvalue()
-        params = (query.flags, query.edns, query.edns_max_udp_payload, query.edns_flags, edns_options_str, query.tcp)
+        params = query.params()
         if params in self.queries:
             self.queries[params] = self.queries[params].join(query, bailiwick_map, default_bailiwick)
         else:
@@ -1272,7 +1526,15 @@ class ExecutableDNSQuery(DNSQuery):
 
     @classmethod
     def execute_queries(cls, *queries, **kwargs):
-        '''Excecute the query to a given server, and handle it appropriately.'''
+        '''Excecute the query to a given server, and handle it appropriately.
+
+        If hedge_groups is specified, it is a list of sequences of queries,
+        each of which is sent hedge_delay seconds after the one before it in
+        its sequence.  Once any query in a sequence receives a complete and
+        valid response, the others are abandoned: those not yet sent are not
+        sent, and responses to the others are ignored.  If sent_queries is
+        specified, it is a set, to which each query is added once it is
+        actually sent (i.e., if it wasn't abandoned first).'''
 
         tm = kwargs.get('tm', None)
         if tm is None:
@@ -1289,15 +1551,32 @@ class ExecutableDNSQuery(DNSQuery):
         ignore_queryid = kwargs.get('ignore_queryid', True)
         response_wire_map = {}
 
+        hedge_delay = kwargs.get('hedge_delay', None) or 0
+        sent_queries = kwargs.get('sent_queries', None)
+        hedge_groups = {}
+        hedge_delays = {}
+        for group in kwargs.get('hedge_groups', ()):
+            for i, query in enumerate(group):
+                hedge_groups[query] = group
+                hedge_delays[query] = i * hedge_delay
+
         query_handlers = {}
-        query_time = None
         for th_factory in th_factories:
-            if not th_factory.cls.singleton:
-                th = th_factory.build(processed_queue=response_queue)
+            # a transport handler that is not a singleton carries several
+            # queries, which are sent together at the latest of their query
+            # times; so that the hedging delay of some queries doesn't hold up
+            # the others, the queries are batched by their delay
+            batches = {}
 
             for query in queries:
+                # avoid servers in an address family that appears to be
+                # blackholed, as long as there are others to query
+                servers = [x for x in query.servers if not tm.family_health.is_blackholed(x.version)]
+                if not servers:
+                    servers = query.servers
+
                 qtm_for_server = False
-                for server in query.servers:
+                for server in servers:
                     if not th_factory.cls.allow_loopback_query and (LOOPBACK_IPV4_RE.match(server) or server == LOOPBACK_IPV6):
                         continue
                     if not th_factory.cls.allow_private_query and (RFC_1918_RE.match(server) or LINK_LOCAL_RE.match(server) or UNIQ_LOCAL_RE.match(server)):
@@ -1305,6 +1584,8 @@ class ExecutableDNSQuery(DNSQuery):
 
                     qtm_for_server = True
                     qh = query.get_query_handler(server)
+                    delay = hedge_delays.get(query, 0)
+                    qh.query_time += delay
                     qtm = qh.get_query_transport_meta()
                     query_handlers[qtm] = qh
 
@@ -1314,21 +1595,28 @@ class ExecutableDNSQuery(DNSQuery):
                         th.init_req()
                         bisect.insort(request_list, (qh.query_time, th))
                     else:
+                        if delay not in batches:
+                            batches[delay] = [th_factory.build(processed_queue=response_queue), None]
+                        th, query_time = batches[delay]
                         # find the maximum query time
                         if query_time is None or qh.query_time > query_time:
-                            query_time = qh.query_time
+                            batches[delay][1] = qh.query_time
                         th.add_qtm(qtm)
 
                 if not qtm_for_server:
                     raise NoValidServersToQuery('No valid servers to query!')
 
-            if not th_factory.cls.singleton:
+            for delay in sorted(batches):
+                th, query_time = batches[delay]
                 th.init_req()
                 bisect.insort(request_list, (query_time, th))
 
         while query_handlers:
             while request_list and time.time() >= request_list[0][0]:
-                tm.handle_msg_nowait(request_list.pop(0)[1])
+                th = request_list.pop(0)[1]
+                if sent_queries is not None:
+                    sent_queries.update([query_handlers[qtm].query for qtm in th.qtms if qtm in query_handlers])
+                tm.handle_msg_nowait(th)
 
             t = time.time()
             if request_list and t < request_list[0][0]:
@@ -1346,8 +1634,11 @@ class ExecutableDNSQuery(DNSQuery):
             newth = th.factory.build(processed_queue=response_queue)
             query_time = None
             for qtm in th.qtms:
-                # find its matching query meta information
-                qh = query_handlers.pop(qtm)
+                # find its matching query meta information; if there is none,
+                # then the query was abandoned
+                qh = query_handlers.pop(qtm, None)
+                if qh is None:
+                    continue
                 query = qh.query
 
                 # define response as either a Message created from parsing
@@ -1370,16 +1661,45 @@ class ExecutableDNSQuery(DNSQuery):
                 else:
                     msg_size = None
                 response_time = round(qtm.end_time - qtm.start_time, 3)
-                response = qh.handle_response(qtm.res, response, response_time, qtm.src, qtm.sport)
+
+                if qtm.res:
+                    tm.family_health.record(qh._server, True)
+                elif isinstance(response, dns.exception.Timeout) or \
+                        (isinstance(response, socket.error) and response.errno in (errno.EHOSTUNREACH, errno.ENETUNREACH)):
+                    tm.family_health.record(qh._server, False)
+
+                if qh.is_probe(qtm):
+                    # wait for the remaining probes in this round
+                    if not qh.add_probe_response(qtm, qtm.res, response, response_time):
+                        continue
+                    accepted = qh.handle_probe_responses()
+                    if accepted is None:
+                        response = None
+                    else:
+                        response_wire, response, response_time = accepted
+                        if response_wire:
+                            msg_size = len(response_wire)
+                        else:
+                            msg_size = None
+                else:
+                    response = qh.handle_response(qtm.res, response, response_time, qtm.src, qtm.sport)
 
                 # if no response was returned, then resubmit the modified query
                 if response is None:
-                    qtm = qh.get_query_transport_meta()
                     # find the maximum query time
                     if query_time is None or qh.query_time > query_time:
                         query_time = qh.query_time
-                    query_handlers[qtm] = qh
-                    newth.add_qtm(qtm)
+                    for qtm1 in qh.get_query_transport_metas():
+                        query_handlers[qtm1] = qh
+                        # singleton transport handlers can only carry one
+                        # query, so concurrent probes each get their own
+                        if th.factory.cls.singleton and newth.qtms:
+                            th1 = th.factory.build(processed_queue=response_queue)
+                            th1.add_qtm(qtm1)
+                            th1.init_req()
+                            bisect.insort(request_list, (qh.query_time, th1))
+                        else:
+                            newth.add_qtm(qtm1)
                     continue
 
                 # otherwise store away the response (or error), history, and response time
@@ -1446,6 +1766,31 @@ class ExecutableDNSQuery(DNSQuery):
                 # This query is now executed, at least in part
                 query._executed = True
 
+                # a valid response makes the other queries in the hedge
+                # group unnecessary
+                if query in hedge_groups and response_obj.is_valid_response() and response_obj.is_complete_response():
+                    abandoned = set()
+                    for query1 in hedge_groups.pop(query):
+                        hedge_groups.pop(query1, None)
+                        if query1 is query:
+                            continue
+                        for qtm1 in [x for x in query_handlers if query_handlers[x].query is query1]:
+                            del query_handlers[qtm1]
+                            abandoned.add(qtm1)
+                    # don't send queries that haven't been sent yet, removing
+                    # them from the batches in which they would be sent
+                    pending = []
+                    for query_time1, th1 in request_list:
+                        qtms = [x for x in th1.qtms if x not in abandoned]
+                        if len(qtms) < len(th1.qtms):
+                            if not qtms:
+                                continue
+                            th1.qtms = qtms
+                            th1.init_req()
+                        pending.append((query_time1, th1))
+                    request_list = pending
+                    newth.qtms = [x for x in newth.qtms if x not in abandoned]
+
             if newth.qtms:
                 newth.init_req()
                 bisect.insort(request_list, (query_time, newth))
@@ -1724,6 +2069,45 @@ class RecursivePMTUDiagnosticQuery(RecursiveDNSSECQuery):
     max_attempts = 15
     lifetime = 25.0
 
+class ParallelPMTUDiagnosticQuery(DNSSECQuery):
+    '''A PMTUDiagnosticQuery that bounds the PMTU by probing several UDP max
+    payload values concurrently.'''
+
+    response_handlers = [ParallelPMTUBoundingHandler(512, 4, 1.0,
+            (MaxTimeoutsHandler(8),
+                LifetimeHandler(18.0),
+                ChangeTimeoutOnTimeoutHandler(2.0, 2),
+                ChangeTimeoutOnTimeoutHandler(4.0, 3),
+                ChangeTimeoutOnTimeoutHandler(1.0, 4),
+                ChangeTimeoutOnTimeoutHandler(2.0, 5))),
+            UseTCPOnTCFlagHandler(),
+            DisableEDNSOnFormerrHandler(), DisableEDNSOnRcodeHandler(),
+            ClearEDNSFlagOnTimeoutHandler(dns.flags.DO, 6), DisableEDNSOnTimeoutHandler(7)]
+
+    query_timeout = 1.0
+    max_attempts = 15
+    lifetime = 18.0
+
+class RecursiveParallelPMTUDiagnosticQuery(RecursiveDNSSECQuery):
+    '''A RecursivePMTUDiagnosticQuery that bounds the PMTU by probing several
+    UDP max payload values concurrently.'''
+
+    response_handlers = [ParallelPMTUBoundingHandler(512, 5, 1.0,
+            (MaxTimeoutsHandler(8),
+                LifetimeHandler(25.0),
+                ChangeTimeoutOnTimeoutHandler(2.0, 2),
+                ChangeTimeoutOnTimeoutHandler(4.0, 3),
+                ChangeTimeoutOnTimeoutHandler(8.0, 4),
+                ChangeTimeoutOnTimeoutHandler(1.0, 5),
+                ChangeTimeoutOnTimeoutHandler(2.0, 6))),
+            UseTCPOnTCFlagHandler(),
+            DisableEDNSOnFormerrHandler(), SetFlagOnRcodeHandler(dns.flags.CD, dns.rcode.SERVFAIL), DisableEDNSOnRcodeHandler(),
+            ClearEDNSFlagOnTimeoutHandler(dns.flags.DO, 7), DisableEDNSOnTimeoutHandler(8)]
+
+    query_timeout = 1.0
+    max_attempts = 15
+    lifetime = 25.0
+
 class TruncationDiagnosticQuery(DNSSECQuery):
     '''A simple query to test the results of a query with capabilities of only
     receiving back a small (512 byte) payload.'''
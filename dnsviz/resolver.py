@@ -22,19 +22,30 @@
 from __future__ import unicode_literals
 
 import bisect
+import collections
+import heapq
 import io
 import math
+import os
 import random
+import sys
 import threading
 import time
 
+# minimal support for python2.6
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
 from . import query
 from .ipaddr import *
 from . import response as Response
 from . import transport
 from . import util
+from .format import latin1_binary_to_string as lb2s
 
-import dns.rdataclass, dns.exception, dns.message, dns.rcode, dns.resolver
+import dns.rdataclass, dns.exception, dns.message, dns.rcode, dns.resolver, dns.rrset
 
 MAX_CNAME_REDIRECTION = 20
 
@@ -98,7 +109,12 @@ class DNSAnswerNoAnswerAllowed(DNSAnswer):
 class Resolver:
     '''A simple stub DNS resolver.'''
 
-    def __init__(self, servers, query_cls, timeout=1.0, max_attempts=5, lifetime=15.0, shuffle=False, client_ipv4=None, client_ipv6=None, port=53, transport_manager=None, th_factories=None):
+    # the number of recent response times from which the hedging delay is
+    # derived, if hedge_percentile is specified
+    HEDGE_SAMPLES = 100
+
+    def __init__(self, servers, query_cls, timeout=1.0, max_attempts=5, lifetime=15.0, shuffle=False, client_ipv4=None, client_ipv6=None, port=53, transport_manager=None, th_factories=None,
+            hedge_delay=None, hedge_percentile=None):
         if lifetime is None and max_attempts is None:
             raise ValueError("At least one of lifetime or max_attempts must be specified for a Resolver instance.")
 
@@ -114,6 +130,17 @@ class Resolver:
         self._transport_manager = transport_manager
         self._th_factories = th_factories
 
+        # if hedge_delay is specified, then each query is also sent to a
+        # second server if no valid response has been received from the first
+        # after hedge_delay seconds (or, with hedge_percentile, after the
+        # given percentile of recent response times, once enough are known),
+        # and the first valid response is used.
+        self._hedge_delay = hedge_delay
+        self._hedge_percentile = hedge_percentile
+        self._response_times = collections.deque(maxlen=self.HEDGE_SAMPLES)
+        self._hedge_stats = { 'queries': 0, 'hedged': 0, 'hedge_wins': 0 }
+        self._hedge_lock = threading.Lock()
+
     @classmethod
     def from_file(cls, resolv_conf, query_cls, **kwargs):
         servers = []
@@ -169,6 +196,37 @@ class Resolver:
 
         return answers
 
+    def _get_hedge_delay(self):
+        with self._hedge_lock:
+            if self._hedge_percentile is None or len(self._response_times) < self._response_times.maxlen // 5:
+                return self._hedge_delay
+            response_times = sorted(self._response_times)
+        index = min(int(len(response_times) * self._hedge_percentile), len(response_times) - 1)
+        return response_times[index]
+
+    def hedge_stats(self):
+        with self._hedge_lock:
+            d = OrderedDict((
+                ('queries', self._hedge_stats['queries']),
+                ('hedged', self._hedge_stats['hedged']),
+                ('hedge_wins', self._hedge_stats['hedge_wins']),
+            ))
+        d['delay'] = self._get_hedge_delay()
+        return d
+
+    def _record_hedge_result(self, qs, hedged):
+        with self._hedge_lock:
+            self._hedge_stats['queries'] += 1
+            if hedged:
+                self._hedge_stats['hedged'] += 1
+            for i, q in enumerate(qs):
+                for client_response in q.responses.values():
+                    for response in client_response.values():
+                        if response.is_complete_response() and response.is_valid_response():
+                            self._response_times.append(response.response_time)
+                            if i > 0:
+                                self._hedge_stats['hedge_wins'] += 1
+
     def query_multiple(self, *query_tuples, **kwargs):
         valid_servers = {}
         responses = {}
@@ -189,11 +247,33 @@ class Resolver:
         else:
             servers = self._servers
 
+        if self._hedge_delay is not None:
+            hedge_delay = self._get_hedge_delay()
+        else:
+            hedge_delay = None
+
+        def _next_query(query_tuple, now, exclude):
+            while True:
+                cycle_num, server_index = divmod(attempts[query_tuple], len(servers))
+                # if we've exceeded our maximum attempts, then there is none
+                if cycle_num >= self._max_attempts:
+                    return None
+
+                server = servers[server_index]
+                attempts[query_tuple] += 1
+                if server in valid_servers[query_tuple] and server not in exclude:
+                    if self._lifetime is not None:
+                        timeout = min(self._timeout, max((start + self._lifetime) - now, 0))
+                    else:
+                        timeout = self._timeout
+                    return self._query_cls(query_tuple[0], query_tuple[1], query_tuple[2], server, None, client_ipv4=self._client_ipv4, client_ipv6=self._client_ipv6, port=self._port, query_timeout=timeout, max_attempts=1)
+
         tuples_to_query = query_tuples.difference(last_responses)
         start = time.time()
         while tuples_to_query and (self._lifetime is None or time.time() - start < self._lifetime):
             now = time.time()
             queries = {}
+            hedge_groups = []
             for query_tuple in tuples_to_query:
                 if not valid_servers[query_tuple]:
                     try:
@@ -202,61 +282,71 @@ class Resolver:
                         last_responses[query_tuple] = None, None
                     continue
 
-                while query_tuple not in queries:
-                    cycle_num, server_index = divmod(attempts[query_tuple], len(servers))
-                    # if we've exceeded our maximum attempts, then break out
-                    if cycle_num >= self._max_attempts:
-                        try:
-                            last_responses[query_tuple] = responses[query_tuple]
-                        except KeyError:
-                            last_responses[query_tuple] = None, None
-                        break
-
-                    server = servers[server_index]
-                    if server in valid_servers[query_tuple]:
-                        if self._lifetime is not None:
-                            timeout = min(self._timeout, max((start + self._lifetime) - now, 0))
-                        else:
-                            timeout = self._timeout
-                        q = self._query_cls(query_tuple[0], query_tuple[1], query_tuple[2], server, None, client_ipv4=self._client_ipv4, client_ipv6=self._client_ipv6, port=self._port, query_timeout=timeout, max_attempts=1)
-                        queries[query_tuple] = q
-
-                    attempts[query_tuple] += 1
-
-            query.ExecutableDNSQuery.execute_queries(*list(queries.values()), tm=self._transport_manager, th_factories=self._th_factories)
-
-            for query_tuple, q in queries.items():
-                # no response means we didn't even try because we don't have
-                # proper connectivity
-                if not q.responses:
-                    server = list(q.servers)[0]
-                    valid_servers[query_tuple].remove(server)
-                    if not valid_servers[query_tuple]:
-                        last_responses[query_tuple] = server, None
+                q = _next_query(query_tuple, now, ())
+                if q is None:
+                    try:
+                        last_responses[query_tuple] = responses[query_tuple]
+                    except KeyError:
+                        last_responses[query_tuple] = None, None
                     continue
+                queries[query_tuple] = [q]
+
+                # hedge the query with one to another server
+                if hedge_delay is not None and len(valid_servers[query_tuple]) > 1:
+                    q1 = _next_query(query_tuple, now, q.servers)
+                    if q1 is not None:
+                        queries[query_tuple].append(q1)
+                        hedge_groups.append(queries[query_tuple])
+
+            all_queries = [q for qs in queries.values() for q in qs]
+            sent_queries = set()
+            query.ExecutableDNSQuery.execute_queries(*all_queries, tm=self._transport_manager, th_factories=self._th_factories, hedge_groups=hedge_groups, hedge_delay=hedge_delay, sent_queries=sent_queries)
+
+            for query_tuple, qs in queries.items():
+                if self._hedge_delay is not None:
+                    # a query is hedged only if the hedge was actually sent,
+                    # rather than abandoned first
+                    self._record_hedge_result(qs, any(q in sent_queries for q in qs[1:]))
+
+                # consider valid responses first, so a hedged query that was
+                # abandoned (and has no response) doesn't invalidate its
+                # server
+                qs.sort(key=lambda x: not [r for cr in x.responses.values() for r in cr.values() if r.is_complete_response() and r.is_valid_response()])
+                for q in qs:
+                    if query_tuple in last_responses:
+                        break
 
-                server, client_response = list(q.responses.items())[0]
-                client, response = list(client_response.items())[0]
-                responses[query_tuple] = (server, response)
-                # if we received a complete message with an acceptable rcode,
-                # then accept it as the last response
-                if response.is_complete_response() and response.is_valid_response():
-                    last_responses[query_tuple] = responses[query_tuple]
-                # if we received a message that was incomplete (i.e.,
-                # truncated), had an invalid rcode, was malformed, or was
-                # otherwise invalid, then accept the response (if directed),
-                # and invalidate the server
-                elif response.message is not None or \
-                        response.error not in (query.RESPONSE_ERROR_TIMEOUT, query.RESPONSE_ERROR_NETWORK_ERROR):
-                    # accept_first_response is true, then accept the response
-                    if accept_first_response:
+                    # no response means we didn't even try because we don't
+                    # have proper connectivity
+                    if not q.responses:
+                        server = list(q.servers)[0]
+                        valid_servers[query_tuple].discard(server)
+                        if not valid_servers[query_tuple]:
+                            last_responses[query_tuple] = server, None
+                        continue
+
+                    server, client_response = list(q.responses.items())[0]
+                    client, response = list(client_response.items())[0]
+                    responses[query_tuple] = (server, response)
+                    # if we received a complete message with an acceptable rcode,
+                    # then accept it as the last response
+                    if response.is_complete_response() and response.is_valid_response():
                         last_responses[query_tuple] = responses[query_tuple]
-                    # if the response was SERVFAIL, and we were not directed to
-                    # continue, then accept the response
-                    elif response.message is not None and \
-                            response.message.rcode() == dns.rcode.SERVFAIL and not continue_on_servfail:
-                        last_responses[query_tuple] = responses[query_tuple]
-                    valid_servers[query_tuple].remove(server)
+                    # if we received a message that was incomplete (i.e.,
+                    # truncated), had an invalid rcode, was malformed, or was
+                    # otherwise invalid, then accept the response (if directed),
+                    # and invalidate the server
+                    elif response.message is not None or \
+                            response.error not in (query.RESPONSE_ERROR_TIMEOUT, query.RESPONSE_ERROR_NETWORK_ERROR):
+                        # accept_first_response is true, then accept the response
+                        if accept_first_response:
+                            last_responses[query_tuple] = responses[query_tuple]
+                        # if the response was SERVFAIL, and we were not directed to
+                        # continue, then accept the response
+                        elif response.message is not None and \
+                                response.message.rcode() == dns.rcode.SERVFAIL and not continue_on_servfail:
+                            last_responses[query_tuple] = responses[query_tuple]
+                        valid_servers[query_tuple].discard(server)
 
             tuples_to_query = query_tuples.difference(last_responses)
 
@@ -273,9 +363,555 @@ class CacheEntry:
         self.rcode = rcode
         self.soa_rrset = soa_rrset
 
+    def serialize(self, key):
+        name, rdtype = key
+        d = OrderedDict((
+            ('name', lb2s(name.canonicalize().to_text())),
+            ('type', dns.rdatatype.to_text(rdtype)),
+            ('rcode', dns.rcode.to_text(self.rcode)),
+            ('source', self.source),
+            ('expiration', self.expiration),
+        ))
+        if self.rrset is not None:
+            d['rdata'] = [lb2s(rdata.to_text()) for rdata in self.rrset]
+        if self.soa_rrset is not None:
+            d['soa_name'] = lb2s(self.soa_rrset.name.canonicalize().to_text())
+            d['soa_rdata'] = lb2s(self.soa_rrset[0].to_text())
+        return d
+
+    @classmethod
+    def deserialize(cls, d):
+        name = dns.name.from_text(d['name'])
+        rdtype = dns.rdatatype.from_text(d['type'])
+        ttl = max(0, int(d['expiration'] - time.time()))
+        if 'rdata' in d:
+            rrset = dns.rrset.from_text_list(name, ttl, dns.rdataclass.IN, rdtype, d['rdata'])
+        else:
+            rrset = None
+        if 'soa_name' in d:
+            soa_rrset = dns.rrset.from_text_list(dns.name.from_text(d['soa_name']), ttl, dns.rdataclass.IN, dns.rdatatype.SOA, [d['soa_rdata']])
+        else:
+            soa_rrset = None
+        return (name, rdtype), cls(rrset, d['source'], d['expiration'], dns.rcode.from_text(d['rcode']), soa_rrset)
+
+class SharedResolverCache(object):
+    '''A store of resolver cache entries that can be shared by FullResolver
+    instances in different processes, e.g., as an object served by a
+    multiprocessing manager.  Before resolving a name, a FullResolver claims
+    its lookup with claim(), which also returns the entries it needs from the
+    store, and afterwards it releases the claim with release(), which adds the
+    entries it has cached in the meantime.  A resolver claiming a lookup
+    already claimed by another process waits (up to claim_timeout seconds)
+    for the other to release it, so that the names common to all lookups,
+    such as the root and top-level domains, are resolved only once.  Each
+    claim records its claimant, a (pid, thread ident) tuple; a claimant never
+    waits on a claim held by its own process, which coordinates its own
+    lookups, and a claimant that already holds a claim doesn't wait at all,
+    so that nested lookups in different processes can't wait on each other.
+    If max_entries is specified, then the least recently used entries beyond
+    that number are evicted.'''
+
+    def __init__(self, max_entries=None, claim_timeout=5.0):
+        self._max_entries = max_entries
+        self._claim_timeout = claim_timeout
+        self._cache = OrderedDict()
+        self._expirations = []
+        self._claims = {}
+        self._lock = threading.Lock()
+        self._claim_released = threading.Condition(self._lock)
+        self._stats = { 'hits': 0, 'misses': 0, 'puts': 0, 'evictions': 0, 'claims': 0, 'claim_waits': 0, 'synthesized': 0 }
+
+    def _expire(self, t):
+        while self._expirations and self._expirations[0][0] <= t:
+            expiration, key = heapq.heappop(self._expirations)
+            if key in self._cache and self._cache[key].expiration == expiration:
+                del self._cache[key]
+
+    def _get(self, key):
+        try:
+            entry = self._cache.pop(key)
+        except KeyError:
+            return None
+        # move the entry to the most recently used position
+        self._cache[key] = entry
+        return entry
+
+    def _put(self, key, entry):
+        try:
+            old_entry = self._cache[key]
+        except KeyError:
+            pass
+        else:
+            if entry.source >= old_entry.source:
+                return False
+        self._cache.pop(key, None)
+        self._cache[key] = entry
+        heapq.heappush(self._expirations, (entry.expiration, key))
+        self._stats['puts'] += 1
+
+        # evict the least recently used entries; their items in
+        # _expirations are discarded when they reach the top of the heap
+        if self._max_entries is not None:
+            while len(self._cache) > self._max_entries:
+                self._cache.popitem(last=False)
+                self._stats['evictions'] += 1
+        return True
+
+    def _get_claimant(self, key, t):
+        # a claim older than the timeout is considered abandoned, e.g., by a
+        # process that has exited
+        try:
+            claim_time, claimant = self._claims[key]
+        except KeyError:
+            return None
+        if claim_time + self._claim_timeout <= t:
+            return None
+        return claimant
+
+    def get(self, key):
+        t = time.time()
+        with self._lock:
+            self._expire(t)
+            entry = self._get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+            else:
+                self._stats['hits'] += 1
+            return entry
+
+    def put(self, key, entry):
+        t = time.time()
+        with self._lock:
+            self._expire(t)
+            return self._put(key, entry)
+
+    def claim(self, key, keys=(), claimant=(None, None), wait=True):
+        '''Claim the lookup of key on behalf of claimant, a (pid, thread
+        ident) tuple.  If key is not in the store, but a resolver in another
+        process has claimed it, first wait for that claim to be released (or
+        for claim_timeout seconds), unless wait is False (i.e., because the
+        claimant already holds a claim).  Return a tuple of (claimed,
+        entries), in which claimed is True if the lookup was claimed, in which
+        case it must be released with release(), and entries is a dictionary
+        of the entries for key and keys that are in the store.'''
+
+        t = time.time()
+        with self._lock:
+            self._expire(t)
+            other = self._get_claimant(key, t)
+            if key not in self._cache and other is not None and wait and other[0] != claimant[0]:
+                self._stats['claim_waits'] += 1
+                deadline = t + self._claim_timeout
+                while self._get_claimant(key, t) is not None and t < deadline:
+                    self._claim_released.wait(deadline - t)
+                    t = time.time()
+                self._expire(t)
+
+            entries = {}
+            for k in (key,) + tuple(keys):
+                entry = self._get(k)
+                if entry is not None:
+                    entries[k] = entry
+
+            # only lookups of the claimed key are counted as hits or misses;
+            # the other keys are mostly those of ancestors that are not zones
+            if key in entries:
+                self._stats['hits'] += 1
+                claimed = False
+            else:
+                self._stats['misses'] += 1
+                # if the lookup is still claimed (e.g., the wait timed out, or
+                # the claim is held by this process), then proceed without
+                # the claim
+                claimed = self._get_claimant(key, t) is None
+                if claimed:
+                    self._claims[key] = (t, claimant)
+                    self._stats['claims'] += 1
+            return claimed, entries
+
+    def release(self, key, entries=(), synthesized=0, claimant=(None, None)):
+        '''Add entries, a list of (key, entry) tuples, to the store, and
+        release the claim on key by claimant, if key is not None and the
+        claim is still held by claimant.  synthesized is the number of
+        negative answers synthesized by the resolver since its last release,
+        which is added to the statistics.'''
+
+        t = time.time()
+        with self._lock:
+            self._expire(t)
+            for k, entry in entries:
+                self._put(k, entry)
+            self._stats['synthesized'] += synthesized
+            if key is not None and key in self._claims and self._claims[key][1] == claimant:
+                del self._claims[key]
+                self._claim_released.notify_all()
+
+    def snapshot(self):
+        '''Return the unexpired entries, serialized.'''
+
+        t = time.time()
+        with self._lock:
+            return [entry.serialize(key) for key, entry in self._cache.items() if entry.expiration > t]
+
+    def load(self, snapshot):
+        '''Add the unexpired entries from a snapshot.'''
+
+        t = time.time()
+        for d in snapshot:
+            if d['expiration'] > t:
+                self.put(*CacheEntry.deserialize(d))
+
+    def stats(self):
+        with self._lock:
+            d = OrderedDict((
+                ('entries', len(self._cache)),
+                ('max_entries', self._max_entries),
+                ('hits', self._stats['hits']),
+                ('misses', self._stats['misses']),
+                ('puts', self._stats['puts']),
+                ('evictions', self._stats['evictions']),
+                ('claims', self._stats['claims']),
+                ('claim_waits', self._stats['claim_waits']),
+                ('synthesized', self._stats['synthesized']),
+            ))
+        lookups = d['hits'] + d['misses']
+        if lookups:
+            d['hit_rate'] = round(float(d['hits'])/lookups, 3)
+        else:
+            d['hit_rate'] = None
+        return d
+
+INFRA_STATUS_OK = 0
+INFRA_STATUS_LAME = 1
+INFRA_STATUS_UNRESPONSIVE = 2
+INFRA_STATUS_ERROR = 3
+
+def infrastructure_status(q, response):
+    '''Classify the response from a server to query q, for the purposes of the
+    infrastructure cache.  Return a tuple of (status, edns), where status is
+    one of the INFRA_STATUS_* values (or None, if the response says nothing
+    about the server), and edns is True or False, according to whether the
+    server supports EDNS (or None, if unknown).
+
+    A server is only considered lame for the zone if it refuses the query or
+    answers it non-authoritatively, without a referral.  Other error codes
+    (e.g., SERVFAIL) might be specific to the name queried, so they show only
+    that the server is responsive (INFRA_STATUS_ERROR).'''
+
+    if response.error == query.RESPONSE_ERROR_TIMEOUT:
+        return INFRA_STATUS_UNRESPONSIVE, None
+    if response.message is None or not response.is_complete_response():
+        return None, None
+
+    if q.edns >= 0 and response.effective_edns is not None:
+        edns = response.effective_edns >= 0 and response.message.edns >= 0
+    else:
+        edns = None
+
+    if response.message.rcode() == dns.rcode.REFUSED:
+        return INFRA_STATUS_LAME, edns
+    if not response.is_valid_response():
+        return INFRA_STATUS_ERROR, edns
+    if response.is_authoritative() or response.is_referral(q.qname, q.rdtype, q.bailiwick):
+        return INFRA_STATUS_OK, edns
+    return INFRA_STATUS_LAME, edns
+
+class InfrastructureCache(object):
+    '''A cache of what is known about the servers queried: whether they are
+    unresponsive, whether they are lame for a given zone, and whether they
+    support EDNS.  A server is considered unresponsive only after max_timeouts
+    consecutive queries to it have timed out.  Entries expire after ttl
+    seconds, after which servers are given another chance.  Like
+    SharedResolverCache, an instance can be shared by resolvers and analysts,
+    including across processes.'''
+
+    def __init__(self, ttl=900, max_timeouts=3):
+        self.ttl = ttl
+        self.max_timeouts = max_timeouts
+        self._timeouts = {}
+        self._unresponsive = {}
+        self._lame = {}
+        self._edns = {}
+        self._lock = threading.Lock()
+
+    def _is_current(self, d, key, t):
+        try:
+            expiration = d[key]
+        except KeyError:
+            return False
+        if expiration <= t:
+            del d[key]
+            return False
+        return True
+
+    def record(self, server, zone, status, edns=None):
+        '''Record the status of server (one of the INFRA_STATUS_* values), as
+        observed in a query for a name in zone.'''
+
+        t = time.time()
+        with self._lock:
+            if status == INFRA_STATUS_UNRESPONSIVE:
+                timeouts = self._timeouts.get(server, 0) + 1
+                if timeouts >= self.max_timeouts:
+                    self._unresponsive[server] = t + self.ttl
+                    self._timeouts.pop(server, None)
+                else:
+                    self._timeouts[server] = timeouts
+            elif status is not None:
+                self._timeouts.pop(server, None)
+                self._unresponsive.pop(server, None)
+                if status == INFRA_STATUS_LAME:
+                    self._lame[(server, zone)] = t + self.ttl
+                elif status == INFRA_STATUS_OK:
+                    self._lame.pop((server, zone), None)
+            if edns is not None:
+                self._edns[server] = (edns, t + self.ttl)
+
+    def partition(self, servers, zone):
+        '''Partition servers into those not known to be bad, those lame for
+        zone, and those unresponsive, returning the three lists.'''
+
+        good = []
+        lame = []
+        unresponsive = []
+        t = time.time()
+        with self._lock:
+            for server in servers:
+                if self._is_current(self._unresponsive, server, t):
+                    unresponsive.append(server)
+                elif self._is_current(self._lame, (server, zone), t):
+                    lame.append(server)
+                else:
+                    good.append(server)
+        return good, lame, unresponsive
+
+    def serialize(self):
+        t = time.time()
+        with self._lock:
+            return OrderedDict((
+                ('unresponsive', sorted([s for s in self._unresponsive if self._unresponsive[s] > t])),
+                ('lame', sorted(['%s %s' % (s, lb2s(z.canonicalize().to_text())) for (s, z) in self._lame if self._lame[(s, z)] > t])),
+                ('no_edns', sorted([s for s in self._edns if not self._edns[s][0] and self._edns[s][1] > t])),
+            ))
+
+class _NegativeZone(object):
+    '''The NSEC or NSEC3 RRs cached for a zone, with the SOA RR returned with
+    them.'''
+
+    def __init__(self, zone, soa_rrset, use_nsec3):
+        self.zone = zone
+        self.soa_rrset = soa_rrset
+        self.use_nsec3 = use_nsec3
+        self.rrsets = {}
+        self.expirations = {}
+        self.next_expiration = None
+        self._nsec_set = None
+        self._names = None
+
+    def add(self, rrset, expiration):
+        self.rrsets[rrset.name] = rrset
+        self.expirations[rrset.name] = expiration
+        if self.next_expiration is None or expiration < self.next_expiration:
+            self.next_expiration = expiration
+        self._nsec_set = None
+        self._names = None
+
+    def expire(self, t):
+        if self.next_expiration is None or self.next_expiration > t:
+            return
+        for name in [n for n in self.expirations if self.expirations[n] <= t]:
+            del self.rrsets[name]
+            del self.expirations[name]
+        if self.expirations:
+            self.next_expiration = min(self.expirations.values())
+        else:
+            self.next_expiration = None
+        self._nsec_set = None
+        self._names = None
+
+    def nsec_set(self):
+        if self._nsec_set is None:
+            self._nsec_set = Response.NSECSet(list(self.rrsets.values()), False, False)
+            self._names = sorted(self.rrsets)
+        return self._nsec_set
+
+    def covering(self, name):
+        '''Return the owner name of the NSEC(3) RR that covers name, or None
+        if there is none.  Only the RR with the closest preceding owner name
+        (in canonical order) needs to be checked.'''
+
+        nsec_set = self.nsec_set()
+        if not self._names:
+            return None
+        nsec_name = self._names[bisect.bisect_right(self._names, name) - 1]
+        if nsec_set._nsec_covers_name(name, nsec_name):
+            return nsec_name
+        return None
+
+class AggressiveNegativeCache(object):
+    '''A cache of the NSEC and NSEC3 RRs returned in authoritative, signed
+    negative responses, from which NXDOMAIN and NODATA answers are
+    synthesized for other names in the same zone (RFC 8198).'''
+
+    def __init__(self):
+        self._zones = {}
+        self._lock = threading.Lock()
+        self.synthesized = 0
+
+    def add(self, soa_rrset, authority, max_ttl=None):
+        '''Add the signed NSEC or NSEC3 RRsets from the authority section of a
+        negative response, whose SOA RRset is soa_rrset.'''
+
+        signed = set([(x.name, x.covers) for x in authority if x.rdtype == dns.rdatatype.RRSIG])
+        nsec_rrsets = [x for x in authority if x.rdtype in (dns.rdatatype.NSEC, dns.rdatatype.NSEC3) and \
+                (x.name, x.rdtype) in signed and x.name.is_subdomain(soa_rrset.name)]
+        if not nsec_rrsets:
+            return
+
+        t = time.time()
+        zone = soa_rrset.name
+        use_nsec3 = nsec_rrsets[0].rdtype == dns.rdatatype.NSEC3
+        with self._lock:
+            z = self._zones.get(zone)
+            if z is None or z.use_nsec3 != use_nsec3:
+                z = self._zones[zone] = _NegativeZone(zone, soa_rrset, use_nsec3)
+            z.soa_rrset = soa_rrset
+            for rrset in nsec_rrsets:
+                if (rrset.rdtype == dns.rdatatype.NSEC3) != use_nsec3:
+                    continue
+                ttl = min(rrset.ttl, soa_rrset.ttl, soa_rrset[0].minimum)
+                if max_ttl is not None and ttl > max_ttl:
+                    ttl = max_ttl
+                z.add(rrset, t + ttl)
+
+    def _find_zone(self, qname, t):
+        name = qname
+        while True:
+            z = self._zones.get(name)
+            if z is not None:
+                z.expire(t)
+                if not z.rrsets:
+                    del self._zones[name]
+                else:
+                    return z
+            try:
+                name = name.parent()
+            except dns.name.NoParent:
+                return None
+
+    def _nodata(self, nsec_set, nsec_name, rdtype):
+        if nsec_set.rdtype_exists_in_bitmap(nsec_name, rdtype) or \
+                nsec_set.rdtype_exists_in_bitmap(nsec_name, dns.rdatatype.CNAME):
+            return False
+        is_apex = nsec_set.rdtype_exists_in_bitmap(nsec_name, dns.rdatatype.SOA)
+        is_delegation = nsec_set.rdtype_exists_in_bitmap(nsec_name, dns.rdatatype.NS) and not is_apex
+        # at a zone cut, the parent only proves the absence of DS, and the
+        # child cannot
+        if rdtype == dns.rdatatype.DS:
+            return not is_apex
+        return not is_delegation
+
+    def _lookup_nsec(self, z, qname, rdtype):
+        nsec_set = z.nsec_set()
+        if qname in nsec_set.rrsets:
+            if self._nodata(nsec_set, qname, rdtype):
+                return dns.rcode.NOERROR
+            return None
+
+        nsec_name = z.covering(qname)
+        if nsec_name is None:
+            return None
+        # an NSEC RR at a delegation point or DNAME says nothing about the
+        # names below it
+        if qname.is_subdomain(nsec_name) and \
+                (nsec_set.rdtype_exists_in_bitmap(nsec_name, dns.rdatatype.DNAME) or \
+                (nsec_set.rdtype_exists_in_bitmap(nsec_name, dns.rdatatype.NS) and \
+                not nsec_set.rdtype_exists_in_bitmap(nsec_name, dns.rdatatype.SOA))):
+            return None
+
+        # the closest encloser is the longest ancestor shared with either end
+        # of the NSEC RR, and no wildcard may exist beneath it
+        next_name = nsec_set.rrsets[nsec_name].rrset[0].next
+        nlabels = max(qname.fullcompare(nsec_name)[2], qname.fullcompare(next_name)[2])
+        closest_encloser = dns.name.Name(qname.labels[-nlabels:])
+        if not closest_encloser.is_subdomain(z.zone):
+            return None
+        wildcard = dns.name.Name((b'*',) + closest_encloser.labels)
+        if wildcard in nsec_set.rrsets or z.covering(wildcard) is None:
+            return None
+        return dns.rcode.NXDOMAIN
+
+    def _lookup_nsec3(self, z, qname, rdtype):
+        nsec_set = z.nsec_set()
+        for salt, alg, iterations in nsec_set.nsec3_params:
+            digest_name = nsec_set.get_digest_name_for_nsec3(qname, z.zone, salt, alg, iterations)
+            if digest_name is None:
+                continue
+            if digest_name in nsec_set.rrsets:
+                if self._nodata(nsec_set, digest_name, rdtype):
+                    return dns.rcode.NOERROR
+                return None
+            if qname == z.zone:
+                return None
+
+            # find the closest encloser, then prove that neither the next
+            # closer name nor the wildcard beneath the closest encloser exist
+            # (RFC 5155, section 8.4)
+            next_closer = qname
+            closest_encloser = qname.parent()
+            while closest_encloser.is_subdomain(z.zone):
+                digest_name = nsec_set.get_digest_name_for_nsec3(closest_encloser, z.zone, salt, alg, iterations)
+                if digest_name in nsec_set.rrsets:
+                    break
+                next_closer = closest_encloser
+                closest_encloser = closest_encloser.parent()
+            else:
+                continue
+            if not nsec_set.check_closest_encloser(closest_encloser, digest_name, z.zone):
+                continue
+
+            nsec_name = z.covering(nsec_set.get_digest_name_for_nsec3(next_closer, z.zone, salt, alg, iterations))
+            # with opt-out, an insecure delegation might exist for the name
+            if nsec_name is None or nsec_set.rrsets[nsec_name].rrset[0].flags & 0x01:
+                continue
+            wildcard = dns.name.Name((b'*',) + closest_encloser.labels)
+            digest_name = nsec_set.get_digest_name_for_nsec3(wildcard, z.zone, salt, alg, iterations)
+            if digest_name in nsec_set.rrsets or z.covering(digest_name) is None:
+                continue
+            return dns.rcode.NXDOMAIN
+        return None
+
+    def lookup(self, qname, rdtype):
+        '''Return a tuple of (rcode, soa_rrset) for a negative response to
+        qname/rdtype, synthesized from the cached NSEC or NSEC3 RRs, or None
+        if they don't prove one.'''
+
+        with self._lock:
+            z = self._find_zone(qname, time.time())
+            if z is None:
+                return None
+            if z.use_nsec3:
+                rcode = self._lookup_nsec3(z, qname, rdtype)
+            else:
+                rcode = self._lookup_nsec(z, qname, rdtype)
+            if rcode is None:
+                return None
+            self.synthesized += 1
+            return rcode, z.soa_rrset
+
 class ServFail(Exception):
     pass
 
+class _InFlightLookup(object):
+    '''A lookup being resolved by one thread, on which other threads
+    resolving the same lookup can wait.'''
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
 class FullResolver:
     '''A full iterative DNS resolver, following hints.'''
 
@@ -291,10 +927,12 @@ class FullResolver:
 
     MIN_TTL = 60
     MAX_CHAIN = 20
+    MAX_CONCURRENT_QUERIES = 8
+    MAX_UNRESPONSIVE_RETRIES = 3
 
     default_th_factory = transport.DNSQueryTransportHandlerDNSFactory()
 
-    def __init__(self, hints=util.get_root_hints(), query_cls=(query.QuickDNSSECQuery, query.RobustDNSSECQuery), client_ipv4=None, client_ipv6=None, odd_ports=None, transport_manager=None, th_factories=None, max_ttl=None):
+    def __init__(self, hints=util.get_root_hints(), query_cls=(query.QuickDNSSECQuery, query.RobustDNSSECQuery), client_ipv4=None, client_ipv6=None, odd_ports=None, transport_manager=None, th_factories=None, max_ttl=None, max_cache_entries=None, shared_cache=None, infra_cache=None, aggressive_negative=False):
 
         self._hints = hints
         self._query_cls = query_cls
@@ -313,9 +951,34 @@ class FullResolver:
 
         self._max_ttl = max_ttl
 
-        self._cache = {}
+        self._max_cache_entries = max_cache_entries
+        self._shared_cache = shared_cache
+        if infra_cache is None:
+            infra_cache = InfrastructureCache()
+        self.infra_cache = infra_cache
+        if aggressive_negative:
+            self._negative_cache = AggressiveNegativeCache()
+        else:
+            self._negative_cache = None
+
+        # entries are kept in order of use (least recently used first), and
+        # their expirations in a heap
+        self._cache = OrderedDict()
         self._expirations = []
         self._cache_lock = threading.Lock()
+        self._cache_stats = { 'hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0 }
+        self._unlocked_hits = 0
+
+        # entries to be added to the shared cache, and the number of
+        # synthesized answers already reported to it
+        self._shared_pending = []
+        self._shared_synthesized = 0
+        # the number of claims on the shared cache held by each thread
+        self._claims_held = threading.local()
+
+        self._inflight = {}
+        self._inflight_waiting = {}
+        self._inflight_lock = threading.Lock()
 
     def _allow_server(self, server):
         if not self.allow_loopback_query and (LOOPBACK_IPV4_RE.search(server) is not None or server == LOOPBACK_IPV6):
@@ -328,21 +991,38 @@ class FullResolver:
 
     def flush_cache(self):
         with self._cache_lock:
-            self._cache = {}
+            self._cache = OrderedDict()
             self._expirations = []
 
+    def _remove_cache_entry(self, key):
+        # the corresponding item in _expirations is left in place, and is
+        # discarded when it reaches the top of the heap
+        del self._cache[key]
+        if len(self._expirations) > 2 * len(self._cache) + 64:
+            self._expirations = [(exp, k) for (exp, k) in self._expirations if k in self._cache and self._cache[k].expiration == exp]
+            heapq.heapify(self._expirations)
+
     def expire_cache(self):
         t = time.time()
 
-        with self._cache_lock:
-            if self._expirations and self._expirations[0][0] > t:
+        # check without the lock first, since this is called for every query
+        try:
+            if self._expirations[0][0] > t:
                 return
+        except IndexError:
+            return
 
-            future_index = bisect.bisect_right(self._expirations, (t, None))
-            for i in range(future_index):
-                cache_key = self._expirations[i][1]
-                del self._cache[cache_key]
-            self._expirations = self._expirations[future_index:]
+        with self._cache_lock:
+            while self._expirations and self._expirations[0][0] <= t:
+                expiration, key = heapq.heappop(self._expirations)
+                try:
+                    entry = self._cache[key]
+                except KeyError:
+                    continue
+                # the entry might have been replaced since this item was added
+                if entry.expiration == expiration:
+                    del self._cache[key]
+                    self._cache_stats['expirations'] += 1
 
     def cache_put(self, name, rdtype, rrset, source, rcode, soa_rrset, ttl):
         t = time.time()
@@ -364,6 +1044,13 @@ class FullResolver:
         key = (name, rdtype)
         new_entry = CacheEntry(rrset, source, expiration, rcode, soa_rrset)
 
+        # entries are added to the shared cache when the lookup that cached
+        # them is released, to save a round trip for each entry
+        if self._cache_insert(key, new_entry) and self._shared_cache is not None:
+            with self._cache_lock:
+                self._shared_pending.append((key, new_entry))
+
+    def _cache_insert(self, key, new_entry):
         with self._cache_lock:
             try:
                 old_entry = self._cache[key]
@@ -371,39 +1058,117 @@ class FullResolver:
                 pass
             else:
                 if new_entry.source >= old_entry.source:
-                    return
-
-                # remove the old entry from expirations
-                old_index = bisect.bisect_left(self._expirations, (old_entry.expiration, key))
-                old_key = self._expirations.pop(old_index)[1]
-                assert old_key == key, "Old key doesn't match new key!"
+                    return False
+                self._remove_cache_entry(key)
 
             self._cache[key] = new_entry
-            bisect.insort(self._expirations, (expiration, key))
+            heapq.heappush(self._expirations, (new_entry.expiration, key))
 
-    def cache_get(self, name, rdtype):
-        try:
-            entry = self._cache[(name, rdtype)]
-        except KeyError:
-            return None
+            # evict the least recently used entries
+            if self._max_cache_entries is not None:
+                while len(self._cache) > self._max_cache_entries:
+                    self._remove_cache_entry(next(iter(self._cache)))
+                    self._cache_stats['evictions'] += 1
+        return True
+
+    def cache_get(self, name, rdtype, shared=True):
+        '''Return the cache entry for name and rdtype, or None if there is
+        none.  If shared is True, then the shared cache (if any) is consulted
+        when the entry is not in the cache.'''
+
+        key = (name, rdtype)
+
+        # a hit in an unbounded cache needs no lock, as there is no order of
+        # use to maintain; the hit is counted in a separate variable, as the
+        # increment is not synchronized (so the count is approximate)
+        entry = self._cache.get(key)
+        if entry is not None and self._max_cache_entries is None:
+            self._unlocked_hits += 1
         else:
-            t = time.time()
-            ttl = max(0, int(entry.expiration - t))
+            with self._cache_lock:
+                try:
+                    # move the entry to the most recently used position
+                    entry = self._cache.pop(key)
+                except KeyError:
+                    entry = None
+                else:
+                    self._cache[key] = entry
+                    self._cache_stats['hits'] += 1
+
+        if entry is None:
+            if self._shared_cache is not None and shared:
+                entry = self._shared_cache.get(key)
+            if entry is None:
+                with self._cache_lock:
+                    self._cache_stats['misses'] += 1
+                return None
+            self._cache_insert(key, entry)
+            with self._cache_lock:
+                self._cache_stats['shared_hits'] += 1
 
-            if entry.rrset is not None:
-                entry.rrset.update_ttl(ttl)
-            if entry.soa_rrset is not None:
-                entry.soa_rrset.update_ttl(ttl)
+        t = time.time()
+        ttl = max(0, int(entry.expiration - t))
 
-            return entry
+        if entry.rrset is not None:
+            entry.rrset.update_ttl(ttl)
+        if entry.soa_rrset is not None:
+            entry.soa_rrset.update_ttl(ttl)
+
+        return entry
+
+    def cache_stats(self):
+        with self._cache_lock:
+            d = OrderedDict((
+                ('entries', len(self._cache)),
+                ('max_entries', self._max_cache_entries),
+            ))
+            for stat in ('hits', 'shared_hits', 'misses', 'evictions', 'expirations'):
+                d[stat] = self._cache_stats[stat]
+            d['hits'] += self._unlocked_hits
+        if self._negative_cache is not None:
+            d['synthesized'] = self._negative_cache.synthesized
+        return d
+
+    def cache_snapshot(self):
+        '''Return the unexpired entries in the cache, serialized, for use
+        with load_cache_snapshot(), e.g., in a later run.'''
+
+        t = time.time()
+        with self._cache_lock:
+            items = list(self._cache.items())
+        return [entry.serialize(key) for key, entry in items if entry.expiration > t]
+
+    def load_cache_snapshot(self, snapshot):
+        '''Add the unexpired entries from a cache snapshot to the cache.'''
+
+        t = time.time()
+        for d in snapshot:
+            if d['expiration'] > t:
+                self._cache_insert(*CacheEntry.deserialize(d))
 
     def cache_dump(self):
-        keys = self._cache.keys()
-        keys.sort()
+        '''Return the cache statistics and the contents of the cache, sorted
+        by name and type.'''
 
         t = time.time()
-        for key in keys:
-            entry = self._cache[key]
+        with self._cache_lock:
+            items = sorted(self._cache.items(), key=lambda x: x[0])
+
+        entries = []
+        for (name, rdtype), entry in items:
+            entries.append(OrderedDict((
+                ('name', lb2s(name.canonicalize().to_text())),
+                ('type', dns.rdatatype.to_text(rdtype)),
+                ('rcode', dns.rcode.to_text(entry.rcode)),
+                ('source', entry.source),
+                ('ttl', max(0, int(entry.expiration - t))),
+                ('rdata', [lb2s(rdata.to_text()) for rdata in entry.rrset] if entry.rrset is not None else []),
+            )))
+
+        d = OrderedDict()
+        d['stats'] = self.cache_stats()
+        d['entries'] = entries
+        return d
 
     def query(self, qname, rdtype, rdclass=dns.rdataclass.IN):
         msg = dns.message.make_response(dns.message.make_query(qname, rdtype), True)
@@ -419,8 +1184,7 @@ class FullResolver:
                     new_rrset.update(rrset)
         return msg, None
 
-    def query_for_answer(self, qname, rdtype, rdclass=dns.rdataclass.IN, allow_noanswer=False):
-        response, server = self.query(qname, rdtype, rdclass)
+    def _answer_from_response(self, qname, rdtype, response, server, allow_noanswer):
         if response.rcode() == dns.rcode.SERVFAIL:
             raise dns.resolver.NoNameservers()
         if allow_noanswer:
@@ -429,23 +1193,217 @@ class FullResolver:
             answer_cls = DNSAnswer
         return answer_cls(qname, rdtype, response, server)
 
+    def query_for_answer(self, qname, rdtype, rdclass=dns.rdataclass.IN, allow_noanswer=False):
+        response, server = self.query(qname, rdtype, rdclass)
+        return self._answer_from_response(qname, rdtype, response, server, allow_noanswer)
+
     def query_multiple_for_answer(self, *query_tuples, **kwargs):
         allow_noanswer = kwargs.pop('allow_noanswer', False)
+        responses = self.query_multiple(*query_tuples)
         answers = {}
-        for query_tuple in query_tuples:
+        for query_tuple, (response, server) in responses.items():
             try:
-                answers[query_tuple] = self.query_for_answer(query_tuple[0], query_tuple[1], query_tuple[2], allow_noanswer=allow_noanswer)
+                answers[query_tuple] = self._answer_from_response(query_tuple[0], query_tuple[1], response, server, allow_noanswer)
             except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN, dns.resolver.NoNameservers) as e:
                 answers[query_tuple] = e
         return answers
 
+    def _query_multiple_worker(self, query_tuples, responses, errors):
+        while True:
+            try:
+                query_tuple = query_tuples.pop()
+            except IndexError:
+                return
+            try:
+                responses[query_tuple] = self.query(query_tuple[0], query_tuple[1], query_tuple[2])
+            except:
+                errors.append((query_tuple, sys.exc_info()))
+
     def query_multiple(self, *query_tuples, **kwargs):
+        '''Resolve the query tuples concurrently, using up to
+        MAX_CONCURRENT_QUERIES threads, including the calling thread.  The
+        threads share both the cache and the table of in-flight lookups.'''
+
         responses = {}
-        for query_tuple in query_tuples:
-            responses[query_tuple] = self.query(query_tuple[0], query_tuple[1], query_tuple[2])
+        errors = []
+        remaining = list(set(query_tuples))
+
+        threads = []
+        for i in range(min(len(remaining), self.MAX_CONCURRENT_QUERIES) - 1):
+            t = threading.Thread(target=self._query_multiple_worker, args=(remaining, responses, errors))
+            t.start()
+            threads.append(t)
+        self._query_multiple_worker(remaining, responses, errors)
+        for t in threads:
+            t.join()
+
+        if errors:
+            raise errors[0][1][1]
         return responses
 
+    def _waits_on(self, thread, other):
+        '''Return True if thread is other or is (transitively) waiting on a
+        lookup owned by other.  The caller must hold _inflight_lock.'''
+
+        seen = set()
+        while thread is not None and thread not in seen:
+            if thread is other:
+                return True
+            seen.add(thread)
+            try:
+                key = self._inflight_waiting[thread]
+            except KeyError:
+                return False
+            try:
+                thread = self._inflight[key].owner
+            except KeyError:
+                return False
+        return False
+
     def _query(self, qname, rdtype, rdclass, level, max_source, starting_domain=None):
+        '''Resolve the query, or, if another thread is already resolving the
+        same query, wait for its result.'''
+
+        key = (qname, rdtype, rdclass, max_source, starting_domain)
+        me = threading.current_thread()
+
+        with self._inflight_lock:
+            try:
+                lookup = self._inflight[key]
+            except KeyError:
+                lookup = self._inflight[key] = _InFlightLookup(me)
+                wait = False
+            else:
+                # if the owner of the lookup is waiting (directly or
+                # indirectly) on this thread, waiting would deadlock, so
+                # resolve independently.
+                if self._waits_on(lookup.owner, me):
+                    lookup = None
+                    wait = False
+                else:
+                    self._inflight_waiting[me] = key
+                    wait = True
+
+        if lookup is None:
+            return self._query_shared(qname, rdtype, rdclass, level, max_source, starting_domain)
+
+        if wait:
+            lookup.done.wait()
+            with self._inflight_lock:
+                del self._inflight_waiting[me]
+            if lookup.error is not None:
+                raise lookup.error
+            return lookup.result[:]
+
+        try:
+            lookup.result = self._query_shared(qname, rdtype, rdclass, level, max_source, starting_domain)
+            return lookup.result[:]
+        except Exception as e:
+            lookup.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            lookup.done.set()
+
+    def _query_shared(self, qname, rdtype, rdclass, level, max_source, starting_domain=None):
+        '''Resolve the query, coordinating with the other resolvers using the
+        shared cache, if any.  The lookup is claimed in the shared cache,
+        which returns the entries that _query_proper() consults for qname and
+        its ancestors, and it is released afterwards, along with the entries
+        cached in the meantime.  A thread that already holds a claim (i.e.,
+        for a lookup in which this one is nested) doesn't wait on the claims
+        of others.'''
+
+        if self._shared_cache is None:
+            return self._query_proper(qname, rdtype, rdclass, level, max_source, starting_domain)
+
+        key = (qname, rdtype)
+        claimant = (os.getpid(), threading.current_thread().ident)
+        held = getattr(self._claims_held, 'count', 0)
+        claimed = False
+        entry = self._cache.get(key)
+        if (entry is None or entry.source > max_source) and key not in self._hints and \
+                self._cache.get((qname, dns.rdatatype.CNAME)) is None:
+            keys = [(qname, dns.rdatatype.CNAME)]
+            name = qname
+            while True:
+                keys.append((name, dns.rdatatype.NS))
+                keys.append((name, dns.rdatatype.DNAME))
+                try:
+                    name = name.parent()
+                except dns.name.NoParent:
+                    break
+            keys = [k for k in keys if k not in self._cache]
+            claimed, entries = self._shared_cache.claim(key, keys, claimant, not held)
+            if claimed:
+                self._claims_held.count = held + 1
+            for k in entries:
+                self._cache_insert(k, entries[k])
+            if key in entries:
+                with self._cache_lock:
+                    self._cache_stats['shared_hits'] += 1
+
+        try:
+            return self._query_proper(qname, rdtype, rdclass, level, max_source, starting_domain)
+        finally:
+            if claimed:
+                self._claims_held.count = held
+            with self._cache_lock:
+                pending = self._shared_pending
+                self._shared_pending = []
+                synthesized = 0
+                if self._negative_cache is not None:
+                    synthesized = self._negative_cache.synthesized - self._shared_synthesized
+                    self._shared_synthesized += synthesized
+            if claimed or pending or synthesized:
+                self._shared_cache.release(key if claimed else None, pending, synthesized, claimant)
+
+    def _servers_for_zone(self, ns_names, ns_name_order, bailiwick, level):
+        '''Yield the servers to query for the names in ns_name_order, looking
+        up the addresses of each name, as needed.  Servers known by the
+        infrastructure cache to be lame for bailiwick are deferred until the
+        others have been tried, and of those known to be unresponsive, at most
+        MAX_UNRESPONSIVE_RETRIES are tried, and only as a last resort.'''
+
+        deferred_lame = []
+        deferred_unresponsive = []
+        for ns_name in ns_name_order:
+            if ns_names[ns_name] is None:
+                # first get the addresses associated with each name
+                ns_names[ns_name] = set()
+                for a_rdtype in dns.rdatatype.A, dns.rdatatype.AAAA:
+                    if ns_name.is_subdomain(bailiwick):
+                        if bailiwick == dns.name.root:
+                            sd = bailiwick
+                        else:
+                            sd = bailiwick.parent()
+                    else:
+                        sd = None
+                    try:
+                        a_rrset = self._query(ns_name, a_rdtype, dns.rdataclass.IN, level + 1, self.SRC_ADDITIONAL, starting_domain=sd)[-2]
+                    except ServFail:
+                        a_rrset = None
+                    if a_rrset is not None:
+                        for rdata in a_rrset:
+                            ns_names[ns_name].add(IPAddr(rdata.address))
+
+            # server disallowed by policy
+            servers = [s for s in ns_names[ns_name] if self._allow_server(s)]
+
+            good, lame, unresponsive = self.infra_cache.partition(servers, bailiwick)
+            deferred_lame.extend(lame)
+            deferred_unresponsive.extend(unresponsive)
+            for server in good:
+                yield server
+
+        for server in deferred_lame:
+            yield server
+        random.shuffle(deferred_unresponsive)
+        for server in deferred_unresponsive[:self.MAX_UNRESPONSIVE_RETRIES]:
+            yield server
+
+    def _query_proper(self, qname, rdtype, rdclass, level, max_source, starting_domain=None):
         self.expire_cache()
 
         # check for max chain length
@@ -453,7 +1411,7 @@ class FullResolver:
             raise ServFail('SERVFAIL - resolution chain too long')
 
         # first check cache for answer
-        entry = self.cache_get(qname, rdtype)
+        entry = self.cache_get(qname, rdtype, False)
         if entry is not None and entry.source <= max_source:
             return [entry.rrset, entry.rcode]
 
@@ -462,10 +1420,18 @@ class FullResolver:
             return [self._hints[(qname, rdtype)], dns.rcode.NOERROR]
 
         # next check cache for alias
-        entry = self.cache_get(qname, dns.rdatatype.CNAME)
+        entry = self.cache_get(qname, dns.rdatatype.CNAME, False)
         if entry is not None and entry.rrset is not None:
             return [entry.rrset] + self._query(entry.rrset[0].target, rdtype, rdclass, level + 1, max_source)
 
+        # synthesize a negative answer from cached NSEC/NSEC3 RRs, if enabled
+        if self._negative_cache is not None and self.SRC_AUTH_ANS <= max_source:
+            negative = self._negative_cache.lookup(qname, rdtype)
+            if negative is not None:
+                rcode, soa_rrset = negative
+                self.cache_put(qname, rdtype, None, self.SRC_AUTH_ANS, rcode, soa_rrset, None)
+                return [None, rcode]
+
         # now check for closest enclosing NS, DNAME, or hint
         closest_zone = qname
 
@@ -482,13 +1448,13 @@ class FullResolver:
         while True:
             # if we are a proper superdomain, then look for DNAME
             if closest_zone != qname:
-                entry = self.cache_get(closest_zone, dns.rdatatype.DNAME)
+                entry = self.cache_get(closest_zone, dns.rdatatype.DNAME, False)
                 if entry is not None and entry.rrset is not None:
                     cname_rrset = Response.cname_from_dname(qname, entry.rrset)
                     return [entry.rrset, cname_rrset] + self._query(cname_rrset[0].target, rdtype, rdclass, level + 1, max_source)
 
             # look for NS records in cache
-            entry = self.cache_get(closest_zone, dns.rdatatype.NS)
+            entry = self.cache_get(closest_zone, dns.rdatatype.NS, False)
             if entry is not None:
                 if entry.rrset is not None:
                     ns_rrset = entry.rrset
@@ -534,83 +1500,102 @@ class FullResolver:
 
             for query_cls in self._query_cls:
                 # query each server until we get a match
-                for ns_name in all_ns_names:
+                is_referral = False
+                for server in self._servers_for_zone(ns_names, all_ns_names, bailiwick, level):
+                    q = query_cls(qname, rdtype, rdclass, (server,), bailiwick, self._client_ipv4, self._client_ipv6, self._odd_ports.get((bailiwick, server), 53))
+                    q.execute(tm=self._transport_manager, th_factories=self._th_factories)
                     is_referral = False
-                    if ns_names[ns_name] is None:
-                        # first get the addresses associated with each name
-                        ns_names[ns_name] = set()
-                        for a_rdtype in dns.rdatatype.A, dns.rdatatype.AAAA:
-                            if ns_name.is_subdomain(bailiwick):
-                                if bailiwick == dns.name.root:
-                                    sd = bailiwick
-                                else:
-                                    sd = bailiwick.parent()
-                            else:
-                                sd = None
-                            try:
-                                a_rrset = self._query(ns_name, a_rdtype, dns.rdataclass.IN, level + 1, self.SRC_ADDITIONAL, starting_domain=sd)[-2]
-                            except ServFail:
-                                a_rrset = None
-                            if a_rrset is not None:
-                                for rdata in a_rrset:
-                                    ns_names[ns_name].add(IPAddr(rdata.address))
-
-                    for server in ns_names[ns_name]:
-                        # server disallowed by policy
-                        if not self._allow_server(server):
-                            continue
-
-                        q = query_cls(qname, rdtype, rdclass, (server,), bailiwick, self._client_ipv4, self._client_ipv6, self._odd_ports.get((bailiwick, server), 53))
-                        q.execute(tm=self._transport_manager, th_factories=self._th_factories)
-                        is_referral = False
-
-                        if not q.responses:
-                            # No network connectivity
-                            continue
-
-                        server1, client_response = list(q.responses.items())[0]
-                        client, response = list(client_response.items())[0]
-
-                        if response.is_valid_response() and response.is_complete_response():
-                            soa_rrset = None
-                            rcode = response.message.rcode()
-
-                            # response is acceptable
+
+                    if not q.responses:
+                        # No network connectivity
+                        continue
+
+                    server1, client_response = list(q.responses.items())[0]
+                    client, response = list(client_response.items())[0]
+
+                    status, edns = infrastructure_status(q, response)
+                    self.infra_cache.record(server, bailiwick, status, edns)
+
+                    if response.is_valid_response() and response.is_complete_response():
+                        soa_rrset = None
+                        rcode = response.message.rcode()
+
+                        # response is acceptable
+                        try:
+                            # first check for exact match
+                            ret = [[x for x in response.message.answer if x.name == qname and x.rdtype == rdtype and x.rdclass == rdclass][0]]
+                        except IndexError:
                             try:
-                                # first check for exact match
-                                ret = [[x for x in response.message.answer if x.name == qname and x.rdtype == rdtype and x.rdclass == rdclass][0]]
+                                # now look for DNAME
+                                dname_rrset = [x for x in response.message.answer if qname.is_subdomain(x.name) and qname != x.name and x.rdtype == dns.rdatatype.DNAME and x.rdclass == rdclass][0]
                             except IndexError:
                                 try:
-                                    # now look for DNAME
-                                    dname_rrset = [x for x in response.message.answer if qname.is_subdomain(x.name) and qname != x.name and x.rdtype == dns.rdatatype.DNAME and x.rdclass == rdclass][0]
+                                    # now look for CNAME
+                                    cname_rrset = [x for x in response.message.answer if x.name == qname and x.rdtype == dns.rdatatype.CNAME and x.rdclass == rdclass][0]
                                 except IndexError:
+                                    ret = [None]
+                                    # no answer
                                     try:
-                                        # now look for CNAME
-                                        cname_rrset = [x for x in response.message.answer if x.name == qname and x.rdtype == dns.rdatatype.CNAME and x.rdclass == rdclass][0]
+                                        soa_rrset = [x for x in response.message.authority if qname.is_subdomain(x.name) and x.rdtype == dns.rdatatype.SOA][0]
                                     except IndexError:
-                                        ret = [None]
-                                        # no answer
+                                        pass
+                                # cache the NS RRset
+                                else:
+                                    cname_rrset = [x for x in response.message.answer if x.name == qname and x.rdtype == dns.rdatatype.CNAME and x.rdclass == rdclass][0]
+                                    ret = [cname_rrset]
+                            else:
+                                # handle DNAME: return the DNAME, CNAME and (recursively) its chain
+                                cname_rrset = Response.cname_from_dname(qname, dname_rrset)
+                                ret = [dname_rrset, cname_rrset]
+
+                        if response.is_referral(qname, rdtype, bailiwick):
+                            is_referral = True
+                            a_rrsets = {}
+                            min_ttl = None
+                            ret = None
+
+                            # if response is referral, then we follow it
+                            ns_rrset = [x for x in response.message.authority if qname.is_subdomain(x.name) and x.rdtype == dns.rdatatype.NS][0]
+                            ns_names = response.ns_ip_mapping_from_additional(ns_rrset.name, bailiwick)
+                            for ns_name in ns_names:
+                                if not ns_names[ns_name]:
+                                    ns_names[ns_name] = None
+                                else: # name is in bailiwick
+                                    for a_rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
                                         try:
-                                            soa_rrset = [x for x in response.message.authority if qname.is_subdomain(x.name) and x.rdtype == dns.rdatatype.SOA][0]
-                                        except IndexError:
+                                            a_rrsets[a_rdtype] = response.message.find_rrset(response.message.additional, ns_name, a_rdtype, dns.rdataclass.IN)
+                                        except KeyError:
                                             pass
-                                    # cache the NS RRset
-                                    else:
-                                        cname_rrset = [x for x in response.message.answer if x.name == qname and x.rdtype == dns.rdatatype.CNAME and x.rdclass == rdclass][0]
-                                        ret = [cname_rrset]
-                                else:
-                                    # handle DNAME: return the DNAME, CNAME and (recursively) its chain
-                                    cname_rrset = Response.cname_from_dname(qname, dname_rrset)
-                                    ret = [dname_rrset, cname_rrset]
-
-                            if response.is_referral(qname, rdtype, bailiwick):
-                                is_referral = True
-                                a_rrsets = {}
-                                min_ttl = None
-                                ret = None
-
-                                # if response is referral, then we follow it
-                                ns_rrset = [x for x in response.message.authority if qname.is_subdomain(x.name) and x.rdtype == dns.rdatatype.NS][0]
+                                        else:
+                                            if min_ttl is None or a_rrsets[a_rdtype].ttl < min_ttl:
+                                                min_ttl = a_rrsets[a_rdtype].ttl
+
+                                    for a_rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+                                        if a_rdtype in a_rrsets:
+                                            a_rrsets[a_rdtype].update_ttl(min_ttl)
+                                            self.cache_put(ns_name, a_rdtype, a_rrsets[a_rdtype], self.SRC_ADDITIONAL, dns.rcode.NOERROR, None, None)
+                                        else:
+                                            self.cache_put(ns_name, a_rdtype, None, self.SRC_ADDITIONAL, dns.rcode.NOERROR, None, min_ttl)
+
+                            if min_ttl is not None:
+                                ns_rrset.update_ttl(min_ttl)
+
+                            # cache the NS RRset
+                            self.cache_put(ns_rrset.name, dns.rdatatype.NS, ns_rrset, self.SRC_NONAUTH_AUTH, rcode, None, None)
+                            break
+
+                        elif response.is_authoritative():
+                            terminal = True
+                            a_rrsets = {}
+                            min_ttl = None
+
+                            # if response is authoritative (and not a referral), then we return it
+                            try:
+                                ns_rrset = [x for x in  response.message.answer + response.message.authority if qname.is_subdomain(x.name) and x.rdtype == dns.rdatatype.NS][0]
+                            except IndexError:
+                                pass
+                            else:
+
                                 ns_names = response.ns_ip_mapping_from_additional(ns_rrset.name, bailiwick)
                                 for ns_name in ns_names:
                                     if not ns_names[ns_name]:
@@ -635,66 +1620,24 @@ class FullResolver:
                                 if min_ttl is not None:
                                     ns_rrset.update_ttl(min_ttl)
 
-                                # cache the NS RRset
-                                self.cache_put(ns_rrset.name, dns.rdatatype.NS, ns_rrset, self.SRC_NONAUTH_AUTH, rcode, None, None)
-                                break
-
-                            elif response.is_authoritative():
-                                terminal = True
-                                a_rrsets = {}
-                                min_ttl = None
-
-                                # if response is authoritative (and not a referral), then we return it
-                                try:
-                                    ns_rrset = [x for x in  response.message.answer + response.message.authority if qname.is_subdomain(x.name) and x.rdtype == dns.rdatatype.NS][0]
-                                except IndexError:
-                                    pass
-                                else:
-
-                                    ns_names = response.ns_ip_mapping_from_additional(ns_rrset.name, bailiwick)
-                                    for ns_name in ns_names:
-                                        if not ns_names[ns_name]:
-                                            ns_names[ns_name] = None
-                                        else: # name is in bailiwick
-                                            for a_rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
-                                                try:
-                                                    a_rrsets[a_rdtype] = response.message.find_rrset(response.message.additional, ns_name, a_rdtype, dns.rdataclass.IN)
-                                                except KeyError:
-                                                    pass
-                                                else:
-                                                    if min_ttl is None or a_rrsets[a_rdtype].ttl < min_ttl:
-                                                        min_ttl = a_rrsets[a_rdtype].ttl
-
-                                            for a_rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
-                                                if a_rdtype in a_rrsets:
-                                                    a_rrsets[a_rdtype].update_ttl(min_ttl)
-                                                    self.cache_put(ns_name, a_rdtype, a_rrsets[a_rdtype], self.SRC_ADDITIONAL, dns.rcode.NOERROR, None, None)
-                                                else:
-                                                    self.cache_put(ns_name, a_rdtype, None, self.SRC_ADDITIONAL, dns.rcode.NOERROR, None, min_ttl)
-
-                                    if min_ttl is not None:
-                                        ns_rrset.update_ttl(min_ttl)
-
-                                    self.cache_put(ns_rrset.name, dns.rdatatype.NS, ns_rrset, self.SRC_AUTH_AUTH, rcode, None, None)
-
-                                if ret[-1] == None:
-                                    self.cache_put(qname, rdtype, None, self.SRC_AUTH_ANS, rcode, soa_rrset, None)
+                                self.cache_put(ns_rrset.name, dns.rdatatype.NS, ns_rrset, self.SRC_AUTH_AUTH, rcode, None, None)
 
-                                else:
-                                    for rrset in ret:
-                                        self.cache_put(rrset.name, rrset.rdtype, rrset, self.SRC_AUTH_ANS, rcode, None, None)
+                            if ret[-1] == None:
+                                self.cache_put(qname, rdtype, None, self.SRC_AUTH_ANS, rcode, soa_rrset, None)
+                                if self._negative_cache is not None and soa_rrset is not None:
+                                    self._negative_cache.add(soa_rrset, response.message.authority, self._max_ttl)
 
-                                    if ret[-1].rdtype == dns.rdatatype.CNAME:
-                                        ret += self._query(ret[-1][0].target, rdtype, rdclass, level + 1, self.SRC_NONAUTH_ANS)
-                                        terminal = False
+                            else:
+                                for rrset in ret:
+                                    self.cache_put(rrset.name, rrset.rdtype, rrset, self.SRC_AUTH_ANS, rcode, None, None)
 
-                                if terminal:
-                                    ret.append(rcode)
-                                return ret
+                                if ret[-1].rdtype == dns.rdatatype.CNAME:
+                                    ret += self._query(ret[-1][0].target, rdtype, rdclass, level + 1, self.SRC_NONAUTH_ANS)
+                                    terminal = False
 
-                    # if referral, then break
-                    if is_referral:
-                        break
+                            if terminal:
+                                ret.append(rcode)
+                            return ret
 
                 # if referral, then break
                 if is_referral:
@@ -27,6 +27,7 @@
 
 from __future__ import unicode_literals
 
+import array
 import base64
 import errno
 import cgi
@@ -37,6 +38,7 @@ import io
 import logging
 import socket
 import struct
+import threading
 import time
 
 # minimal support for python2.6
@@ -54,9 +56,13 @@ from .ipaddr import IPAddr
 from .util import tuple_to_dict
 lb2s = fmt.latin1_binary_to_string
 
-class DNSResponse:
+class DNSResponse(object):
     '''A DNS response, including meta information'''
 
+    __slots__ = ('message', 'msg_size', 'error', 'errno', 'history', 'response_time', 'query',
+            'effective_flags', 'effective_edns', 'effective_edns_max_udp_payload', 'effective_edns_flags', 'effective_edns_options', 'effective_tcp',
+            'udp_attempted', 'udp_responsive', 'tcp_attempted', 'tcp_responsive', 'responsive_cause_index', 'responsive_cause_index_tcp')
+
     def __init__(self, message, msg_size, error, errno1, history, response_time, query, review_history=True):
         self.message = message
         self.msg_size = msg_size
@@ -79,6 +85,7 @@ class DNSResponse:
         self.tcp_attempted = None
         self.tcp_responsive = None
         self.responsive_cause_index = None
+        self.responsive_cause_index_tcp = None
 
         if review_history:
             self._review_history()
@@ -592,9 +599,115 @@ class DNSResponse:
             history.append(Q.DNSQueryRetryAttempt.deserialize(retry))
         return DNSResponse(message, msg_size, error, errno1, history, response_time, query)
 
+_server_client_index = {}
+_server_client_list = []
+_server_client_lock = threading.Lock()
+
+def _intern_server_client(server_client):
+    try:
+        return _server_client_index[server_client]
+    except KeyError:
+        with _server_client_lock:
+            if server_client not in _server_client_index:
+                _server_client_index[server_client] = len(_server_client_list)
+                _server_client_list.append(server_client)
+            return _server_client_index[server_client]
+
+class ServerClientMap(object):
+    '''A compact mapping of (server, client) to the list of responses from
+    that server/client pair.  Each (server, client) tuple is interned
+    process-wide, and the map itself holds only an array of indexes into the
+    interned list and a parallel list of response lists.'''
+
+    __slots__ = ('_indexes', '_responses')
+
+    def __init__(self, items=None):
+        self._indexes = array.array(str('i'))
+        self._responses = []
+        if items is not None:
+            self.update(items)
+
+    def __reduce__(self):
+        # the interned indexes are only meaningful within a process, so
+        # pickle the (server, client) tuples themselves
+        return (self.__class__, (list(self.items()),))
+
+    def _find(self, server_client):
+        try:
+            index = _server_client_index[server_client]
+        except KeyError:
+            return -1
+        try:
+            return self._indexes.index(index)
+        except ValueError:
+            return -1
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def __iter__(self):
+        for i in self._indexes:
+            yield _server_client_list[i]
+
+    def __contains__(self, server_client):
+        return self._find(server_client) >= 0
+
+    def __getitem__(self, server_client):
+        i = self._find(server_client)
+        if i < 0:
+            raise KeyError(server_client)
+        return self._responses[i]
+
+    def __setitem__(self, server_client, responses):
+        i = self._find(server_client)
+        if i < 0:
+            self._indexes.append(_intern_server_client(server_client))
+            self._responses.append(responses)
+        else:
+            self._responses[i] = responses
+
+    def __delitem__(self, server_client):
+        i = self._find(server_client)
+        if i < 0:
+            raise KeyError(server_client)
+        del self._indexes[i]
+        del self._responses[i]
+
+    def __repr__(self):
+        return '<%s: %d>' % (self.__class__.__name__, len(self))
+
+    def get(self, server_client, default=None):
+        try:
+            return self[server_client]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return self._responses[:]
+
+    def items(self):
+        return list(zip(self, self._responses))
+
+    def update(self, other):
+        if hasattr(other, 'items'):
+            other = other.items()
+        for server_client, responses in other:
+            self[server_client] = responses
+
+    def copy(self):
+        obj = self.__class__()
+        obj._indexes = self._indexes[:]
+        obj._responses = self._responses[:]
+        return obj
+
 class DNSResponseComponent(object):
+    __slots__ = ('servers_clients',)
+
     def __init__(self):
-        self.servers_clients = {}
+        self.servers_clients = ServerClientMap()
 
     def add_server_client(self, server, client, response):
         if (server, client) not in self.servers_clients:
@@ -612,6 +725,8 @@ class DNSResponseComponent(object):
         return component_info
 
 class RDataMeta(DNSResponseComponent):
+    __slots__ = ('name', 'ttl', 'rdtype', 'rdata', 'rrset_info')
+
     def __init__(self, name, ttl, rdtype, rdata):
         super(RDataMeta, self).__init__()
         self.name = name
@@ -828,6 +943,8 @@ class RdataWrapper(object):
         return self._rdata.to_digestable() < other._rdata.to_digestable()
 
 class RRsetInfo(DNSResponseComponent):
+    __slots__ = ('rrset', 'ttl_cmp', 'rrsig_info', 'wildcard_info', 'dname_info', 'cname_info_from_dname')
+
     def __init__(self, rrset, ttl_cmp, dname_info=None):
         super(RRsetInfo, self).__init__()
         self.rrset = rrset
@@ -989,6 +1106,8 @@ def cname_from_dname(name, dname_rrset):
     return rrset
 
 class NegativeResponseInfo(DNSResponseComponent):
+    __slots__ = ('qname', 'rdtype', 'ttl_cmp', 'soa_rrset_info', 'nsec_set_info')
+
     def __init__(self, qname, rdtype, ttl_cmp):
         super(NegativeResponseInfo, self).__init__()
         self.qname = qname
@@ -1065,7 +1184,7 @@ class NSECSet(DNSResponseComponent):
                 if not self.is_valid_nsec3_hash(rrset[0].next, rrset[0].algorithm):
                     self.invalid_nsec3_hash.add(rrset.name)
 
-        self.servers_clients = {}
+        self.servers_clients = ServerClientMap()
 
     def __repr__(self):
         return '<%s>' % (self.__class__.__name__)
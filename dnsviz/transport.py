@@ -24,6 +24,7 @@ from __future__ import unicode_literals
 import base64
 import bisect
 import codecs
+import collections
 import errno
 import fcntl
 import io
@@ -1508,9 +1509,122 @@ class DNSQueryTransportHandlerHTTPPrivate(DNSQueryTransportHandlerHTTP):
     allow_loopback_query = True
     allow_private_query = True
 
+class AddressFamilyHealth(object):
+    '''Track the responsiveness of servers by address family, so that a
+    family for which there is no working connectivity (e.g., IPv6 packets
+    are silently dropped) can be detected early and avoided for the
+    remainder of a run.
+
+    A family is considered blackholed when, among its window most recent
+    queries, at least max_unresponsive distinct servers failed to respond,
+    and the fraction of queries answered is less than min_response_ratio.
+    Because only recent queries are considered, connectivity lost midway
+    through a run is detected, and a family that is avoided is cleared once
+    it answers again (its servers are still queried when there are no
+    others).'''
+
+    def __init__(self, max_unresponsive=4, window=64, min_response_ratio=0.1):
+        self.max_unresponsive = max_unresponsive
+        self.min_response_ratio = min_response_ratio
+        self._lock = threading.Lock()
+        self._recent = { 4: collections.deque(maxlen=window), 6: collections.deque(maxlen=window) }
+        self._blackholed = { 4: False, 6: False }
+        self._responses = { 4: 0, 6: 0 }
+        self._timeouts = { 4: 0, 6: 0 }
+
+    def _update(self, version):
+        # call with self._lock held
+        recent = self._recent[version]
+        unresponsive = set([server for server, responsive in recent if not responsive])
+        responses = len([server for server, responsive in recent if responsive])
+        self._blackholed[version] = len(unresponsive) >= self.max_unresponsive and \
+                responses < self.min_response_ratio * len(recent)
+
+    def record(self, server, responsive):
+        '''Record whether or not server responded to a query.'''
+
+        self.record_batch([(server, responsive)])
+
+    def record_batch(self, results):
+        '''Record a list of (server, responsive) tuples, and return the
+        verdicts that follow, as a dictionary mapping each address family (4
+        or 6) to whether it is blackholed.'''
+
+        with self._lock:
+            versions = set()
+            for server, responsive in results:
+                self._recent[server.version].append((server, responsive))
+                if responsive:
+                    self._responses[server.version] += 1
+                else:
+                    self._timeouts[server.version] += 1
+                versions.add(server.version)
+            for version in versions:
+                self._update(version)
+            return dict(self._blackholed)
+
+    def is_blackholed(self, version):
+        '''Return True if the given address family appears to be blackholed.'''
+
+        return self._blackholed[version]
+
+    def serialize(self):
+        d = OrderedDict()
+        for version in (4, 6):
+            with self._lock:
+                d['ipv%d' % version] = OrderedDict((
+                    ('responses', self._responses[version]),
+                    ('timeouts', self._timeouts[version]),
+                    ('blackholed', self._blackholed[version]),
+                ))
+        return d
+
+class CachedAddressFamilyHealth(object):
+    '''A per-process front end to an AddressFamilyHealth served by a
+    multiprocessing manager, so that each query costs no round trip to the
+    manager.  Results are recorded in batches, at most interval seconds (or
+    batch_size results) apart, and the verdicts returned with each batch are
+    used until the next one.'''
+
+    def __init__(self, health, interval=1.0, batch_size=64):
+        self._health = health
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._results = []
+        self._blackholed = { 4: False, 6: False }
+        self._last_sync = 0
+
+    def sync(self):
+        with self._lock:
+            results = self._results
+            self._results = []
+            self._last_sync = time.time()
+        blackholed = self._health.record_batch(results)
+        with self._lock:
+            self._blackholed = blackholed
+
+    def record(self, server, responsive):
+        with self._lock:
+            self._results.append((server, responsive))
+            sync = len(self._results) >= self.batch_size or \
+                    time.time() - self._last_sync >= self.interval
+        if sync:
+            self.sync()
+
+    def is_blackholed(self, version):
+        if time.time() - self._last_sync >= self.interval:
+            self.sync()
+        return self._blackholed[version]
+
+    def serialize(self):
+        self.sync()
+        return self._health.serialize()
+
 class DNSQueryTransportManager:
     def __init__(self):
         self._th = _DNSQueryTransportManager()
+        self.family_health = AddressFamilyHealth()
 
     def __del__(self):
         self.close()
@@ -32,7 +32,7 @@ import os
 import re
 import socket
 
-import dns.message, dns.rdatatype
+import dns.exception, dns.message, dns.name, dns.rdatatype
 
 from .config import DNSVIZ_SHARE_PATH
 from . import format as fmt
@@ -152,3 +152,46 @@ def get_client_address(server):
     except socket.error:
         return None
     return IPAddr(s.getsockname()[0])
+
+def iter_names(name_strs, logger):
+    '''Yield the domain name corresponding to each string in name_strs, as
+    it is consumed, logging and skipping those that are invalid.'''
+
+    for name_str in name_strs:
+        try:
+            name = dns.name.from_text(name_str)
+        except UnicodeDecodeError as e:
+            logger.error('%s: "%s"' % (e, name_str))
+        except dns.exception.DNSException:
+            logger.error('The domain name was invalid: "%s"' % name_str)
+        else:
+            yield name
+
+def iter_names_from_file(f, logger):
+    '''Yield the domain names in f, one per line, as they are read, closing
+    f once they have all been read.'''
+
+    try:
+        for name in iter_names((line.strip() for line in f), logger):
+            yield name
+    finally:
+        f.close()
+
+def iter_analyses(cls, names, analysis_structured, logger, keep_level=1):
+    '''Yield the analysis of each name in names, deserialized from
+    analysis_structured as it is consumed, logging and skipping those not
+    found.  Only the analyses of names at or above keep_level (by default,
+    the root and top-level domains, which are shared by nearly all names) are
+    kept from one name to the next; the others are deserialized again, if
+    needed, so that the analyses held don't grow with the number of names.'''
+
+    cache = {}
+    for name in names:
+        name_str = fmt.latin1_binary_to_string(name.canonicalize().to_text())
+        if name_str not in analysis_structured or analysis_structured[name_str].get('stub', True):
+            logger.error('The analysis of "%s" was not found in the input.' % fmt.latin1_binary_to_string(name.to_text()))
+            continue
+        yield cls.deserialize(name, analysis_structured, cache)
+        for cached_name in list(cache):
+            if len(cached_name) - 1 > keep_level:
+                del cache[cached_name]
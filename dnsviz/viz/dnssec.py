@@ -571,7 +571,7 @@ class DNSAuthGraph:
             img_str = ''
             if zone_obj.zone_errors:
                 img_str = '<IMG SCALE="TRUE" SRC="%s"/>' % ERROR_ICON
-            elif zone_obj.zone_warnings:
+            elif zone_obj.zone_warnings or zone_obj.name_warnings:
                 img_str = '<IMG SCALE="TRUE" SRC="%s"/>' % WARNING_ICON
 
             if zone_obj.analysis_end is not None:
@@ -592,8 +592,8 @@ class DNSAuthGraph:
             zone_serialized['description'] = '%s zone' % (zone_obj)
             if zone_obj.zone_errors:
                 zone_serialized['errors'] = [e.serialize(consolidate_clients=consolidate_clients, html_format=True) for e in zone_obj.zone_errors]
-            if zone_obj.zone_warnings:
-                zone_serialized['warnings'] = [e.serialize(consolidate_clients=consolidate_clients, html_format=True) for e in zone_obj.zone_warnings]
+            if zone_obj.zone_warnings or zone_obj.name_warnings:
+                zone_serialized['warnings'] = [e.serialize(consolidate_clients=consolidate_clients, html_format=True) for e in (zone_obj.name_warnings or []) + zone_obj.zone_warnings]
 
             self.node_info[top_name] = [zone_serialized]
 
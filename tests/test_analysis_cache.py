@@ -0,0 +1,86 @@
+from __future__ import unicode_literals
+
+import datetime
+import time
+import unittest
+
+try:
+    import dns.name
+except ImportError:
+    dns = None
+
+class _Analysis(object):
+    '''A stand-in for a complete analysis whose first record expires ttl
+    seconds from now.'''
+
+    def __init__(self, ttl):
+        self.analysis_end = datetime.datetime.utcnow()
+        self.ttl = ttl
+
+    def get_expiration(self):
+        return time.time() + self.ttl
+
+@unittest.skipIf(dns is None, 'dnspython is required')
+class AnalysisCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.names = [dns.name.from_text('n%d.example.com' % i) for i in range(3)]
+
+    def test_bounded_cache_retention(self):
+        from dnsviz.analysis import BoundedAnalysisCache
+        cache = BoundedAnalysisCache(2)
+        cache[self.names[0]] = _Analysis(0)
+        self.assertTrue(self.names[0] in cache)
+
+        cache = BoundedAnalysisCache(2, min_retention=0)
+        cache[self.names[0]] = _Analysis(0)
+        self.assertFalse(self.names[0] in cache)
+
+    def test_bounded_cache_pin(self):
+        from dnsviz.analysis import BoundedAnalysisCache
+        cache = BoundedAnalysisCache(1, min_retention=0)
+        cache.pin(self.names[0])
+        cache[self.names[0]] = _Analysis(0)
+        cache[self.names[1]] = _Analysis(100)
+        cache[self.names[2]] = _Analysis(100)
+        self.assertTrue(self.names[0] in cache)
+        cache.unpin(self.names[0])
+        self.assertFalse(self.names[0] in cache)
+
+    def test_store_pin(self):
+        from dnsviz.analysis import AnalysisStore
+        store = AnalysisStore(1, min_retention=0)
+        store.pin(self.names[0])
+        store.put(self.names[0], b'', True, time.time() - 1)
+        store.put(self.names[1], b'', True)
+        store.put(self.names[2], b'', True)
+        self.assertIsNotNone(store.state(self.names[0]))
+        self.assertIsNone(store.state(self.names[1]))
+        store.unpin(self.names[0])
+        self.assertIsNone(store.state(self.names[0]))
+
+    def test_shared_cache_local_bound(self):
+        from dnsviz.analysis import AnalysisStore, SharedAnalysisCache
+        from dnsviz.analysis import online
+        max_local = online.DEFAULT_CACHE_MAX_LOCAL
+        online.DEFAULT_CACHE_MAX_LOCAL = 1
+        try:
+            cache = SharedAnalysisCache(AnalysisStore())
+        finally:
+            online.DEFAULT_CACHE_MAX_LOCAL = max_local
+        for name in self.names:
+            cache[name] = _Analysis(100)
+        self.assertEqual(len(cache._local_lru), 1)
+        self.assertEqual(len(cache.keys()), 3)
+
+    def test_shared_cache_setdefault_existing(self):
+        from dnsviz.analysis import AnalysisStore, SharedAnalysisCache
+        cache = SharedAnalysisCache(AnalysisStore())
+        name_obj = _Analysis(100)
+        cache[self.names[0]] = name_obj
+        # an existing analysis is returned without serializing the new one
+        unpicklable = _Analysis(100)
+        unpicklable.f = lambda: None
+        self.assertIs(cache.setdefault(self.names[0], unpicklable), name_obj)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+from __future__ import unicode_literals
+
+import importlib
+import unittest
+
+try:
+    import dns.message
+except ImportError:
+    dns = None
+
+COMMAND_MODULES = ('graph', 'grok', 'lookingglass', 'print', 'probe', 'query')
+
+@unittest.skipIf(dns is None, 'dnspython is required')
+class ImportTestCase(unittest.TestCase):
+    def test_analysis_exports(self):
+        import dnsviz.analysis
+        for name in ('AnalysisStore', 'BoundedAnalysisCache', 'PreviousQueries', 'QueryReuseStats', 'SharedAnalysisCache'):
+            self.assertTrue(hasattr(dnsviz.analysis, name), name)
+
+    def test_import_commands(self):
+        for name in COMMAND_MODULES:
+            importlib.import_module('dnsviz.commands.%s' % name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+import unittest
+
+try:
+    import dns.name
+except ImportError:
+    dns = None
+
+@unittest.skipIf(dns is None, 'dnspython is required')
+class SharedResolverCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.key = (dns.name.from_text('example.com'), 2)
+
+    def test_claim_same_process(self):
+        from dnsviz.resolver import SharedResolverCache
+        cache = SharedResolverCache(claim_timeout=5)
+        self.assertTrue(cache.claim(self.key, (), (1, 1))[0])
+
+        # neither the claimant itself nor another thread in its process waits
+        start = time.time()
+        self.assertFalse(cache.claim(self.key, (), (1, 1))[0])
+        self.assertFalse(cache.claim(self.key, (), (1, 2))[0])
+        self.assertTrue(time.time() - start < 1)
+
+    def test_claim_nested(self):
+        from dnsviz.resolver import SharedResolverCache
+        cache = SharedResolverCache(claim_timeout=5)
+        self.assertTrue(cache.claim(self.key, (), (1, 1))[0])
+
+        # a claimant already holding a claim doesn't wait on another process
+        start = time.time()
+        self.assertFalse(cache.claim(self.key, (), (2, 1), False)[0])
+        self.assertTrue(time.time() - start < 1)
+
+    def test_claim_release(self):
+        from dnsviz.resolver import SharedResolverCache
+        cache = SharedResolverCache(claim_timeout=5)
+        self.assertTrue(cache.claim(self.key, (), (1, 1))[0])
+
+        # only the claimant releases the claim
+        cache.release(self.key, (), 0, (2, 1))
+        t = threading.Timer(0.2, cache.release, (self.key, (), 0, (1, 1)))
+        t.start()
+        start = time.time()
+        self.assertTrue(cache.claim(self.key, (), (2, 1))[0])
+        self.assertTrue(0.1 < time.time() - start < 1)
+        t.join()
+
+if __name__ == '__main__':
+    unittest.main()